@@ -1,13 +1,33 @@
 from .zoho_analytics_connector import analytics_client_upstream
+from .zoho_analytics_connector import async_report_client
+from .zoho_analytics_connector import bulk
+from .zoho_analytics_connector import columnar
+from .zoho_analytics_connector import dataframes
 from .zoho_analytics_connector import enhanced_report_client
+from .zoho_analytics_connector import export_cache
 from .zoho_analytics_connector import report_client
 from .zoho_analytics_connector import typed_dicts
 from .zoho_analytics_connector import model_helpers
+from .zoho_analytics_connector import partitioning
+from .zoho_analytics_connector import quota
+from .zoho_analytics_connector import rate_limit
+from .zoho_analytics_connector import streaming
+from .zoho_analytics_connector import token_store
 
 __all__ = [
     "analytics_client_upstream",
+    "async_report_client",
+    "bulk",
+    "columnar",
+    "dataframes",
     "enhanced_report_client",
+    "export_cache",
     "report_client",
     "typed_dicts",
     "model_helpers",
+    "partitioning",
+    "quota",
+    "rate_limit",
+    "streaming",
+    "token_store",
 ]
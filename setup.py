@@ -16,6 +16,7 @@ setup(
     packages=["zoho_analytics_connector"],
     python_requires=">=3.11",
     install_requires=["requests", "emoji"],
+    extras_require={"async": ["httpx"], "numpy": ["numpy"], "pandas": ["pandas>=2.0"], "arrow": ["pyarrow"]},
     setup_requires=["pytest-runner", "wheel"],  # Removed sphinx from setup_requires
     tests_require=["pytest"],
     classifiers=[
@@ -1,9 +1,16 @@
 # $Id$
 import urllib
 import json
+import os
+import threading
+import uuid
+import zlib
 import requests
+from requests.adapters import HTTPAdapter, Retry
 from requests.auth import HTTPProxyAuth
 
+from .streaming import MultipartFileBody
+
 
 class AnalyticsClient:
     """
@@ -12,8 +19,9 @@ class AnalyticsClient:
 
     CLIENT_VERSION = "2.1.0"
     COMMON_ENCODE_CHAR = "UTF-8"
+    EXPORT_CHUNK_SIZE = 1024 * 1024
 
-    def __init__(self, client_id, client_secret, refresh_token):
+    def __init__(self, client_id, client_secret, refresh_token, pool_maxsize=10, max_retries=3, keep_alive=True):
         """
         Creates a new C{AnalyticsClient} instance.
         @param client_id: User client id for OAUth
@@ -22,6 +30,12 @@ class AnalyticsClient:
         @type client_secret:string
         @param refresh_token: User's refresh token for OAUth).
         @type refresh_token:string
+        @param pool_maxsize: The most connections kept open to each host; match it to the number of threads.
+        @type pool_maxsize:int
+        @param max_retries: Retries of requests whose connection failed.
+        @type max_retries:int
+        @param keep_alive: Keep connections open between requests.
+        @type keep_alive:bool
         """
 
         self.proxy = False
@@ -30,6 +44,13 @@ class AnalyticsClient:
         self.proxy_user_name = None
         self.proxy_password = None
 
+        self.pool_connections = 10
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.keep_alive = keep_alive
+        self.session = None
+        self.session_lock = threading.Lock()
+
         self.accounts_server_url = "https://accounts.zoho.com"
         self.analytics_server_url = "https://analyticsapi.zoho.com"
 
@@ -1522,7 +1543,8 @@ class AnalyticsClient:
             @param auto_identify: Used to specify whether to auto identify the CSV format. Allowable values -
                 true/false.
             @type auto_identify: string
-            @param file_path: Path of the file to be imported.
+            @param file_path: Path of the file to be imported. Can also be a binary file object or an iterable of
+                bytes, such as a generator.
             @type file_path: string
             @param config: Contains any additional control parameters. Can be C{None}.
             @type config:dictionary
@@ -1578,7 +1600,8 @@ class AnalyticsClient:
             @param auto_identify: Used to specify whether to auto identify the CSV format. Allowable values -
                 true/false.
             @type auto_identify: string
-            @param file_path: Path of the file to be imported.
+            @param file_path: Path of the file to be imported. Can also be a binary file object or an iterable of
+                bytes, such as a generator.
             @type file_path: string
             @param config: Contains any additional control parameters. Can be C{None}.
             @type config:dictionary
@@ -1635,7 +1658,8 @@ class AnalyticsClient:
             @param auto_identify: Used to specify whether to auto identify the CSV format. Allowable values -
                 true/false.
             @type auto_identify: string
-            @param file_path: Path of the file to be imported.
+            @param file_path: Path of the file to be imported. Can also be a binary file object or an iterable of
+                bytes, such as a generator.
             @type file_path: string
             @param config: Contains any additional control parameters. Can be C{None}.
             @type config:dictionary
@@ -1652,7 +1676,9 @@ class AnalyticsClient:
             response = self.ac.send_import_api_request(endpoint, config, self.request_headers, file_path)
             return response["data"]["jobId"]
 
-        def import_bulk_data(self, view_id, import_type, file_type, auto_identify, file_path, config={}):
+        def import_bulk_data(
+            self, view_id, import_type, file_type, auto_identify, file_path, config={}, compression=None
+        ):
             """
             Asynchronously import the data contained in the mentioned file into the table.
             @param view_id: Id of the view where the data to be imported.
@@ -1664,10 +1690,13 @@ class AnalyticsClient:
             @param auto_identify: Used to specify whether to auto identify the CSV format. Allowable values -
                 true/false.
             @type auto_identify: string
-            @param file_path: Path of the file to be imported.
+            @param file_path: Path of the file to be imported. Can also be a binary file object or an iterable of
+                bytes, such as a generator.
             @type file_path: string
             @param config: Contains any additional control parameters. Can be C{None}.
             @type config:dictionary
+            @param compression: None, "gzip" or "zip", to compress the file while it is sent.
+            @type compression:string
             @raise ServerError: If the server has received the request but did not process the request due to some
                 error.
             @raise ParseError: If the server has responded but client was not able to parse the response.
@@ -1678,7 +1707,9 @@ class AnalyticsClient:
             config["fileType"] = file_type
             config["autoIdentify"] = auto_identify
             config["importType"] = import_type
-            response = self.ac.send_import_api_request(endpoint, config, self.request_headers, file_path)
+            response = self.ac.send_import_api_request(
+                endpoint, config, self.request_headers, file_path, compression=compression
+            )
             return response["data"]["jobId"]
 
         def get_import_job_details(self, job_id):
@@ -1696,24 +1727,27 @@ class AnalyticsClient:
             response = self.ac.send_api_request("GET", endpoint, None, self.request_headers)
             return response["data"]
 
-        def export_data(self, view_id, response_format, file_path, config={}):
+        def export_data(self, view_id, response_format, file_path, config={}, compress=False):
             """
             Export the mentioned table (or) view data.
             @param view_id: Id of the view to be exported.
             @type view_id: string
             @param response_format: The format in which the data is to be exported.
             @type response_format: string
-            @param file_path: Path of the file where the data exported to be stored.
+            @param file_path: Path of the file where the data exported to be stored. Can also be a binary file object
+                or a function called with each chunk of the data.
             @type file_path: string
             @param config: Contains any additional control parameters. Can be C{None}.
             @type config:dictionary
+            @param compress: Gzip compress the data as it is stored.
+            @type compress:bool
             @raise ServerError: If the server has received the request but did not process the request due to some
                 error.
             @raise ParseError: If the server has responded but client was not able to parse the response.
             """
             endpoint = self.endpoint + "/views/" + view_id + "/data"
             config["responseFormat"] = response_format
-            self.ac.send_export_api_request(endpoint, config, self.request_headers, file_path)
+            self.ac.send_export_api_request(endpoint, config, self.request_headers, file_path, compress)
 
         def initiate_bulk_export(self, view_id, response_format, config={}):
             """
@@ -1771,19 +1805,22 @@ class AnalyticsClient:
             response = self.ac.send_api_request("GET", endpoint, None, self.request_headers)
             return response["data"]
 
-        def export_bulk_data(self, job_id, file_path):
+        def export_bulk_data(self, job_id, file_path, compress=False):
             """
             Download the exported data for the mentioned job id.
             @param job_id: Id of the job to be exported.
             @type job_id: string
-            @param file_path: Path of the file where the data exported to be stored.
+            @param file_path: Path of the file where the data exported to be stored. Can also be a binary file object
+                or a function called with each chunk of the data.
             @type file_path: string
+            @param compress: Gzip compress the data as it is stored.
+            @type compress:bool
             @raise ServerError: If the server has received the request but did not process the request due to some
                 error.
             @raise ParseError: If the server has responded but client was not able to parse the response.
             """
             endpoint = self.bulk_endpoint + "/exportjobs/" + job_id + "/data"
-            self.ac.send_export_api_request(endpoint, None, self.request_headers, file_path)
+            self.ac.send_export_api_request(endpoint, None, self.request_headers, file_path, compress)
 
     def set_proxy(self, proxy_host, proxy_port, proxy_user_name, proxy_password):
         """
@@ -1794,10 +1831,22 @@ class AnalyticsClient:
         self.proxy_port = proxy_port
         self.proxy_user_name = proxy_user_name
         self.proxy_password = proxy_password
+        self.close()  # the next request creates a session using the proxy
 
-    def send_import_api_request(self, request_url, config, request_headers, file_path, data=None):
+    def close(self):
         """
-        Internal method to handle HTTP request.
+        Close the pooled connections of this client.
+        """
+        with self.session_lock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+
+    def send_import_api_request(self, request_url, config, request_headers, file_path, data=None, compression=None):
+        """
+        Internal method to handle HTTP request. The file is streamed as a multipart body, read in pieces while
+        it is sent and compressed with compression ("gzip" or "zip") if given; see MultipartFileBody for what
+        file_path can be.
         """
         if self.access_token is None:
             self.regenerate_analytics_oauth_token()
@@ -1816,7 +1865,10 @@ class AnalyticsClient:
             config_data += "DATA=" + urllib.parse.quote_plus(json.dumps(data))
             resp_obj = self.submit_import_request(request_url, config_data, request_headers, self.access_token)
         else:
-            files = {"FILE": open(file_path, "rb")}
+            filename = None
+            if not isinstance(file_path, (str, os.PathLike)):
+                filename = "data." + (config or {}).get("fileType", "csv")
+            files = MultipartFileBody("FILE", file_path, filename, compression)
             resp_obj = self.submit_import_request(request_url, config_data, request_headers, self.access_token, files)
 
         if not (str(resp_obj.status_code).startswith("2")):
@@ -1839,7 +1891,7 @@ class AnalyticsClient:
 
     def submit_import_request(self, request_url, parameters, request_headers={}, access_token=None, files=None):
         """
-        Internal method to send request to server.
+        Internal method to send request to server. files is a MultipartFileBody, or a dict for requests' files.
         """
         try:
             if request_headers is None:
@@ -1850,19 +1902,12 @@ class AnalyticsClient:
 
             request_headers["User-Agent"] = "Analytics Python Client v" + self.CLIENT_VERSION
 
-            req_obj = req_obj = requests.Session()
-            if self.proxy:
-                assert self.proxy_host and self.proxy_port
-                proxy_details = {
-                    "http": "http://" + self.proxy_host + ":" + self.proxy_port,
-                    "https": "http://" + self.proxy_host + ":" + self.proxy_port,
-                }
-                req_obj.proxies = proxy_details
-                if self.proxy_user_name is not None and self.proxy_password is not None:
-                    proxy_auth_details = HTTPProxyAuth(self.proxy_user_name, self.proxy_password)
-                    req_obj.auth = proxy_auth_details
-
-            if bool(files):
+            req_obj = self.get_request_obj()
+
+            if isinstance(files, MultipartFileBody):
+                headers = dict(request_headers, **{"Content-Type": files.content_type})
+                resp_obj = req_obj.post(request_url, params=parameters, data=files, headers=headers)
+            elif bool(files):
                 resp_obj = req_obj.post(request_url, params=parameters, files=files, headers=request_headers)
             else:
                 resp_obj = req_obj.post(request_url, params=parameters, headers=request_headers)
@@ -1874,12 +1919,12 @@ class AnalyticsClient:
 
         return resp_obj
 
-    def send_export_api_request(self, request_url, config, request_headers, file_path):
+    def send_export_api_request(self, request_url, config, request_headers, file_path, compress=False):
         """
-        Internal method to handle HTTP request.
+        Internal method to handle HTTP request. The response is streamed to file_path in chunks of
+        EXPORT_CHUNK_SIZE bytes, so it is never held in memory. file_path can be a path, a binary file object or a
+        function called with each chunk; with compress, the chunks are gzip compressed.
         """
-        file = open(file_path, "wb")
-
         if self.access_token is None:
             self.regenerate_analytics_oauth_token()
 
@@ -1888,26 +1933,30 @@ class AnalyticsClient:
         if bool(config):
             config_data = "CONFIG=" + urllib.parse.quote_plus(json.dumps(config))
 
-        resp_obj = self.submit_export_request(request_url, config_data, request_headers, self.access_token)
+        resp_obj = self.submit_export_request(request_url, config_data, request_headers, self.access_token, True)
 
         if not (str(resp_obj.status_code).startswith("2")):
-            resp_obj = response_obj(resp_obj)
+            error_resp_obj = response_obj(resp_obj)
 
-            if self.is_oauth_expired(resp_obj):
+            if self.is_oauth_expired(error_resp_obj):
                 self.regenerate_analytics_oauth_token()
-                resp_obj = self.submit_export_request(request_url, config_data, request_headers, self.access_token)
+                resp_obj = self.submit_export_request(
+                    request_url, config_data, request_headers, self.access_token, True
+                )
                 if not (str(resp_obj.status_code).startswith("2")):
-                    raise ServerError(resp_obj.resp_content, False)
+                    raise ServerError(response_obj(resp_obj).resp_content, False)
             else:
-                raise ServerError(resp_obj.resp_content, False)
+                raise ServerError(error_resp_obj.resp_content, False)
 
-        file.write(resp_obj.content)
-        file.close()
+        try:
+            write_chunks(resp_obj.iter_content(self.EXPORT_CHUNK_SIZE), file_path, compress)
+        finally:
+            resp_obj.close()
         return
 
-    def submit_export_request(self, request_url, parameters, request_headers={}, access_token=None):
+    def submit_export_request(self, request_url, parameters, request_headers={}, access_token=None, stream=False):
         """
-        Internal method to send request to server.
+        Internal method to send request to server. With stream, the body is read as it is consumed.
         """
         try:
             if request_headers is None:
@@ -1918,19 +1967,9 @@ class AnalyticsClient:
 
             request_headers["User-Agent"] = "Analytics Python Client v" + self.CLIENT_VERSION
 
-            req_obj = req_obj = requests.Session()
-            if self.proxy:
-                assert self.proxy_host and self.proxy_port
-                proxy_details = {
-                    "http": "http://" + self.proxy_host + ":" + self.proxy_port,
-                    "https": "http://" + self.proxy_host + ":" + self.proxy_port,
-                }
-                req_obj.proxies = proxy_details
-                if self.proxy_user_name is not None and self.proxy_password is not None:
-                    proxy_auth_details = HTTPProxyAuth(self.proxy_user_name, self.proxy_password)
-                    req_obj.auth = proxy_auth_details
+            req_obj = self.get_request_obj()
 
-            resp_obj = req_obj.get(request_url, params=parameters, headers=request_headers)
+            resp_obj = req_obj.get(request_url, params=parameters, headers=request_headers, stream=stream)
 
         except Exception as ex:
             resp_obj = response_obj(ex)  # type: ignore
@@ -1984,17 +2023,7 @@ class AnalyticsClient:
 
             request_headers["User-Agent"] = "Analytics Python Client v" + self.CLIENT_VERSION
 
-            req_obj = req_obj = requests.Session()
-            if self.proxy:
-                assert self.proxy_host and self.proxy_port
-                proxy_details = {
-                    "http": "http://" + self.proxy_host + ":" + self.proxy_port,
-                    "https": "http://" + self.proxy_host + ":" + self.proxy_port,
-                }
-                req_obj.proxies = proxy_details
-                if self.proxy_user_name is not None and self.proxy_password is not None:
-                    proxy_auth_details = HTTPProxyAuth(self.proxy_user_name, self.proxy_password)
-                    req_obj.auth = proxy_auth_details
+            req_obj = self.get_request_obj()
 
             resp_obj = None
 
@@ -2016,9 +2045,31 @@ class AnalyticsClient:
 
     def get_request_obj(self):
         """
-        Internal method for getting OAuth token.
+        Internal method for getting the HTTP session. The client keeps one session, so connections are pooled
+        and kept alive between requests; it is created on first use and again after set_proxy.
+        """
+        with self.session_lock:
+            if self.session is None:
+                self.session = self.create_session()
+            return self.session
+
+    def create_session(self):
+        """
+        Internal method to create a session with a connection pool of pool_maxsize connections per host.
+        Failed connections are retried up to max_retries times; read errors are not retried, because the
+        request may have been processed.
         """
         req_obj = requests.Session()
+        retry_strategy = Retry(
+            total=self.max_retries, connect=self.max_retries, read=0, backoff_factor=1, allowed_methods=None
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, max_retries=retry_strategy
+        )
+        req_obj.mount("http://", adapter)
+        req_obj.mount("https://", adapter)
+        if not self.keep_alive:
+            req_obj.headers["Connection"] = "close"
 
         if self.proxy:
             assert self.proxy_host and self.proxy_port
@@ -2066,6 +2117,37 @@ class AnalyticsClient:
         raise ServerError(oauth_resp_obj.resp_content, True)
 
 
+def write_chunks(chunks, destination, compress=False):
+    """
+    Internal method to write chunks of bytes to a file path, a binary file object or a function.
+    With compress, the bytes are gzip compressed as they are written. A file path is written through a
+    temporary file in the same directory, so a download which fails partway leaves no truncated file.
+    """
+    if isinstance(destination, (str, os.PathLike)):
+        directory, file_name = os.path.split(os.path.abspath(destination))
+        temporary_path = os.path.join(directory, ".%s.%s.part" % (file_name, uuid.uuid4().hex))
+        try:
+            with open(temporary_path, "xb") as out_file:
+                write_chunks(chunks, out_file, compress)
+            os.replace(temporary_path, destination)
+        except BaseException:
+            try:
+                os.unlink(temporary_path)
+            except OSError:
+                pass
+            raise
+        return
+    write = destination.write if hasattr(destination, "write") else destination
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None  # gzip format
+    for chunk in chunks:
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            write(chunk)
+    if compressor is not None:
+        write(compressor.flush())
+
+
 class response_obj:
     """
     Internal class.
@@ -0,0 +1,344 @@
+"""An asyncio client for the most used EnhancedZohoAnalyticsClient methods, using httpx.
+
+httpx is an optional dependency: pip install zoho_analytics_connector[async]
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+import asyncio
+import csv
+import json
+import logging
+import random
+import time
+import urllib.parse
+from typing import IO, Any, AsyncIterator, Callable, Iterable, List, Mapping, MutableMapping, Optional, Sequence, Union
+
+try:
+    import httpx
+except ImportError:  # optional dependency
+    httpx = None  # type: ignore
+
+from . import report_client, streaming
+from .enhanced_report_client import EnhancedZohoAnalyticsClient
+from .model_helpers import AnalyticsTableZohoDef_v2
+from .token_store import TokenStore
+from .typed_dicts import TableView_v2, ZohoSchemaModel_v2
+
+logger = logging.getLogger(__name__)
+
+
+async def aiter_body(body: Iterable[bytes]) -> AsyncIterator[bytes]:
+    """httpx.AsyncClient streams request bodies from async iterators"""
+    for piece in body:
+        yield piece
+
+
+class AsyncZohoAnalyticsClient:
+    """The asyncio equivalent of EnhancedZohoAnalyticsClient for data_upload, data_export_using_sql, delete_rows,
+    get_table_metadata_v2 and create_table_v2. All requests share one httpx connection pool (max_connections)
+    and retries back off with asyncio.sleep, so many calls can be in flight without a thread each.
+
+    URLs and responses are handled by an EnhancedZohoAnalyticsClient, sync_client, which is also there for
+    calls that have no async version (they block). It does not share the async client's access token.
+    Use the client as an async context manager, or call aclose(), to close the connection pool."""
+
+    def __init__(
+        self,
+        login_email_id: str,
+        refresh_token: str,
+        default_databasename: Optional[str] = None,
+        access_token: Optional[str] = None,
+        clientId=None,
+        clientSecret=None,
+        serverURL=None,
+        reportServerURL=None,
+        default_retries=6,
+        token_persistence_callback: Optional[Callable[[str], None]] = None,
+        max_connections: int = 20,
+        request_timeout: float = 60,
+        transport=None,
+    ):
+        """transport is passed to httpx.AsyncClient, e.g. an httpx.AsyncHTTPTransport(retries=3)"""
+        if httpx is None:
+            raise ImportError("AsyncZohoAnalyticsClient needs httpx: pip install zoho_analytics_connector[async]")
+        self.sync_client = EnhancedZohoAnalyticsClient(
+            login_email_id=login_email_id,
+            refresh_token=refresh_token,
+            default_databasename=default_databasename,
+            access_token=access_token,
+            clientId=clientId,
+            clientSecret=clientSecret,
+            serverURL=serverURL,
+            reportServerURL=reportServerURL,
+            default_retries=default_retries,
+            token_store=TokenStore(),
+        )
+        self.token_persistence_callback = token_persistence_callback
+        self.http_client = httpx.AsyncClient(
+            timeout=request_timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            headers={"User-Agent": "ZohoAnalytics Python GrowthPath Library"},
+            transport=transport,
+        )
+        self._access_token = access_token if self.sync_client.isOAuth else refresh_token
+        self._token_timestamp = time.time()
+        self._token_expires_at: Optional[float] = None
+        self._token_lock = asyncio.Lock()
+        self._workspace_index: Optional[dict[str, tuple[str, str]]] = None
+        self._workspace_index_expiry = 0.0
+        self._workspace_index_lock = asyncio.Lock()
+
+    async def __aenter__(self) -> "AsyncZohoAnalyticsClient":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.http_client.aclose()
+
+    @property
+    def login_email_id(self) -> str:
+        return self.sync_client.login_email_id
+
+    @property
+    def default_databasename(self) -> Optional[str]:
+        return self.sync_client.default_databasename
+
+    async def get_access_token(self) -> Optional[str]:
+        """A valid access token, refreshed if it is missing or due to expire"""
+        if self.sync_client.isOAuth:
+            deadline = self.sync_client._token_refresh_deadline(self._token_timestamp, self._token_expires_at)
+            if self._access_token is None or time.time() > deadline:
+                await self.refresh_access_token(stale_token=self._access_token)
+        return self._access_token
+
+    async def refresh_access_token(self, stale_token: Optional[str] = None) -> Optional[str]:
+        """Single-flight refresh: coroutines waiting for the lock use the token fetched by the first one"""
+        async with self._token_lock:
+            if self._access_token is not None and self._access_token != stale_token:
+                return self._access_token
+            logger.debug("Refreshing Zoho Analytics OAuth token")
+            response = await self.http_client.post(
+                self.sync_client.iamServerURL + "/oauth/v2/token",
+                data={
+                    "client_id": self.sync_client.clientId,
+                    "client_secret": self.sync_client.clientSecret,
+                    "refresh_token": self.sync_client.refresh_token,
+                    "grant_type": "refresh_token",
+                },
+            )
+            if response.status_code != 200:
+                raise report_client.ServerError(response)
+            token_response = response.json()
+            if "access_token" not in token_response:
+                raise ValueError("Error while getting OAuth access token", token_response)
+            lifetime = report_client.ReportClient.token_lifetime_seconds(token_response)
+            self._access_token = token_response["access_token"]
+            self._token_timestamp = time.time()
+            self._token_expires_at = self._token_timestamp + lifetime if lifetime else None
+            if self.token_persistence_callback:
+                self.token_persistence_callback(self._access_token)
+            return self._access_token
+
+    async def _send_request(
+        self,
+        method: str,
+        url: str,
+        retry_countdown: Optional[int] = None,
+        extra_headers: Optional[Mapping[str, str]] = None,
+        body_factory: Optional[Callable[[], AsyncIterator[bytes]]] = None,
+        **kwargs,
+    ) -> "httpx.Response":
+        """Send a request, retrying like ReportClient.__sendRequest: throttling errors (6045, 10001, 7198), 429 and
+        5xx responses and network errors are retried with backoff, an invalid token (8535) is refreshed and retried.
+        body_factory makes a fresh streamed body for each attempt."""
+        retry_countdown = retry_countdown or self.sync_client.default_retries
+        for attempt in range(1, retry_countdown + 1):
+            last_attempt = attempt == retry_countdown
+            token = await self.get_access_token()
+            headers = {"Authorization": "Zoho-oauthtoken " + token} if self.sync_client.isOAuth else {}
+            headers.update(extra_headers or {})
+            if body_factory is not None:
+                kwargs["content"] = body_factory()
+            try:
+                response = await self.http_client.request(method, url, headers=headers, **kwargs)
+            except httpx.TransportError as e:
+                logger.warning("Network error calling Zoho (attempt %s of %s): %s", attempt, retry_countdown, e)
+                if last_attempt:
+                    raise
+                await asyncio.sleep(min(3 * 2**attempt, 60) + random.random())
+                continue
+
+            succeeded = 200 <= response.status_code < 300
+            code, message = None, ""
+            if not succeeded or "json" in response.headers.get("Content-Type", ""):
+                code, message = self.sync_client._extract_zoho_error(response.text)
+            if succeeded and code not in report_client.ReportClient.THROTTLE_ZOHO_ERROR_CODES:
+                return response
+
+            logger.error("Zoho returned HTTP %s, error code %s %s", response.status_code, code, message)
+            if code == 8535:  # invalid oauth token
+                await self.refresh_access_token(stale_token=token)
+                if last_attempt:
+                    raise report_client.UnrecoverableRateLimitError(response, zoho_error_code=code)
+                continue
+            elif code in report_client.ReportClient.THROTTLE_ZOHO_ERROR_CODES or response.status_code == 429:
+                if last_attempt:
+                    if code == 6045 or code is None:
+                        raise report_client.RecoverableRateLimitError(response, zoho_error_code=code)
+                    raise report_client.UnrecoverableRateLimitError(response, zoho_error_code=code)
+            elif code in (6001, 6043):  # plan row limit, daily API limit
+                raise report_client.UnrecoverableRateLimitError(response, zoho_error_code=code)
+            elif code in (7232, 8509):
+                raise report_client.BadDataError(response, zoho_error_code=code)
+            elif code is not None or response.status_code < 500 or last_attempt:
+                raise report_client.ServerError(response, zoho_error_code=code)
+            await asyncio.sleep(min(4**attempt, 120) + random.random())
+        raise RuntimeError("retry_countdown must be at least 1")
+
+    async def _v1_url(self, table_name: str, database_name: Optional[str], action: str, export_format: str, **kwargs):
+        database_name = database_name or self.default_databasename
+        assert database_name
+        uri = self.sync_client.getURI(
+            dbOwnerName=self.login_email_id, dbName=database_name, tableOrReportName=table_name
+        )
+        return report_client.ReportClientHelper.addQueryParams(
+            uri, await self.get_access_token(), action, export_format, is_oauth=self.sync_client.isOAuth, **kwargs
+        )
+
+    async def data_upload(
+        self,
+        import_content: Union[str, Iterable[Mapping[str, Any]], Iterable[Sequence[Any]], IO],
+        table_name: str,
+        import_mode="TRUNCATEADD",
+        matching_columns: Optional[str] = None,
+        database_name: Optional[str] = None,
+        retry_limit=None,
+        date_format=None,
+        fieldnames: Optional[List[str]] = None,
+    ) -> report_client.ImportResult:
+        """See EnhancedZohoAnalyticsClient.data_upload. A file or an iterable of rows is csv-encoded as it is sent"""
+        url = await self._v1_url(table_name, database_name, "IMPORT", "XML")
+        form_fields = report_client.ReportClient.import_form_fields(import_mode, matching_columns, date_format)
+        retry_limit = retry_limit or self.sync_client.default_retries
+        if isinstance(import_content, str):
+            response = await self._send_request(
+                "POST", url, retry_countdown=retry_limit, data={**form_fields, "ZOHO_IMPORT_DATA": import_content}
+            )
+        else:
+            body = streaming.CSVFormBody(form_fields, "ZOHO_IMPORT_DATA", import_content, fieldnames=fieldnames)
+            response = await self._send_request(
+                "POST",
+                url,
+                retry_countdown=retry_limit if body.replayable else 1,
+                extra_headers={"Content-Type": "application/x-www-form-urlencoded"},
+                body_factory=lambda: aiter_body(body),
+            )
+        return report_client.ImportResult(response.content)
+
+    async def data_export_using_sql(
+        self, sql, table_name, database_name: Optional[str] = None, retry_countdown=5
+    ) -> csv.DictReader:
+        """See EnhancedZohoAnalyticsClient.data_export_using_sql"""
+        url = await self._v1_url(table_name, database_name, "EXPORT", "CSV", sql=sql)
+        response = await self._send_request("POST", url, retry_countdown=retry_countdown)
+        return csv.DictReader(response.content.decode("utf-8-sig").splitlines())
+
+    async def delete_rows(self, table_name, sql, database_name: Optional[str] = None, retry_countdown: int = 5) -> int:
+        """See EnhancedZohoAnalyticsClient.delete_rows"""
+        if len(sql) > 5000:
+            raise RuntimeError("The SQL passed to delete_rows is too big and will cause Zoho 400 errors")
+        url = await self._v1_url(table_name, database_name, "DELETE", "JSON", criteria=sql)
+        response = await self._send_request("POST", url, retry_countdown=retry_countdown)
+        return int(json.loads(response.content)["response"]["result"]["deletedrows"])
+
+    async def _v2_request(self, method: str, path: str, org_id: Optional[str] = None, config=None) -> MutableMapping:
+        url = self.sync_client.getURI_v2() + path
+        if config is not None:
+            url += "?CONFIG=" + urllib.parse.quote_plus(json.dumps(config))
+        extra_headers = {"ZANALYTICS-ORGID": org_id} if org_id else None
+        response = await self._send_request(method, url, extra_headers=extra_headers)
+        return response.json() if response.content else {}
+
+    async def get_org_and_workspace_id(self, database_name: Optional[str] = None) -> tuple[str, str]:
+        """Like the sync version, the workspace index is cached for workspace_cache_ttl_seconds"""
+        database_name = database_name or self.default_databasename
+        assert database_name
+        async with self._workspace_index_lock:
+            if (
+                self._workspace_index is None
+                or time.monotonic() > self._workspace_index_expiry
+                or database_name not in self._workspace_index
+            ):
+                workspaces_metadata = await self._v2_request("GET", "workspaces/")
+                self._workspace_index = EnhancedZohoAnalyticsClient.build_workspace_index(workspaces_metadata)
+                self._workspace_index_expiry = time.monotonic() + self.sync_client.workspace_cache_ttl_seconds
+            try:
+                return self._workspace_index[database_name]
+            except KeyError:
+                raise RuntimeError("workspace not found")
+
+    async def get_table_catalog_v2(
+        self,
+        database_name: Optional[str] = None,
+        failed_views: Optional[dict[str, Exception]] = None,
+        raise_errors: bool = False,
+    ) -> dict[str, TableView_v2]:
+        """See EnhancedZohoAnalyticsClient.get_table_catalog_v2. Up to metadata_concurrency views are fetched at once"""
+        org_id, workspace_id = await self.get_org_and_workspace_id(database_name=database_name)
+        tables_data = await self._v2_request("GET", f"workspaces/{workspace_id}/views/?viewTypes=0", org_id=org_id)
+        views = tables_data["data"]["views"]
+        semaphore = asyncio.Semaphore(self.sync_client.metadata_concurrency)
+
+        async def fetch_view_details(view_id: str) -> tuple[Optional[dict], Optional[Exception]]:
+            async with semaphore:
+                try:
+                    config = {"withInvolvedMetaInfo": True}
+                    return await self._v2_request("GET", f"views/{view_id}", config=config), None
+                except report_client.UnrecoverableRateLimitError:
+                    raise
+                except Exception as ex:
+                    return None, ex
+
+        view_details = await asyncio.gather(*(fetch_view_details(table["viewId"]) for table in views))
+        return EnhancedZohoAnalyticsClient.build_table_catalog_v2(views, list(view_details), failed_views, raise_errors)
+
+    async def get_table_metadata_v2(
+        self, database_name: Optional[str] = None, force_lowercase_column_names=False
+    ) -> ZohoSchemaModel_v2:
+        """See EnhancedZohoAnalyticsClient.get_table_metadata_v2"""
+        table_catalog = await self.get_table_catalog_v2(database_name=database_name)
+        return EnhancedZohoAnalyticsClient.process_table_meta_data_v2(
+            catalog=table_catalog, force_lowercase_column_names=force_lowercase_column_names
+        )
+
+    async def create_table_v2(
+        self, table_design: AnalyticsTableZohoDef_v2, database_name: Optional[str] = None
+    ) -> MutableMapping:
+        """See EnhancedZohoAnalyticsClient.create_table_v2"""
+        org_id, workspace_id = await self.get_org_and_workspace_id(database_name=database_name)
+        columns = table_design["COLUMNS"]
+        BIG_NUMBER_OF_COLUMNS = 10
+        columns_initial, columns_residual = columns[:BIG_NUMBER_OF_COLUMNS], columns[BIG_NUMBER_OF_COLUMNS:]
+        table_design["COLUMNS"] = columns_initial
+        result = await self._v2_request(
+            "POST", f"workspaces/{workspace_id}/tables", org_id=org_id, config={"tableDesign": table_design}
+        )
+        if columns_residual:
+            new_table_id = result["data"]["viewId"]
+            await asyncio.sleep(1)
+            for col in columns_residual:
+                column_config = {"columnName": col["COLUMNNAME"], "dataType": col["DATATYPE"]}
+                if col.get("DESCRIPTION"):
+                    column_config["columnDesc"] = col["DESCRIPTION"]
+                await self._v2_request(
+                    "POST",
+                    f"workspaces/{workspace_id}/views/{new_table_id}/columns",
+                    org_id=org_id,
+                    config=column_config,
+                )
+        return result
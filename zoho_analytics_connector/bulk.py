@@ -0,0 +1,96 @@
+"""Helpers for the asynchronous jobs of the v2 bulk API, which is only wrapped by the upstream AnalyticsClient.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Callable, Iterator, Optional
+
+from .analytics_client_upstream import AnalyticsClient
+
+logger = logging.getLogger(__name__)
+
+# the jobCode of bulk import and export jobs. 1001 (not initiated) and 1002 (in progress) mean keep polling
+JOB_NOT_INITIATED = 1001
+JOB_IN_PROGRESS = 1002
+JOB_FAILED = 1003
+JOB_COMPLETED = 1004
+JOB_NOT_FOUND = 1005
+FINISHED_JOB_STATUSES = {JOB_FAILED: "failed", JOB_COMPLETED: "completed", JOB_NOT_FOUND: "not_found"}
+
+
+class SharedTokenAnalyticsClient(AnalyticsClient):
+    """An upstream AnalyticsClient which uses the OAuth token of a ReportClient, so they share one token,
+    its refreshes and its token store."""
+
+    def __init__(self, report_client, **kwargs):
+        self.report_client = report_client
+        self._sent_token = threading.local()  # the token of the last request each thread sent
+        super().__init__(report_client.clientId, report_client.clientSecret, report_client.refresh_token, **kwargs)
+        self.accounts_server_url = report_client.iamServerURL
+        self.analytics_server_url = report_client.reportServerURL
+
+    @property  # type: ignore[override]
+    def access_token(self):
+        return self.report_client.access_token
+
+    @access_token.setter
+    def access_token(self, token):
+        pass  # the token belongs to report_client
+
+    def submit_import_request(self, request_url, parameters, request_headers={}, access_token=None, files=None):
+        self._sent_token.value = access_token
+        return super().submit_import_request(request_url, parameters, request_headers, access_token, files)
+
+    def submit_export_request(self, request_url, parameters, request_headers={}, access_token=None, stream=False):
+        self._sent_token.value = access_token
+        return super().submit_export_request(request_url, parameters, request_headers, access_token, stream)
+
+    def submit_request(self, request_method, request_url, parameters, request_headers={}, access_token=None):
+        self._sent_token.value = access_token
+        return super().submit_request(request_method, request_url, parameters, request_headers, access_token)
+
+    def regenerate_analytics_oauth_token(self):
+        """Called when a request was rejected for its token. That token is the stale one: if the token has been
+        refreshed since, by another thread or process, that token is used without asking IAM again."""
+        self.report_client.refresh_access_token(stale_token=getattr(self._sent_token, "value", None))
+
+
+def poll_delays(initial_seconds: float, max_seconds: float, factor: float = 1.5) -> Iterator[float]:
+    """Exponential backoff between polls of a job, with jitter (each delay is 50-100% of the nominal one) so that
+    jobs submitted together don't poll together"""
+    delay = initial_seconds
+    while True:
+        yield delay * random.uniform(0.5, 1.0)
+        delay = min(max_seconds, delay * factor)
+
+
+def wait_for_job(
+    get_job_details: Callable[[], dict],
+    timeout_seconds: float,
+    poll_interval_seconds: float = 2.0,
+    max_poll_interval_seconds: float = 30.0,
+) -> tuple[str, dict]:
+    """Poll a job until it is finished or timeout_seconds have passed. The job is polled at least once, and once
+    more at the deadline, so a short timeout still reports a job which has finished.
+    Returns the status (see FINISHED_JOB_STATUSES, or "timeout") and the job details from the last poll."""
+    deadline = time.monotonic() + timeout_seconds
+    for delay in poll_delays(poll_interval_seconds, max_poll_interval_seconds):
+        time.sleep(max(0.0, min(delay, deadline - time.monotonic())))
+        details = get_job_details()
+        status = FINISHED_JOB_STATUSES.get(job_code(details))  # type: ignore[arg-type]
+        if status:
+            return status, details
+        if time.monotonic() >= deadline:
+            return "timeout", details
+    raise AssertionError("poll_delays does not end")
+
+
+def job_code(details: dict) -> Optional[int]:
+    code = details.get("jobCode")
+    return int(code) if code is not None else None
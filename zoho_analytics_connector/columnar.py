@@ -0,0 +1,167 @@
+"""Decode exported csv into typed columns, using the data types of the v2 table metadata.
+
+NumPy is an optional dependency: pip install zoho_analytics_connector[numpy]
+With it, number, date and boolean columns are NumPy arrays; without it, numbers and booleans are array.array
+and dates are lists of datetimes. Text columns are lists of str either way.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+import array
+import csv
+import datetime
+import io
+import math
+import re
+from typing import Any, Iterator, Literal, Mapping, Optional, Sequence
+
+try:
+    import numpy
+except ImportError:  # optional dependency
+    numpy = None  # type: ignore
+
+from .typed_dicts import data_type_nbr_data_type_mapping
+
+ColumnKind = Literal["int", "float", "bool", "date", "str"]
+
+# keyed by the dataTypeId codes of data_type_nbr_data_type_mapping
+_KIND_OF_DATA_TYPE_ID: dict[int, ColumnKind] = {-5: "int", 8: "float", -7: "bool", 93: "date", 12: "str"}
+
+# tried after ISO 8601, which is what SQL exports normally use
+DATE_FORMATS = ("%d %b %Y %H:%M:%S", "%d %b %Y", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y", "%m/%d/%Y")
+
+# what formatted numbers may add: whitespace, thousands separators, percent signs and currency symbols
+_NUMBER_FORMATTING_RE = re.compile(r"[\s,%$\u00a2-\u00a5\u20a0-\u20cf]")
+_TRUE = {"true", "yes", "1"}
+_FALSE = {"false", "no", "0"}
+
+
+def column_kind(column: Mapping) -> ColumnKind:
+    """The kind of a column's values, from its v2 metadata: the dataTypeId code, or else the dataType name
+    (e.g. DECIMAL_NUMBER). Unknown types are "str"."""
+    type_id = column.get("dataTypeId")
+    if type_id is None:
+        data_type = column.get("dataType")
+        type_id = next((code for code, names in data_type_nbr_data_type_mapping.items() if data_type in names), None)
+    return _KIND_OF_DATA_TYPE_ID.get(int(type_id), "str") if type_id is not None else "str"
+
+
+def parse_number(text: str) -> float:
+    """A number, which may be formatted like "$1,234.5" or "12%". Raises ValueError for other text, such as
+    a date."""
+    try:
+        return float(text)
+    except ValueError:
+        return float(_NUMBER_FORMATTING_RE.sub("", text))
+
+
+def parse_int(text: str) -> int:
+    try:
+        return int(text)
+    except ValueError:
+        return int(parse_number(text))
+
+
+def parse_bool(text: str) -> bool:
+    lowered = text.strip().lower()
+    if lowered in _TRUE:
+        return True
+    if lowered in _FALSE:
+        return False
+    raise ValueError(f"Not a boolean: {text!r}")
+
+
+def parse_date(text: str, date_formats: Sequence[str] = DATE_FORMATS) -> datetime.datetime:
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        pass
+    for date_format in date_formats:
+        try:
+            return datetime.datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+    raise ValueError(f"Not a date in a known format: {text!r}")
+
+
+def decode_column(values: list[str], kind: ColumnKind, use_numpy: bool) -> Sequence:
+    """Decode the text of a column. Empty values are NaN in number columns (so an int column with blanks is
+    decoded as float), NaT (or None without NumPy) in date columns and None in boolean columns, which are then
+    lists instead of arrays."""
+    if kind in ("int", "float"):
+        if kind == "int" and "" not in values:
+            ints = [parse_int(value) for value in values]
+            return numpy.array(ints, dtype=numpy.int64) if use_numpy else array.array("q", ints)
+        floats = [parse_number(value) if value != "" else math.nan for value in values]
+        return numpy.array(floats, dtype=numpy.float64) if use_numpy else array.array("d", floats)
+    if kind == "bool":
+        bools = [parse_bool(value) if value != "" else None for value in values]
+        if "" in values:
+            return bools
+        return numpy.array(bools, dtype=bool) if use_numpy else array.array("b", bools)  # type: ignore[arg-type]
+    if kind == "date":
+        dates = [parse_date(value) if value != "" else None for value in values]
+        return numpy.array(dates, dtype="datetime64[s]") if use_numpy else dates
+    return values
+
+
+class ColumnarResult:
+    """The result of a typed export, held by column: result["price"] is the whole price column (see decode_column)
+    and result.kinds["price"] its kind. Use rows() for row dicts."""
+
+    def __init__(self, columns: dict[str, Sequence], kinds: dict[str, ColumnKind], num_rows: int):
+        self.columns = columns
+        self.kinds = kinds
+        self.num_rows = num_rows
+
+    @property
+    def column_names(self) -> list[str]:
+        return list(self.columns)
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def __getitem__(self, column_name: str) -> Sequence:
+        return self.columns[column_name]
+
+    def __contains__(self, column_name: str) -> bool:
+        return column_name in self.columns
+
+    def rows(self) -> Iterator[dict[str, Any]]:
+        for i in range(self.num_rows):
+            yield {name: values[i] for name, values in self.columns.items()}
+
+
+def match_kinds(header: Sequence[str], kinds: Mapping[str, ColumnKind]) -> dict[str, ColumnKind]:
+    """The kind of each column in a csv header. kinds maps column names, matched exactly or case-insensitively,
+    to their kind; other columns are "str"."""
+    lowercase_kinds = {name.lower(): kind for name, kind in kinds.items()}
+    return {name: kinds.get(name) or lowercase_kinds.get(name.lower(), "str") for name in header}
+
+
+def decode_csv(csv_text: str, kinds: Mapping[str, ColumnKind], use_numpy: Optional[bool] = None) -> ColumnarResult:
+    """Decode csv text (with a header row) into a ColumnarResult, with the column kinds found by match_kinds.
+    use_numpy defaults to whether NumPy is installed."""
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    elif use_numpy and numpy is None:
+        raise ImportError("use_numpy needs NumPy: pip install zoho_analytics_connector[numpy]")
+    reader = csv.reader(io.StringIO(csv_text, newline=""))
+    header = next(reader, [])
+    header_kinds = match_kinds(header, kinds)
+    raw_columns: list[list[str]] = [[] for _ in header]
+    num_rows = 0
+    for row in reader:
+        if not row:
+            continue
+        num_rows += 1
+        for values, value in zip(raw_columns, row):
+            values.append(value)
+        for values in raw_columns[len(row) :]:  # short rows
+            values.append("")
+    columns: dict[str, Sequence] = {}
+    for name, values in zip(header, raw_columns):
+        columns[name] = decode_column(values, header_kinds[name], use_numpy)
+    return ColumnarResult(columns, header_kinds, num_rows)
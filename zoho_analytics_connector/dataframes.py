@@ -0,0 +1,154 @@
+"""Conversions between exported or imported csv and pandas DataFrames or pyarrow Tables.
+
+pandas and pyarrow are optional dependencies: pip install zoho_analytics_connector[pandas] or [arrow]
+The column types of exports come from the v2 table metadata, see columnar.py.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+import csv
+import io
+from typing import Any, Iterator, Literal, Mapping
+
+try:
+    import pandas
+except ImportError:  # optional dependency
+    pandas = None  # type: ignore
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.csv
+except ImportError:  # optional dependency
+    pyarrow = None  # type: ignore
+
+from .columnar import DATE_FORMATS, ColumnKind, match_kinds, parse_int, parse_number
+
+DataFrameEngine = Literal["pandas", "arrow"]
+
+# dates are written like this in uploads; ZOHO_DATE_FORMAT is the same format in Zoho's (Java) notation
+UPLOAD_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+ZOHO_DATE_FORMAT = "yyyy-MM-dd HH:mm:ss"
+
+# nullable pandas dtypes, so blank numbers and booleans do not change a column's type
+_PANDAS_DTYPES: dict[ColumnKind, str] = {"int": "Int64", "float": "float64", "bool": "boolean", "str": "string"}
+
+
+def require(engine: DataFrameEngine):
+    if engine == "pandas" and pandas is None:
+        raise ImportError("DataFrames need pandas: pip install zoho_analytics_connector[pandas]")
+    if engine == "arrow" and pyarrow is None:
+        raise ImportError("Arrow tables need pyarrow: pip install zoho_analytics_connector[arrow]")
+    if engine not in ("pandas", "arrow"):
+        raise ValueError(f"engine must be pandas or arrow, not {engine!r}")
+
+
+def csv_header(csv_text: str) -> list[str]:
+    return next(csv.reader(io.StringIO(csv_text, newline="")), [])
+
+
+def parse_formatted_numbers(values: list, kind: ColumnKind) -> list:
+    """Parse number text as columnar's typed exports do, e.g. "$1,250.50"; blank or missing values are None"""
+    parse = parse_int if kind == "int" else parse_number
+    return [parse(value) if isinstance(value, str) and value != "" else None for value in values]
+
+
+def csv_to_pandas(csv_text: str, kinds: Mapping[str, ColumnKind]) -> "pandas.DataFrame":
+    """Parse csv with pandas' C parser, with dtypes from the column kinds (see columnar.match_kinds).
+    Only empty values are missing; text such as "NA" is kept. If the C parser cannot read the numbers, such as
+    currency values, the number columns are parsed by parse_formatted_numbers."""
+    require("pandas")
+    header_kinds = match_kinds(csv_header(csv_text), kinds)
+
+    def read_csv(number_dtype=None):
+        return pandas.read_csv(
+            io.StringIO(csv_text),
+            dtype={
+                name: number_dtype if number_dtype and kind in ("int", "float") else _PANDAS_DTYPES[kind]
+                for name, kind in header_kinds.items()
+                if kind != "date"
+            },
+            keep_default_na=False,
+            na_values=[""],
+            thousands=",",
+        )
+
+    try:
+        frame = read_csv()
+    except ValueError:  # formatted numbers
+        frame = read_csv(number_dtype="string")
+        for name, kind in header_kinds.items():
+            if kind in ("int", "float"):
+                numbers = parse_formatted_numbers(frame[name].tolist(), kind)
+                frame[name] = pandas.Series(numbers, index=frame.index, dtype=_PANDAS_DTYPES[kind])
+    for name, kind in header_kinds.items():
+        if kind == "date":
+            try:
+                frame[name] = pandas.to_datetime(frame[name], format="ISO8601")
+            except ValueError:
+                frame[name] = pandas.to_datetime(frame[name], format="mixed")
+    return frame
+
+
+def csv_to_arrow(csv_text: str, kinds: Mapping[str, ColumnKind]) -> "pyarrow.Table":
+    """Parse csv with pyarrow's csv reader, with column types from the column kinds (see columnar.match_kinds).
+    If the reader cannot convert the numbers, such as currency values, the number columns are parsed by
+    parse_formatted_numbers."""
+    require("arrow")
+    arrow_types = {
+        "int": pyarrow.int64(),
+        "float": pyarrow.float64(),
+        "bool": pyarrow.bool_(),
+        "date": pyarrow.timestamp("s"),
+        "str": pyarrow.string(),
+    }
+    header_kinds = match_kinds(csv_header(csv_text), kinds)
+
+    def read_csv(number_type=None):
+        convert_options = pyarrow.csv.ConvertOptions(
+            column_types={
+                name: number_type if number_type and kind in ("int", "float") else arrow_types[kind]
+                for name, kind in header_kinds.items()
+            },
+            timestamp_parsers=[pyarrow.csv.ISO8601, *DATE_FORMATS],
+            true_values=["true", "True", "TRUE", "yes", "Yes"],
+            false_values=["false", "False", "FALSE", "no", "No"],
+        )
+        return pyarrow.csv.read_csv(io.BytesIO(csv_text.encode("utf-8")), convert_options=convert_options)
+
+    try:
+        return read_csv()
+    except pyarrow.ArrowInvalid:  # formatted numbers
+        table = read_csv(number_type=pyarrow.string())
+    for name, kind in header_kinds.items():
+        if kind in ("int", "float"):
+            numbers = parse_formatted_numbers(table[name].to_pylist(), kind)
+            index = table.schema.get_field_index(name)
+            table = table.set_column(index, name, pyarrow.array(numbers, type=arrow_types[kind]))
+    return table
+
+
+def iter_csv_chunks_of_frame(frame: Any, rows_per_chunk: int) -> Iterator[str]:
+    """Write a DataFrame or Arrow table as csv chunks of up to rows_per_chunk rows, each with the header row.
+    Each chunk is written by the library's vectorized csv writer; dates are written in UPLOAD_DATE_FORMAT."""
+    if pyarrow is not None and isinstance(frame, pyarrow.Table):
+        for start in range(0, max(frame.num_rows, 1), rows_per_chunk):
+            chunk = frame.slice(start, rows_per_chunk)
+            columns = [
+                pyarrow.compute.strftime(column, format=UPLOAD_DATE_FORMAT)
+                if pyarrow.types.is_timestamp(column.type)
+                else column
+                for column in chunk.columns
+            ]
+            buffer = io.BytesIO()
+            pyarrow.csv.write_csv(pyarrow.Table.from_arrays(columns, names=chunk.column_names), buffer)
+            yield buffer.getvalue().decode("utf-8")
+    elif pandas is not None and isinstance(frame, pandas.DataFrame):
+        for start in range(0, max(len(frame), 1), rows_per_chunk):
+            yield frame.iloc[start : start + rows_per_chunk].to_csv(
+                index=False, date_format=UPLOAD_DATE_FORMAT, lineterminator="\r\n"
+            )
+    else:
+        raise TypeError(f"Expected a pandas DataFrame or a pyarrow Table, not {type(frame).__name__}")
@@ -7,15 +7,35 @@ file, You can obtain one at https://mozilla.org/MPL/2.0/.
 """
 
 import csv
+import io
 import json
 import logging
+import os
+import threading
 import time
-from typing import MutableMapping, Optional, List, Callable
+import urllib.parse
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import IO, Any, MutableMapping, Optional, List, Callable, Iterable, Iterator, Mapping, Sequence, Union
 
-from . import report_client
+from . import analytics_client_upstream, bulk, columnar, dataframes, partitioning, report_client, streaming
+from .export_cache import (
+    CacheStats,
+    LRUMemoryCache,
+    SingleFlight,
+    export_cache_key,
+    get_table_versions,
+    new_table_version,
+    ordered_tables_in_sql,
+    table_version_key,
+    tables_in_sql,
+)
+from .quota import ApiQuotaTracker
+from .rate_limit import AdaptiveConcurrencyLimiter, RateLimiter
+from .token_store import FileTokenStore, TokenStore
 from .model_helpers import AnalyticsTableZohoDef_v2, ColumnUpdateDef_v2
 
-from .typed_dicts import ZohoSchemaModel, Catalog, ZohoSchemaModel_v2, TableView_v2
+from .typed_dicts import ZohoSchemaModel, Catalog, ZohoSchemaModel_v2, TableView_v2, ZohoWorkspacesResponse
+from .typed_dicts import BulkImportJob, BulkJobResult
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -25,8 +45,31 @@ logger.addHandler(ch)
 
 """ add some helper functions on top of report_client"""
 
+# the IAM (serverURL) and Analytics API (reportServerURL) hosts of each Zoho data centre
+ZOHO_DATA_CENTRES: dict[str, tuple[str, str]] = {
+    "us": ("https://accounts.zoho.com", "https://analyticsapi.zoho.com"),
+    "eu": ("https://accounts.zoho.eu", "https://analyticsapi.zoho.eu"),
+    "in": ("https://accounts.zoho.in", "https://analyticsapi.zoho.in"),
+    "au": ("https://accounts.zoho.com.au", "https://analyticsapi.zoho.com.au"),
+    "jp": ("https://accounts.zoho.jp", "https://analyticsapi.zoho.jp"),
+    "ca": ("https://accounts.zohocloud.ca", "https://analyticsapi.zohocloud.ca"),
+    "sa": ("https://accounts.zoho.sa", "https://analyticsapi.zoho.sa"),
+    "cn": ("https://accounts.zoho.com.cn", "https://analyticsapi.zoho.com.cn"),
+}
+
 
 class EnhancedZohoAnalyticsClient(report_client.ReportClient):
+    workspace_cache_ttl_seconds = 15 * 60
+    metadata_concurrency = 4
+    export_cache = None  # the default cache_object of data_export_using_sql, see export_cache.py
+    _export_caches: tuple = ()  # every cache data_export_using_sql has used, whose table versions writes change
+    _export_caches_lock = threading.Lock()
+    # holds the table versions of exports made without a cache, so that coalescing them still sees writes
+    _uncached_table_versions = LRUMemoryCache(max_bytes=1024 * 1024)
+    # identical exports running at the same time share one request. The keys include the login, data centre and
+    # workspace, so all clients in the process can share this
+    export_flights = SingleFlight()
+
     @staticmethod
     def process_table_meta_data(catalog: Catalog, force_lowercase_column_names=False) -> ZohoSchemaModel:
         """catalog is a ZOHO_CATALOG_INFO dict. Call this from get_database_metadata for example
@@ -80,14 +123,25 @@ class EnhancedZohoAnalyticsClient(report_client.ReportClient):
 
         return table_data_zoho_schema
 
-    def get_table_catalog_v2(self, database_name: Optional[str] = None) -> dict[str, TableView_v2]:
-        org_id, workspace_id = self.get_org_and_workspace_id(database_name=database_name)
-
-        tables_data = self.get_views_api_v2(org_id=org_id, workspace_id=workspace_id, view_types=[0])
+    @staticmethod
+    def build_table_catalog_v2(
+        views: List[dict],
+        view_details: List[tuple[Optional[dict], Optional[Exception]]],
+        failed_views: Optional[dict[str, Exception]] = None,
+        raise_errors: bool = False,
+    ) -> dict[str, TableView_v2]:
+        """Combine the list of views with the (details, error) fetched for each of them into a table catalog.
+        Views which failed are left out and recorded in failed_views if it is a dict. With raise_errors, the
+        exception of the first failed view is raised instead, with a note listing every failed view."""
         table_catalog: dict[str, TableView_v2] = {}
-        for table in tables_data["data"]["views"]:
+        errors: dict[str, Exception] = {}
+        for table, (table_details, error) in zip(views, view_details):
             view_id = table["viewId"]
-            table_details = self.get_view_details_api_v2(view_id=view_id)
+            if table_details is None:
+                logger.warning("Could not fetch v2 view details for %s: %r", view_id, error)
+                if error is not None:
+                    errors[view_id] = error
+                continue
             detailed_view = table_details.get("data", {}).get("views", {})
             columns = detailed_view.get("columns") or []
             table_name = detailed_view.get("viewName") or table.get("viewName")
@@ -102,9 +156,51 @@ class EnhancedZohoAnalyticsClient(report_client.ReportClient):
                 tableType=table_type,
                 viewID=resolved_view_id,
             )
-
+        if failed_views is not None:
+            failed_views.update(errors)
+        if raise_errors and errors:
+            first_error = next(iter(errors.values()))
+            first_error.add_note(f"Could not fetch the details of views {', '.join(errors)}")
+            raise first_error
         return table_catalog
 
+    def get_table_catalog_v2(
+        self,
+        database_name: Optional[str] = None,
+        max_workers: Optional[int] = None,
+        failed_views: Optional[dict[str, Exception]] = None,
+        raise_errors: bool = False,
+    ) -> dict[str, TableView_v2]:
+        """The details of each table are fetched concurrently by up to max_workers threads (default:
+        metadata_concurrency). The catalog is in the same order as Zoho's list of views.
+        If fetching the details of a view fails, it is logged and left out of the catalog, and the exception is
+        recorded in failed_views if you pass a dict. With raise_errors, once all views have been tried, the
+        original exception of the first failed view (e.g. ServerError) is raised, with a note listing every
+        failed view. Views which hit the rate limit are tried again one at a time after the others are done.
+        A daily API limit error (UnrecoverableRateLimitError) is raised."""
+        org_id, workspace_id = self.get_org_and_workspace_id(database_name=database_name)
+
+        tables_data = self.get_views_api_v2(org_id=org_id, workspace_id=workspace_id, view_types=[0])
+        views = tables_data["data"]["views"]
+
+        def fetch_view_details(view_id: str) -> tuple[Optional[dict], Optional[Exception]]:
+            try:
+                return self.get_view_details_api_v2(view_id=view_id), None
+            except report_client.UnrecoverableRateLimitError:
+                raise
+            except Exception as ex:
+                return None, ex
+
+        view_ids = [table["viewId"] for table in views]
+        with ThreadPoolExecutor(max_workers=max_workers or self.metadata_concurrency) as executor:
+            view_details = list(executor.map(self.bind_api_priority(fetch_view_details), view_ids))
+        for i, (view_id, (_, error)) in enumerate(zip(view_ids, view_details)):
+            if isinstance(error, report_client.RecoverableRateLimitError):
+                logger.warning("Rate limited fetching details of view %s, trying again on its own", view_id)
+                view_details[i] = fetch_view_details(view_id)
+
+        return self.build_table_catalog_v2(views, view_details, failed_views=failed_views, raise_errors=raise_errors)
+
     def get_table_view_ids_v2(self, database_name: Optional[str] = None) -> dict[str, str]:
         table_catalog = self.get_table_catalog_v2(database_name=database_name)
         return {table_name: table["viewID"] for table_name, table in table_catalog.items()}
@@ -123,13 +219,35 @@ class EnhancedZohoAnalyticsClient(report_client.ReportClient):
         reporting_currency: Optional[str] = None,
         error_email_list: Optional[List[str]] = None,
         token_persistence_callback: Optional[Callable[[str], None]] = None,
+        workspace_cache_ttl_seconds: Optional[int] = None,
+        workspace_cache_backend=None,
+        token_store: Optional[TokenStore] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        rate_limit_key: Optional[str] = None,
+        concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+        quota_tracker: Optional[ApiQuotaTracker] = None,
+        export_cache=None,
     ):
-        """error email list is not used by the client, but it is available for callers as a convenience"""
+        """error email list is not used by the client, but it is available for callers as a convenience
+        workspace_cache_backend is optional, an object with get, set and delete like the django cache
+        export_cache is optional, the cache used by data_export_using_sql when it is not given a cache_object
+        token_store is optional; without one, tokens are only persisted by token_persistence_callback
+        rate_limiter is optional; requests are counted against rate_limit_key, default login_email_id"""
         self.login_email_id = login_email_id
+        if workspace_cache_ttl_seconds is not None:
+            self.workspace_cache_ttl_seconds = workspace_cache_ttl_seconds
+        self.workspace_cache_backend = workspace_cache_backend
+        self._workspace_index: Optional[dict[str, tuple[str, str]]] = None
+        self._workspace_index_expiry = 0.0
+        self._workspace_index_lock = threading.Lock()
+        self._upstream_client: Optional[bulk.SharedTokenAnalyticsClient] = None
+        self._upstream_client_lock = threading.Lock()
         self.default_databasename = default_databasename
         self.error_email_list = error_email_list or [login_email_id]
         self.reporting_currency = reporting_currency
         self.token_persistence_callback = token_persistence_callback
+        self.export_cache = export_cache
+        self.export_cache_stats = CacheStats()
         super().__init__(
             refresh_token=refresh_token,
             clientId=clientId,
@@ -138,11 +256,21 @@ class EnhancedZohoAnalyticsClient(report_client.ReportClient):
             reportServerURL=reportServerURL,
             default_retries=default_retries,
             access_token=access_token,
+            token_store=token_store,
+            rate_limiter=rate_limiter,
+            rate_limit_key=rate_limit_key or login_email_id,
+            concurrency_limiter=concurrency_limiter,
+            quota_tracker=quota_tracker,
         )
 
+    def default_token_store(self) -> TokenStore:
+        """Without a token_store, tokens are only persisted by token_persistence_callback"""
+        return FileTokenStore(self.default_token_file(), read_only=True)
+
     def persist_token(self, token: str):
         if self.token_persistence_callback:
             self.token_persistence_callback(token)
+        super().persist_token(token)
 
     def get_database_catalog(self, database_name: Optional[str] = None) -> Catalog:
         actual_db_name = database_name or self.default_databasename
@@ -163,18 +291,60 @@ class EnhancedZohoAnalyticsClient(report_client.ReportClient):
         return table_metadata
 
     def get_org_and_workspace_id(self, database_name: Optional[str] = None) -> tuple[str, str]:
+        """The ids are looked up in a cached index of workspace names, see get_workspace_index.
+        A name which is not in the index causes one refresh, in case the workspace is new."""
         database_name = database_name or self.default_databasename
-        workspaces_metadata = self.get_all_workspaces_metadata_api_v2()
+        assert database_name
+        workspace_index = self.get_workspace_index()
+        if database_name not in workspace_index:
+            workspace_index = self.get_workspace_index(refresh=True)
+        try:
+            return workspace_index[database_name]
+        except KeyError:
+            raise RuntimeError("workspace not found")
 
+    @staticmethod
+    def build_workspace_index(workspaces_metadata: ZohoWorkspacesResponse) -> dict[str, tuple[str, str]]:
+        """map workspace name to (org_id, workspace_id). Owned workspaces win over shared ones with the same name"""
+        workspace_index: dict[str, tuple[str, str]] = {}
         for workspace in (
             workspaces_metadata["data"]["ownedWorkspaces"] + workspaces_metadata["data"]["sharedWorkspaces"]
         ):
-            if workspace["workspaceName"] == database_name:
-                workspace_id = workspace["workspaceId"]
-                org_id = workspace["orgId"]
-                return org_id, workspace_id
-        else:
-            raise RuntimeError("workspace not found")
+            workspace_index.setdefault(workspace["workspaceName"], (workspace["orgId"], workspace["workspaceId"]))
+        return workspace_index
+
+    @property
+    def workspace_cache_key(self) -> str:
+        return f"zoho_analytics_connector:workspaces:{self.reportServerURL}:{self.login_email_id}"
+
+    def get_workspace_index(self, refresh=False) -> dict[str, tuple[str, str]]:
+        """Return the workspace name index, fetching all workspaces metadata only when the cached index is missing or
+        older than workspace_cache_ttl_seconds. If a workspace_cache_backend (with the get and set functions of a
+        django cache) was provided, the index is shared through it, so other processes don't need to fetch it."""
+        with self._workspace_index_lock:
+            if not refresh and self._workspace_index is not None and time.monotonic() < self._workspace_index_expiry:
+                return self._workspace_index
+            workspace_index = None
+            if not refresh and self.workspace_cache_backend is not None:
+                cached_index = self.workspace_cache_backend.get(self.workspace_cache_key)
+                if cached_index:
+                    workspace_index = {name: tuple(ids) for name, ids in cached_index.items()}
+            if workspace_index is None:
+                workspace_index = self.build_workspace_index(self.get_all_workspaces_metadata_api_v2())
+                if self.workspace_cache_backend is not None:
+                    self.workspace_cache_backend.set(
+                        self.workspace_cache_key, workspace_index, self.workspace_cache_ttl_seconds
+                    )
+            self._workspace_index = workspace_index
+            self._workspace_index_expiry = time.monotonic() + self.workspace_cache_ttl_seconds
+            return workspace_index
+
+    def invalidate_workspace_cache(self):
+        """Forget the workspace index, e.g. after creating, copying or deleting a workspace"""
+        with self._workspace_index_lock:
+            self._workspace_index = None
+            if self.workspace_cache_backend is not None:
+                self.workspace_cache_backend.delete(self.workspace_cache_key)
 
     def get_table_metadata_v2(
         self, database_name: Optional[str] = None, force_lowercase_column_names=False
@@ -278,16 +448,33 @@ class EnhancedZohoAnalyticsClient(report_client.ReportClient):
 
     def data_upload(
         self,
-        import_content: str,
+        import_content: Union[str, Iterable[Mapping[str, Any]], Iterable[Sequence[Any]], IO],
         table_name: str,
         import_mode="TRUNCATEADD",
         matching_columns: Optional[str] = None,
         database_name: Optional[str] = None,
         retry_limit=None,
         date_format=None,
+        chunk_size_bytes: Optional[int] = None,
+        chunk_row_count: Optional[int] = None,
+        max_workers: int = 4,
+        fieldnames: Optional[List[str]] = None,
+        compress: bool = False,
     ) -> Optional[report_client.ImportResult]:
         """data is a csv-style string, newline separated. Matching columns is a comma separated string
         import_mode is one of TRUNCATEADD, APPEND, UPDATEADD
+
+        Instead of a string, import_content can be a file-like object or an iterable of rows (dicts or tuples).
+        This is csv-encoded as it is sent, so the whole csv is never held in memory. For dict rows the header is
+        fieldnames or the keys of the first row; for tuples it is fieldnames, or else the first row.
+        Retries need to re-read the content: a list or a seekable file is fine, a generator is sent only once.
+
+        For large payloads, pass chunk_size_bytes and/or chunk_row_count. The csv is split on row boundaries,
+        every chunk gets the header row, and chunks are sent concurrently by up to max_workers threads.
+        With TRUNCATEADD, the first chunk is sent alone and truncates; the rest are APPENDed.
+        The ImportResult returned for a chunked upload has the counts summed over all chunks.
+
+        compress sends the csv (or each chunk) as a zip file; see importData_v1a.
         """
         retry_limit = retry_limit or self.default_retries
         logger.info("Retry limit for data_upload: %s", retry_limit)
@@ -297,6 +484,22 @@ class EnhancedZohoAnalyticsClient(report_client.ReportClient):
         database_name = database_name or self.default_databasename
         assert database_name
         uri = self.getURI(dbOwnerName=self.login_email_id, dbName=database_name, tableOrReportName=table_name)
+        if chunk_size_bytes or chunk_row_count:
+            chunks = streaming.iter_csv_chunks(
+                streaming.iter_csv_lines(import_content_demojized, fieldnames=fieldnames),
+                max_bytes=chunk_size_bytes,
+                max_rows=chunk_row_count,
+            )
+            return self._import_chunks(
+                uri,
+                chunks=chunks,
+                import_mode=import_mode,
+                matching_columns=matching_columns,
+                date_format=date_format,
+                retry_limit=retry_limit,
+                max_workers=max_workers,
+                compress=compress,
+            )
         # import_modes = APPEND / TRUNCATEADD / UPDATEADD
         impResult = self.importData_v1a(
             uri,
@@ -305,10 +508,125 @@ class EnhancedZohoAnalyticsClient(report_client.ReportClient):
             date_format=date_format,
             matching_columns=matching_columns,
             retry_countdown=retry_limit,
+            fieldnames=fieldnames,
+            compress=compress,
         )
 
         return impResult
 
+    def _import_chunks(
+        self,
+        uri: str,
+        chunks: Iterator[str],
+        import_mode: str,
+        matching_columns: Optional[str],
+        date_format: Optional[str],
+        retry_limit: int,
+        max_workers: int,
+        compress: bool = False,
+    ) -> Optional[report_client.ImportResult]:
+        """Send csv chunks through importData_v1a on a bounded thread pool and merge the results.
+        No more than 2 * max_workers chunks are held at once, so chunks can be produced lazily."""
+
+        def import_chunk(chunk: str, chunk_import_mode: str) -> report_client.ImportResult:
+            return self.importData_v1a(
+                uri,
+                import_mode=chunk_import_mode,
+                import_content=chunk,
+                date_format=date_format,
+                matching_columns=matching_columns,
+                retry_countdown=retry_limit,
+                compress=compress,
+            )
+
+        results: List[report_client.ImportResult] = []
+        if import_mode == "TRUNCATEADD":
+            first_chunk = next(chunks, None)
+            if first_chunk is None:
+                return None
+            results.append(import_chunk(first_chunk, "TRUNCATEADD"))
+            import_mode = "APPEND"
+
+        import_chunk_in_worker = self.bind_api_priority(import_chunk)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending: set[Future] = set()
+            for chunk in chunks:
+                if len(pending) >= 2 * max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    results.extend(future.result() for future in done)
+                pending.add(executor.submit(import_chunk_in_worker, chunk, import_mode))
+            results.extend(future.result() for future in pending)
+
+        if not results:
+            return None
+        logger.info("Chunked import of %s chunks to %s finished", len(results), uri)
+        return report_client.ImportResult.merge(results)
+
+    def export_cache_key(
+        self,
+        sql: str,
+        database_name: Optional[str] = None,
+        response_format: str = "CSV",
+        table_versions: Optional[Mapping[str, str]] = None,
+    ) -> str:
+        """The cache key of an export, namespaced by data centre, login and workspace and including the versions of
+        the tables the sql reads (by default their current versions in export_cache); see export_cache.py"""
+        if table_versions is None:
+            table_versions = self.export_table_versions(sql, database_name)
+        return export_cache_key(
+            data_centre=urllib.parse.urlparse(self.reportServerURL).netloc,
+            login_email_id=self.login_email_id,
+            workspace=database_name or self.default_databasename or "",
+            sql=sql,
+            response_format=response_format,
+            table_versions=table_versions,
+        )
+
+    def export_table_version_key(self, table_name: str, database_name: Optional[str] = None) -> str:
+        return table_version_key(
+            data_centre=urllib.parse.urlparse(self.reportServerURL).netloc,
+            login_email_id=self.login_email_id,
+            workspace=database_name or self.default_databasename or "",
+            table_name=table_name,
+        )
+
+    def _table_versions_cache(self, cache):
+        """The cache holding table versions for exports cached in cache (which may be None), remembered so that
+        invalidate_export_cache changes the versions in it"""
+        cache = cache if cache is not None else self.export_cache
+        if cache is None:
+            return self._uncached_table_versions
+        with self._export_caches_lock:
+            if not any(known_cache is cache for known_cache in self._export_caches):
+                self._export_caches = self._export_caches + (cache,)
+        return cache
+
+    def export_table_versions(self, sql: str, database_name: Optional[str] = None, cache=None) -> dict[str, str]:
+        """The versions of the tables the sql reads, or of "*" if the tables could not be found, in cache (default
+        export_cache)"""
+        table_names = tables_in_sql(sql) or {"*"}
+        version_keys = {name: self.export_table_version_key(name, database_name) for name in table_names}
+        return get_table_versions(self._table_versions_cache(cache), version_keys)
+
+    def invalidate_export_cache(self, table_name: str, database_name: Optional[str] = None):
+        """Give the table, and the unknown tables of queries which could not be scanned ("*"), new versions in every
+        cache data_export_using_sql has used. Cached exports which read the table are then no longer found, and are
+        evicted or expire in time.
+        This is called after every write to a table made through this client (see table_written)."""
+        with self._export_caches_lock:
+            caches = (self._uncached_table_versions,) + self._export_caches
+        if self.export_cache is not None and not any(cache is self.export_cache for cache in caches):
+            caches = caches + (self.export_cache,)
+        for cache in caches:
+            for versioned_table in (table_name, "*"):
+                new_table_version(cache, self.export_table_version_key(versioned_table, database_name))
+        self.export_cache_stats.record("invalidations")
+        logger.debug("Invalidated the cached exports of %s", table_name)
+
+    def table_written(self, tableURI: str):
+        _, database_name, table_name = self.splitURI(tableURI)
+        self.invalidate_export_cache(table_name, database_name)
+
     def data_export_using_sql(
         self,
         sql,
@@ -317,20 +635,52 @@ class EnhancedZohoAnalyticsClient(report_client.ReportClient):
         cache_object=None,
         cache_timeout_seconds=60,
         retry_countdown=5,
+        stale_after_seconds: Optional[float] = None,
     ) -> csv.DictReader:
         """returns a csv.DictReader after querying with the sql provided.
         retry_countdown is the number of retries
         The Zoho API insists on a table or report name, but it doesn't seem to restrict the query
         The cache object has a get and set function like the django cache does: https://docs.djangoproject.com/en/3.1/topics/cache/
-        The cache key is the sql query"""
+        It defaults to the client's export_cache (e.g. export_cache.LRUMemoryCache or DiskCache).
+        The cache key is made from the normalized sql, the workspace and the data centre (see export_cache_key),
+        and the cached value holds the csv text and when it was fetched. Hits and misses are counted in
+        export_cache_stats.
+        The cache key includes the versions of the tables the sql reads, so writes through this client to one of
+        those tables invalidate it (see invalidate_export_cache); writes made elsewhere are only seen after the
+        cache timeout.
+        Identical exports (same workspace, normalized sql and format) made by several threads at once share one
+        request to Zoho; the callers which waited are counted as "coalesced" in export_cache_stats. As the key
+        includes the table versions, callers arriving after a write do not join an export started before it, and
+        that export is not cached (it is counted as "superseded").
+        stale_after_seconds turns on stale-while-revalidate: a cached export older than this (the soft TTL) is
+        still returned at once, and one background thread fetches a fresh copy. cache_timeout_seconds is then the
+        hard TTL, after which the entry has expired and the caller waits for Zoho."""
+        returned_data = self._export_csv_text(
+            sql, table_name, database_name, cache_object, cache_timeout_seconds, retry_countdown, stale_after_seconds
+        )
+        # the csv text, or a list of lines, was cached by older versions
+        lines = io.StringIO(returned_data, newline="") if isinstance(returned_data, str) else returned_data
+        reader = csv.DictReader(lines)
+        return reader
 
-        if cache_object:
-            returned_data = cache_object.get(sql)
-        else:
-            returned_data = None
-        if not returned_data:
-            database_name = database_name or self.default_databasename
-            assert database_name
+    def _export_csv_text(
+        self,
+        sql,
+        table_name,
+        database_name: Optional[str],
+        cache_object,
+        cache_timeout_seconds,
+        retry_countdown: int,
+        stale_after_seconds: Optional[float],
+    ) -> Union[str, List[str]]:
+        """The csv text of an export, from the cache or Zoho; see data_export_using_sql"""
+        database_name = database_name or self.default_databasename
+        assert database_name
+        cache = cache_object if cache_object is not None else self.export_cache
+        table_versions = self.export_table_versions(sql, database_name, cache)
+        cache_key = self.export_cache_key(sql, database_name, table_versions=table_versions)
+
+        def fetch() -> str:
             uri = self.getURI(
                 dbOwnerName=self.login_email_id,
                 dbName=database_name,
@@ -339,12 +689,267 @@ class EnhancedZohoAnalyticsClient(report_client.ReportClient):
             callback_data = self.exportDataUsingSQL_v2(
                 tableOrReportURI=uri, format="CSV", sql=sql, retry_countdown=retry_countdown
             )
-            returned_data = callback_data.getvalue().decode("utf-8-sig").splitlines()
-            if cache_object:
-                cache_object.set(sql, returned_data, cache_timeout_seconds)
+            csv_text = callback_data.getvalue().decode("utf-8-sig")
+            if cache is not None:
+                if self.export_table_versions(sql, database_name, cache) == table_versions:
+                    cache.set(cache_key, {"csv": csv_text, "fetched_at": time.time()}, cache_timeout_seconds)
+                else:
+                    # a table was written while this ran, so the csv may be older than the write
+                    self.export_cache_stats.record("superseded")
+                    logger.debug("Not caching an export which ran during a write to a table it reads: %s", sql)
+            return csv_text
 
-        reader = csv.DictReader(returned_data)
-        return reader
+        returned_data = cache.get(cache_key) if cache is not None else None
+        if cache is not None:
+            self.export_cache_stats.record("hits" if returned_data is not None else "misses")
+        if isinstance(returned_data, dict):
+            if stale_after_seconds is not None and time.time() - returned_data["fetched_at"] > stale_after_seconds:
+                self.export_cache_stats.record("stale_hits")
+                self._refresh_export_in_background(cache_key, fetch)
+            returned_data = returned_data["csv"]
+        if returned_data is None:
+            returned_data, shared = self.export_flights.do(cache_key, fetch)
+            if shared:
+                self.export_cache_stats.record("coalesced")
+        return returned_data
+
+    @staticmethod
+    def column_kinds_from_schema(
+        schema: ZohoSchemaModel_v2, table_names: Iterable[str]
+    ) -> dict[str, columnar.ColumnKind]:
+        """The kind of each column of the tables (see columnar.column_kind), by column name. Table names are not case
+        sensitive; when tables share a column name, the first table's column wins."""
+        tables_by_name = {name.lower(): table for name, table in schema.items()}
+        kinds: dict[str, columnar.ColumnKind] = {}
+        for table_name in table_names:
+            for column_name, column in tables_by_name.get(table_name.lower(), {}).items():
+                kinds.setdefault(column_name, columnar.column_kind(column))
+        return kinds
+
+    def _export_column_kinds(
+        self,
+        sql,
+        table_name: str,
+        database_name: str,
+        schema: Optional[ZohoSchemaModel_v2],
+        column_kinds: Optional[Mapping[str, columnar.ColumnKind]],
+    ) -> dict[str, columnar.ColumnKind]:
+        if schema is None:
+            schema = self.get_table_metadata_v2(database_name=database_name)
+        kinds = self.column_kinds_from_schema(schema, [table_name, *ordered_tables_in_sql(sql)])
+        kinds.update(column_kinds or {})
+        return kinds
+
+    def data_export_typed(
+        self,
+        sql,
+        table_name,
+        database_name: Optional[str] = None,
+        schema: Optional[ZohoSchemaModel_v2] = None,
+        column_kinds: Optional[Mapping[str, columnar.ColumnKind]] = None,
+        use_numpy: Optional[bool] = None,
+        cache_object=None,
+        cache_timeout_seconds=60,
+        retry_countdown=5,
+        stale_after_seconds: Optional[float] = None,
+    ) -> columnar.ColumnarResult:
+        """Like data_export_using_sql (with the same caching), but the csv is decoded into typed columns using the
+        data types of the table metadata: numbers, dates and booleans are arrays (NumPy arrays if it is installed),
+        see columnar.py.
+        Column types come from table_name and the tables the sql reads, matched by column name. schema is the
+        result of get_table_metadata_v2; pass it to save fetching the metadata on every call. column_kinds sets
+        or overrides the kind of result columns, e.g. {"total": "float"} for an aggregate or an alias."""
+        database_name = database_name or self.default_databasename
+        kinds = self._export_column_kinds(sql, table_name, database_name, schema, column_kinds)
+        csv_text = self._export_csv_text(
+            sql, table_name, database_name, cache_object, cache_timeout_seconds, retry_countdown, stale_after_seconds
+        )
+        if not isinstance(csv_text, str):
+            csv_text = "\n".join(csv_text)
+        return columnar.decode_csv(csv_text, kinds, use_numpy=use_numpy)
+
+    def export_to_dataframe(
+        self,
+        sql,
+        table_name: Optional[str] = None,
+        database_name: Optional[str] = None,
+        engine: dataframes.DataFrameEngine = "pandas",
+        schema: Optional[ZohoSchemaModel_v2] = None,
+        column_kinds: Optional[Mapping[str, columnar.ColumnKind]] = None,
+        cache_object=None,
+        cache_timeout_seconds=60,
+        retry_countdown=5,
+        stale_after_seconds: Optional[float] = None,
+    ):
+        """Export into a pandas DataFrame (engine="pandas") or a pyarrow Table (engine="arrow"). The csv is parsed
+        by the library's own csv reader, with dtypes from the table metadata as in data_export_typed; schema and
+        column_kinds work the same way. table_name defaults to the first table named in the sql (see
+        export_cache.ordered_tables_in_sql). Caching is the same as data_export_using_sql."""
+        dataframes.require(engine)
+        table_name = table_name or next(iter(ordered_tables_in_sql(sql)), None)
+        if not table_name:
+            raise ValueError("No table found in the sql, pass table_name")
+        database_name = database_name or self.default_databasename
+        kinds = self._export_column_kinds(sql, table_name, database_name, schema, column_kinds)
+        csv_text = self._export_csv_text(
+            sql, table_name, database_name, cache_object, cache_timeout_seconds, retry_countdown, stale_after_seconds
+        )
+        if not isinstance(csv_text, str):
+            csv_text = "\n".join(csv_text)
+        if engine == "arrow":
+            return dataframes.csv_to_arrow(csv_text, kinds)
+        return dataframes.csv_to_pandas(csv_text, kinds)
+
+    def upload_dataframe(
+        self,
+        frame,
+        table_name: str,
+        import_mode="TRUNCATEADD",
+        matching_columns: Optional[str] = None,
+        database_name: Optional[str] = None,
+        retry_limit=None,
+        chunk_row_count: int = 100_000,
+        max_workers: int = 4,
+        compress: bool = False,
+    ) -> Optional[report_client.ImportResult]:
+        """Upload a pandas DataFrame or a pyarrow Table. It is written as csv by the library's vectorized writer,
+        chunk_row_count rows at a time, and the chunks go through the chunked import of data_upload (the first
+        chunk of a TRUNCATEADD truncates, the rest are appended concurrently). The index of a DataFrame is not
+        uploaded; dates are sent in dataframes.UPLOAD_DATE_FORMAT."""
+        database_name = database_name or self.default_databasename
+        assert database_name
+        uri = self.getURI(dbOwnerName=self.login_email_id, dbName=database_name, tableOrReportName=table_name)
+        return self._import_chunks(
+            uri,
+            chunks=dataframes.iter_csv_chunks_of_frame(frame, chunk_row_count),
+            import_mode=import_mode,
+            matching_columns=matching_columns,
+            date_format=dataframes.ZOHO_DATE_FORMAT,
+            retry_limit=retry_limit or self.default_retries,
+            max_workers=max_workers,
+            compress=compress,
+        )
+
+    def _refresh_export_in_background(self, cache_key: str, fetch: Callable[[], str]):
+        """Start a thread which fetches an export again to replace a stale cached copy, unless one is running"""
+        if self.export_flights.in_flight(cache_key):
+            return
+
+        def refresh():
+            try:
+                self.export_flights.do(cache_key, fetch)
+            except Exception as e:
+                self.export_cache_stats.record("refresh_errors")
+                logger.warning("Background refresh of a cached export failed, the stale copy is kept: %r", e)
+            else:
+                self.export_cache_stats.record("refreshes")
+
+        threading.Thread(target=refresh, name="export-refresh", daemon=True).start()
+
+    def data_export_using_sql_stream(
+        self,
+        sql,
+        table_name,
+        database_name: Optional[str] = None,
+        retry_countdown=5,
+        chunk_size: int = 64 * 1024,
+    ) -> Iterator[dict[str, str]]:
+        """A generator version of data_export_using_sql which yields each row as a dict as it arrives.
+        The response is streamed and parsed incrementally, so memory use does not depend on the size of the export.
+        The request is made when the first row is requested. There is no caching."""
+        database_name = database_name or self.default_databasename
+        assert database_name
+        uri = self.getURI(
+            dbOwnerName=self.login_email_id,
+            dbName=database_name,
+            tableOrReportName=table_name,
+        )
+        response = self.exportDataUsingSQL_stream(
+            tableOrReportURI=uri, format="CSV", sql=sql, retry_countdown=retry_countdown
+        )
+        try:
+            lines = streaming.iter_text_lines(response.iter_content(chunk_size=chunk_size))
+            yield from csv.DictReader(lines)
+        finally:
+            response.close()
+
+    def data_export_partitioned(
+        self,
+        sql,
+        table_name,
+        partition_column: Optional[str] = None,
+        partitions: int = 4,
+        bounds: Optional[tuple[partitioning.PartitionValue, partitioning.PartitionValue]] = None,
+        database_name: Optional[str] = None,
+        max_workers: int = 4,
+        retry_countdown=5,
+        schema: Optional[ZohoSchemaModel_v2] = None,
+    ) -> Iterator[dict[str, str]]:
+        """Export a big query as several smaller ones which run concurrently, and yield the rows as dicts.
+        The results of sql are split into ranges of partition_column (a number or date column which sql selects):
+        the range is bounds, or else the min and max found by a first query. The ranges are exported by up to
+        max_workers threads, within the client's rate limits, and their rows are yielded in range order
+        (rows with a null partition_column come last). A range is only requested when a worker is free and fewer
+        than max_workers ranges are waiting to be yielded, so memory use is bounded by the size of max_workers + 1
+        ranges. Each range is an ordinary export, so each must finish within request_timeout.
+        Without partition_column, the table's first auto number, number or date column is used (from schema, the
+        result of get_table_metadata_v2, which is fetched if not given). The found bounds are parsed as the
+        column's data type in schema, if it is known. sql is used as a subquery, so Zoho must accept it in a FROM
+        clause. The requests are made when the first row is requested. There is no caching."""
+        database_name = database_name or self.default_databasename
+        assert database_name
+        table_model = {}
+        if partition_column is None or schema is not None:
+            schema = schema if schema is not None else self.get_table_metadata_v2(database_name=database_name)
+            table_model = {name.lower(): table for name, table in schema.items()}.get(table_name.lower(), {})
+        if partition_column is None:
+            partition_column = partitioning.choose_partition_column(table_model)
+            if partition_column is None:
+                raise ValueError(f"{table_name} has no number or date column to partition by, pass partition_column")
+        column = {name.lower(): model for name, model in table_model.items()}.get(partition_column.strip('"').lower())
+        uri = self.getURI(dbOwnerName=self.login_email_id, dbName=database_name, tableOrReportName=table_name)
+
+        def export(partition_sql: str) -> str:
+            callback_data = self.exportDataUsingSQL_v2(
+                tableOrReportURI=uri, format="CSV", sql=partition_sql, retry_countdown=retry_countdown
+            )
+            return callback_data.getvalue().decode("utf-8-sig")
+
+        if bounds is None:
+            bounds_csv = export(partitioning.bounds_sql(sql, partition_column))
+            row = next(csv.DictReader(io.StringIO(bounds_csv, newline="")), None)
+            if not row or not row["low"]:  # no rows, or only nulls in partition_column
+                yield from csv.DictReader(io.StringIO(export(sql), newline=""))
+                return
+            bounds = (
+                partitioning.parse_partition_value(row["low"], column),
+                partitioning.parse_partition_value(row["high"], column),
+            )
+        points = partitioning.split_points(bounds[0], bounds[1], partitions)
+        partition_sqls = partitioning.partition_sqls(sql, partition_column, points)
+        logger.info("Exporting %s partitions of %s by %s", len(partition_sqls), table_name, partition_column)
+
+        # a window of max_workers partitions is exported ahead of the one being yielded, so at most
+        # max_workers + 1 partitions are held in memory however many there are
+        remaining_sqls = iter(partition_sqls)
+        window: list[Future] = []
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        export_in_worker = self.bind_api_priority(export)
+
+        def submit_next():
+            partition_sql = next(remaining_sqls, None)
+            if partition_sql is not None:
+                window.append(executor.submit(export_in_worker, partition_sql))
+
+        try:
+            for _ in range(max_workers):
+                submit_next()
+            while window:
+                csv_text = window.pop(0).result()
+                submit_next()
+                yield from csv.DictReader(io.StringIO(csv_text, newline=""))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
     def delete_rows(self, table_name, sql, database_name: Optional[str] = None, retry_countdown: int = 5) -> int:
         """criteria is SQL fragments such as 'a' in ColA, for example,
@@ -409,3 +1014,222 @@ class EnhancedZohoAnalyticsClient(report_client.ReportClient):
             oldColumnName=old_column_name,
             newColumnName=new_column_name,
         )
+
+    def upstream_client(self) -> bulk.SharedTokenAnalyticsClient:
+        """The upstream AnalyticsClient for this account, created on first use. It shares this client's token."""
+        with self._upstream_client_lock:
+            if self._upstream_client is None:
+                self._upstream_client = bulk.SharedTokenAnalyticsClient(self, pool_maxsize=self.metadata_concurrency)
+            return self._upstream_client
+
+    def get_view_ids_by_name_v2(self, org_id: str, workspace_id: str) -> dict[str, str]:
+        """The view id of each table in the workspace, from one call listing the views"""
+        views = self.get_views_api_v2(org_id=org_id, workspace_id=workspace_id, view_types=[0])["data"]["views"]
+        return {view["viewName"]: view["viewId"] for view in views}
+
+    def _run_bulk_job(
+        self,
+        name: str,
+        submit: Callable[[], str],
+        get_job_details: Callable[[str], dict],
+        job_timeout_seconds: float,
+        poll_interval_seconds: float,
+        max_poll_interval_seconds: float,
+        on_completed: Optional[Callable[[str, BulkJobResult], None]] = None,
+    ) -> BulkJobResult:
+        """Submit a bulk API job, poll it until it finishes and call on_completed(job_id, result) if it completed.
+        Each API call is paced by pace_request. Errors are recorded in the result, except
+        UnrecoverableRateLimitError which is raised."""
+        started = time.monotonic()
+        result = BulkJobResult(
+            name=name,
+            job_id=None,
+            status="error",
+            job_code=None,
+            details={},
+            error=None,
+            elapsed_seconds=0.0,
+        )
+        try:
+            self.pace_request()
+            job_id = submit()
+            result["job_id"] = job_id
+
+            def get_details() -> dict:
+                self.pace_request()
+                return get_job_details(job_id)
+
+            status, result["details"] = bulk.wait_for_job(
+                get_details,
+                timeout_seconds=job_timeout_seconds,
+                poll_interval_seconds=poll_interval_seconds,
+                max_poll_interval_seconds=max_poll_interval_seconds,
+            )
+            result["job_code"] = bulk.job_code(result["details"])
+            if status == "completed" and on_completed is not None:
+                on_completed(job_id, result)
+            result["status"] = status  # type: ignore[typeddict-item]
+        except report_client.UnrecoverableRateLimitError:
+            raise
+        except Exception as ex:
+            logger.exception("Bulk job %s failed", name)
+            result["error"] = str(ex)
+        result["elapsed_seconds"] = time.monotonic() - started
+        logger.info("Bulk job %s for %s: %s", result["job_id"], name, result["status"])
+        return result
+
+    def bulk_import_many(
+        self,
+        jobs: Iterable[BulkImportJob],
+        database_name: Optional[str] = None,
+        max_concurrent_jobs: int = 4,
+        job_timeout_seconds: float = 60 * 60,
+        poll_interval_seconds: float = 2.0,
+        max_poll_interval_seconds: float = 30.0,
+        compress: bool = False,
+    ) -> List[BulkJobResult]:
+        """Import files into many tables with the v2 bulk API, which runs each import as a job on Zoho's side.
+        Up to max_concurrent_jobs jobs are in flight; when one finishes the next is submitted. Each job is polled
+        with backoff and jitter until it finishes or job_timeout_seconds pass (there is no API to cancel a job, so
+        a timed out job may still complete). Errors are reported in the results, which are in the order of jobs;
+        only UnrecoverableRateLimitError is raised.
+        compress sends each file zipped; if Zoho cannot read a zipped file (see is_compressed_import_rejection) it
+        is sent again uncompressed, and if that works compressed_uploads_supported is turned off."""
+        org_id, workspace_id = self.get_org_and_workspace_id(database_name=database_name)
+        view_ids = self.get_view_ids_by_name_v2(org_id=org_id, workspace_id=workspace_id)
+        bulk_api = self.upstream_client().get_bulk_instance(org_id, workspace_id)
+
+        def submit_import(job: BulkImportJob) -> str:
+            view_id = view_ids.get(job["table_name"])
+            if view_id is None:
+                raise ValueError(f"There is no table {job['table_name']} in the workspace")
+            import_args = (
+                view_id,
+                job.get("import_type", "append"),
+                job.get("file_type", "csv"),
+                "true" if job.get("auto_identify", True) else "false",
+                job["file_path"],
+            )
+            if compress and self.compressed_uploads_supported:
+                try:
+                    return bulk_api.import_bulk_data(*import_args, dict(job.get("config", {})), compression="zip")
+                except analytics_client_upstream.ServerError as e:
+                    if not isinstance(job["file_path"], str) or not self.is_compressed_import_rejection(e):
+                        raise  # only a file path can be read again, and only a rejected zip is worth resending
+                    logger.warning("Zoho rejected a compressed bulk import (%s), sending it uncompressed", e)
+                job_id = bulk_api.import_bulk_data(*import_args, dict(job.get("config", {})))
+                logger.warning("Compressed imports are turned off for this client")
+                self.compressed_uploads_supported = False
+                return job_id
+            return bulk_api.import_bulk_data(*import_args, dict(job.get("config", {})))
+
+        def run_job(job: BulkImportJob) -> BulkJobResult:
+            result = self._run_bulk_job(
+                job["table_name"],
+                submit=lambda: submit_import(job),
+                get_job_details=bulk_api.get_import_job_details,
+                job_timeout_seconds=job_timeout_seconds,
+                poll_interval_seconds=poll_interval_seconds,
+                max_poll_interval_seconds=max_poll_interval_seconds,
+            )
+            if result["job_id"] is not None:
+                self.invalidate_export_cache(job["table_name"], database_name)
+            return result
+
+        with ThreadPoolExecutor(max_workers=max_concurrent_jobs) as executor:
+            return list(executor.map(self.bind_api_priority(run_job), jobs))
+
+    def bulk_export_many(
+        self,
+        queries: Mapping[str, str],
+        output_dir: str = ".",
+        sinks: Optional[Mapping[str, Union[str, IO[bytes], Callable[[bytes], None]]]] = None,
+        response_format: str = "csv",
+        compress: bool = False,
+        database_name: Optional[str] = None,
+        max_concurrent_jobs: int = 4,
+        job_timeout_seconds: float = 60 * 60,
+        poll_interval_seconds: float = 2.0,
+        max_poll_interval_seconds: float = 30.0,
+    ) -> List[BulkJobResult]:
+        """Run many SQL exports as v2 bulk export jobs. queries maps a name to its SQL. Each result is streamed
+        as soon as its job completes to sinks[name], which is a path, a binary file object or a function called
+        with each chunk, or else to output_dir/name.response_format (.gz added with compress). A path is recorded
+        as the result's output. With compress the data is gzip compressed as it is written.
+        Up to max_concurrent_jobs jobs (including their downloads) are in flight at once.
+        A job still running after job_timeout_seconds is reported as a timeout and not downloaded; Zoho has no
+        API to cancel it. Errors are reported in the results, which are in the order of queries; only
+        UnrecoverableRateLimitError is raised."""
+        org_id, workspace_id = self.get_org_and_workspace_id(database_name=database_name)
+        bulk_api = self.upstream_client().get_bulk_instance(org_id, workspace_id)
+        sinks = sinks or {}
+
+        def run_job(name: str) -> BulkJobResult:
+            output = sinks.get(name) or os.path.join(
+                output_dir, f"{name}.{response_format}" + (".gz" if compress else "")
+            )
+
+            def download(job_id: str, result: BulkJobResult):
+                self.pace_request()
+                bulk_api.export_bulk_data(job_id, output, compress)
+                if isinstance(output, str):
+                    result["output"] = output
+
+            return self._run_bulk_job(
+                name,
+                submit=lambda: bulk_api.initiate_bulk_export_using_sql(queries[name], response_format, {}),
+                get_job_details=bulk_api.get_export_job_details,
+                job_timeout_seconds=job_timeout_seconds,
+                poll_interval_seconds=poll_interval_seconds,
+                max_poll_interval_seconds=max_poll_interval_seconds,
+                on_completed=download,
+            )
+
+        with ThreadPoolExecutor(max_workers=max_concurrent_jobs) as executor:
+            return list(executor.map(self.bind_api_priority(run_job), queries))
+
+
+class ZohoClientPool:
+    """A thread-safe registry of clients, one per (login email, data centre), for processes serving many Zoho accounts.
+    Each client has its own credentials, token, token store and connection pool, so the accounts don't block each
+    other. With token_directory, each client stores its token in its own file there (named by its token_key)
+    unless it is given a token_store; otherwise it uses its default per-account store."""
+
+    def __init__(
+        self,
+        client_class: type[EnhancedZohoAnalyticsClient] = EnhancedZohoAnalyticsClient,
+        token_directory: Optional[str] = None,
+    ):
+        self.client_class = client_class
+        self.token_directory = token_directory
+        self._clients: dict[tuple[str, str], EnhancedZohoAnalyticsClient] = {}
+        self._lock = threading.Lock()
+
+    def get_client(self, login_email_id: str, data_centre: str = "us", **client_kwargs) -> EnhancedZohoAnalyticsClient:
+        """Return the client for the account, creating it from client_kwargs (refresh_token, clientId etc.)
+        the first time. serverURL and reportServerURL default to the hosts of the data centre.
+        Raises KeyError if there is no client yet and no client_kwargs to make one."""
+        key = (login_email_id, data_centre)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                return client
+            if not client_kwargs:
+                raise KeyError(f"No Zoho client for {login_email_id} in data centre {data_centre}")
+            iam_url, analytics_url = ZOHO_DATA_CENTRES[data_centre]
+            client_kwargs.setdefault("serverURL", iam_url)
+            client_kwargs.setdefault("reportServerURL", analytics_url)
+            if self.token_directory is not None and client_kwargs.get("token_store") is None:
+                token_key = self.client_class.make_token_key(
+                    client_kwargs.get("clientId"), client_kwargs.get("refresh_token"), client_kwargs["serverURL"]
+                )
+                token_path = os.path.join(self.token_directory, f"access_token.{token_key}.json")
+                client_kwargs["token_store"] = FileTokenStore(token_path)
+            client = self.client_class(login_email_id=login_email_id, **client_kwargs)
+            self._clients[key] = client
+            return client
+
+    def remove_client(self, login_email_id: str, data_centre: str = "us"):
+        """Forget a client, e.g. after its refresh token was revoked"""
+        with self._lock:
+            self._clients.pop((login_email_id, data_centre), None)
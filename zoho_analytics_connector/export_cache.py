@@ -0,0 +1,342 @@
+"""Cache backends and cache keys for the results of SQL exports (EnhancedZohoAnalyticsClient.data_export_using_sql).
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+The backends have the get, set and delete functions of a django cache, so a django cache can be used instead.
+"""
+
+import collections
+import contextlib
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Any, Callable, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+# a single quoted string (quotes are escaped by doubling them), or a run of whitespace
+_SQL_TOKEN_RE = re.compile(r"('(?:[^']|'')*')|(\s+)")
+
+
+def normalize_sql(sql: str) -> str:
+    """A canonical form of a query for cache keys: whitespace is collapsed, a trailing semicolon is dropped and
+    everything outside string literals is lower-cased (Zoho's SQL keywords and names are not case sensitive)."""
+    parts = []
+    position = 0
+    for match in _SQL_TOKEN_RE.finditer(sql):
+        parts.append(sql[position : match.start()].lower())
+        literal, _ = match.groups()
+        parts.append(literal if literal else " ")
+        position = match.end()
+    parts.append(sql[position:].lower())
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+# words which can follow a table name in a FROM clause, so they are not taken for an alias
+_NOT_ALIASES = set(
+    "where join inner left right full outer cross natural on using group order having limit offset union "
+    "intersect except".split()
+)
+_SQL_WORD_RE = re.compile(r'"[^"]*"|`[^`]*`|\[[^\]]*\]|[\w.$]+|\S')
+
+
+def tables_in_sql(sql: str) -> set[str]:
+    """The (lower-cased) names of the tables a query reads: the names after FROM, in comma separated FROM lists
+    and after JOIN, including those in subqueries. This is a light scan rather than a parser; it returns an
+    empty set if it finds no table, and callers should then assume the query could read any table."""
+    return set(ordered_tables_in_sql(sql))
+
+
+def ordered_tables_in_sql(sql: str) -> list[str]:
+    """The names found by tables_in_sql, each once, in the order they appear in the sql"""
+    words = _SQL_WORD_RE.findall(_SQL_TOKEN_RE.sub(lambda m: "''" if m.group(1) else " ", sql).lower())
+    tables: dict[str, None] = {}
+    i = 0
+    while i < len(words):
+        if words[i] not in ("from", "join"):
+            i += 1
+            continue
+        i += 1
+        while i < len(words) and words[i] != "(":
+            tables.setdefault(words[i].strip('"`[]'))
+            i += 1
+            if i < len(words) and words[i] == "as":
+                i += 2
+            elif i < len(words) and words[i] not in _NOT_ALIASES and re.match(r"[\w\"`\[]", words[i]):
+                i += 1
+            if i < len(words) and words[i] == ",":
+                i += 1
+            else:
+                break
+    return list(tables)
+
+
+def _namespaced_key(kind: str, parts: list) -> str:
+    """A cache key made by hashing parts, so it is safe for memcached"""
+    return f"zoho_analytics_connector:{kind}:" + hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+def export_cache_key(
+    data_centre: str,
+    login_email_id: str,
+    workspace: str,
+    sql: str,
+    response_format: str,
+    table_versions: Optional[Mapping[str, str]] = None,
+) -> str:
+    """The cache key of an export. It is hashed, so it is safe for memcached, and namespaced by the data centre
+    (API host), the login and the workspace, as the same SQL gives different results in different workspaces.
+    table_versions are the versions of the tables the SQL reads (see get_table_versions), so a write to one of
+    them changes the key."""
+    parts = [data_centre, login_email_id, workspace, response_format.upper(), normalize_sql(sql)]
+    if table_versions:
+        parts.append(sorted(table_versions.items()))
+    return _namespaced_key("exports", parts)
+
+
+def table_version_key(data_centre: str, login_email_id: str, workspace: str, table_name: str) -> str:
+    """The key of a table's version ("*" is the version of queries whose tables are unknown, which changes with
+    every write). Versions are kept in the same cache as the exports, so processes sharing a cache see each
+    other's writes."""
+    return _namespaced_key("table_versions", [data_centre, login_email_id, workspace, table_name.lower()])
+
+
+def new_table_version(cache, version_key: str) -> str:
+    """Give a table a new version, after a write to it. This is a plain set, so concurrent writers cannot lose
+    each other's updates."""
+    version = uuid.uuid4().hex
+    cache.set(version_key, version, None)
+    return version
+
+
+def get_table_versions(cache, version_keys: Mapping[str, str]) -> dict[str, str]:
+    """The version of each table, by name, from a mapping of table names to version keys. A missing version (never
+    written, or evicted from the cache) is replaced by a new one, so losing a version only causes cache misses;
+    it cannot make an export cached before a write look current."""
+    versions = {}
+    for table_name, version_key in version_keys.items():
+        version = cache.get(version_key)
+        versions[table_name] = version if version is not None else new_table_version(cache, version_key)
+    return versions
+
+
+def value_size(value: Any) -> int:
+    """The approximate size in bytes of a cached export"""
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict) and isinstance(value.get("csv"), str):
+        return len(value["csv"])
+    return len(json.dumps(value, default=str))
+
+
+class CacheStats:
+    """Thread-safe counters (hits, misses, sets, evictions etc.), for monitoring a cache"""
+
+    def __init__(self):
+        self._counts: collections.Counter[str] = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record(self, event: str, count: int = 1):
+        with self._lock:
+            self._counts[event] += count
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    @property
+    def hit_ratio(self) -> Optional[float]:
+        counts = self.snapshot()
+        lookups = counts.get("hits", 0) + counts.get("misses", 0)
+        return counts.get("hits", 0) / lookups if lookups else None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key: while a call for a key is running, callers asking for the same
+    key wait for it and share its result (or exception) instead of making the call again."""
+
+    def __init__(self):
+        self._calls: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def in_flight(self, key: str) -> bool:
+        with self._lock:
+            return key in self._calls
+
+    def do(self, key: str, fn: Callable[[], Any]) -> tuple[Any, bool]:
+        """Returns the result of fn() and whether it was shared from a call made by another thread"""
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self._calls[key] = Future()
+        if not is_leader:
+            return future.result(), True
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+        future.set_result(result)
+        return result, False
+
+
+class LRUMemoryCache:
+    """An in-process cache which evicts the least recently used entries to stay under max_bytes.
+    timeout is in seconds like django's; None means the entry does not expire."""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.stats = CacheStats()
+        self._entries: collections.OrderedDict[str, tuple[Any, int, Optional[float]]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.record("misses")
+                return default
+            value, _, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.stats.record("misses")
+                return default
+            self._entries.move_to_end(key)
+            self.stats.record("hits")
+            return value
+
+    def set(self, key: str, value, timeout: Optional[float] = None):
+        size = value_size(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                logger.debug("Not caching %s, it is bigger than the whole cache", key)
+                return
+            expires_at = time.monotonic() + timeout if timeout is not None else None
+            self._entries[key] = (value, size, expires_at)
+            self.current_bytes += size
+            self.stats.record("sets")
+            while self.current_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.stats.record("evictions")
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self.current_bytes -= size
+
+
+class DiskCache:
+    """A cache of gzip compressed JSON files in a directory, which can be shared by the processes on a host.
+    Writes are atomic (a temporary file is renamed). When the files take more than max_bytes, the least recently
+    read are deleted, down to evict_to_fraction of max_bytes. timeout is in seconds like django's; None means the
+    entry does not expire.
+
+    The directory is only scanned when a running total of the bytes written passes max_bytes. The total does not
+    see the writes of other processes, so the files can briefly take more than max_bytes until this process scans."""
+
+    evict_to_fraction = 0.9
+
+    def __init__(self, directory: str, max_bytes: Optional[int] = 1024 * 1024 * 1024, compresslevel: int = 6):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.compresslevel = compresslevel
+        self.stats = CacheStats()
+        self._approx_bytes: Optional[int] = None  # the bytes in the directory as of the last scan, plus writes since
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json.gz")
+
+    def get(self, key: str, default=None):
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as in_file:
+                entry = json.load(in_file)
+        except FileNotFoundError:
+            self.stats.record("misses")
+            return default
+        except (OSError, ValueError) as e:
+            logger.warning("Discarding unreadable cache file %s: %s", path, e)
+            self.delete(key)
+            self.stats.record("misses")
+            return default
+        if entry["expires_at"] is not None and entry["expires_at"] <= time.time():
+            self.delete(key)
+            self.stats.record("misses")
+            return default
+        with contextlib.suppress(OSError):
+            os.utime(path)  # the modification time records the last use, for eviction
+        self.stats.record("hits")
+        return entry["value"]
+
+    def set(self, key: str, value, timeout: Optional[float] = None):
+        entry = {"expires_at": time.time() + timeout if timeout is not None else None, "value": value}
+        temporary_path = None
+        try:
+            with tempfile.NamedTemporaryFile("wb", dir=self.directory, prefix=".cache-", delete=False) as out_file:
+                temporary_path = out_file.name
+                with gzip.GzipFile(fileobj=out_file, mode="wb", compresslevel=self.compresslevel) as gzip_file:
+                    gzip_file.write(json.dumps(entry).encode("utf-8"))
+                written_bytes = out_file.tell()
+            os.replace(temporary_path, self._path(key))
+        except Exception as e:
+            logger.error("Error writing cache file for %s: %s", key, e)
+            if temporary_path is not None:
+                with contextlib.suppress(OSError):
+                    os.unlink(temporary_path)
+            return
+        self.stats.record("sets")
+        if self.max_bytes is not None:
+            self._evict(written_bytes)
+
+    def delete(self, key: str):
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self._path(key))
+
+    def _evict(self, written_bytes: int):
+        if self._approx_bytes is not None:
+            self._approx_bytes += written_bytes
+            if self._approx_bytes <= self.max_bytes:
+                return
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json.gz"):
+                with contextlib.suppress(FileNotFoundError):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        total_bytes = sum(size for _, size, _ in files)
+        if total_bytes > self.max_bytes:
+            for _, size, path in sorted(files):
+                if total_bytes <= self.max_bytes * self.evict_to_fraction:
+                    break
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(path)
+                    self.stats.record("evictions")
+                total_bytes -= size
+        self._approx_bytes = total_bytes
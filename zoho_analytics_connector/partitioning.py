@@ -0,0 +1,97 @@
+"""Split a SQL export into disjoint ranges of a key or date column, so the ranges can be exported concurrently
+(see EnhancedZohoAnalyticsClient.data_export_partitioned).
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+import datetime
+from typing import Mapping, Optional, Union
+
+from .columnar import column_kind, parse_date, parse_number
+
+PartitionValue = Union[int, float, datetime.datetime]
+
+# v2 dataType names of columns which can be partitioned, most preferred first
+PARTITION_DATA_TYPES = ("AUTO_NUMBER", "NUMBER", "POSITIVE_NUMBER", "DATE", "DECIMAL_NUMBER")
+
+
+def choose_partition_column(table_model: Mapping[str, Mapping]) -> Optional[str]:
+    """A column of the table to partition by, from its v2 metadata: an auto number, else a number, else a date.
+    None if the table has no such column."""
+    for data_type in PARTITION_DATA_TYPES:
+        for column_name, column in table_model.items():
+            if column.get("dataType") == data_type:
+                return column_name
+    return None
+
+
+def _parse_formatted_number(text: str) -> Union[int, float]:
+    number = parse_number(text)
+    return int(number) if number.is_integer() and "." not in text else number
+
+
+def parse_partition_value(text: str, column: Optional[Mapping] = None) -> PartitionValue:
+    """A bound of a partition column, as exported in csv. Numbers may be formatted, e.g. "1,234.5".
+    With the column's v2 metadata, the value is parsed as its dataType; else as a number or a date."""
+    kind = column_kind(column) if column is not None else None
+    if kind in ("int", "float"):
+        parsers: tuple = (_parse_formatted_number,)
+    elif kind == "date":
+        parsers = (parse_date,)
+    else:
+        parsers = (int, float, parse_date, _parse_formatted_number)
+    for parse in parsers:
+        try:
+            return parse(text)  # type: ignore[operator]
+        except ValueError:
+            continue
+    raise ValueError(f"Can only partition by a number or a date column, not by values like {text!r}")
+
+
+def split_points(low: PartitionValue, high: PartitionValue, partitions: int) -> list[PartitionValue]:
+    """Up to partitions - 1 increasing values which split [low, high] into ranges of about equal width.
+    Integer and date points are whole numbers and whole seconds; duplicates are dropped, so a narrow range gives
+    fewer partitions."""
+    if isinstance(low, datetime.datetime):
+        step = (high - low) / partitions  # type: ignore[operator]
+        points: list[PartitionValue] = [(low + step * i).replace(microsecond=0) for i in range(1, partitions)]
+    elif isinstance(low, int) and isinstance(high, int):
+        width = high - low + 1
+        points = [low + (width * i) // partitions for i in range(1, partitions)]
+    else:
+        points = [low + (high - low) * i / partitions for i in range(1, partitions)]  # type: ignore[operator]
+    return sorted({point for point in points if low < point <= high})  # type: ignore[operator]
+
+
+def quote_identifier(column_name: str) -> str:
+    return '"' + column_name.strip('"').replace('"', '""') + '"'
+
+
+def sql_literal(value: PartitionValue) -> str:
+    if isinstance(value, datetime.datetime):
+        return f"'{value:%Y-%m-%d %H:%M:%S}'"
+    return repr(value)
+
+
+def _subquery(sql: str) -> str:
+    return "(" + sql.strip().rstrip(";") + ") AS partition_source"
+
+
+def bounds_sql(sql: str, column_name: str) -> str:
+    """A query for the low and high values of the partition column in the results of sql, and their count"""
+    column = quote_identifier(column_name)
+    return f"SELECT MIN({column}) AS low, MAX({column}) AS high, COUNT(*) AS row_count FROM {_subquery(sql)}"
+
+
+def partition_sqls(sql: str, column_name: str, points: list[PartitionValue]) -> list[str]:
+    """One query per range between the split points. The first and last ranges are open ended, so rows outside
+    the bounds found earlier are not lost, and a final query gets the rows where the column is null."""
+    column = quote_identifier(column_name)
+    literals = [sql_literal(point) for point in points]
+    conditions = [f"{column} < {literals[0]}"] if literals else [f"{column} IS NOT NULL"]
+    conditions += [f"{column} >= {lower} AND {column} < {upper}" for lower, upper in zip(literals, literals[1:])]
+    conditions += [f"{column} >= {literals[-1]}"] if literals else []
+    conditions.append(f"{column} IS NULL")
+    return [f"SELECT * FROM {_subquery(sql)} WHERE {condition}" for condition in conditions]
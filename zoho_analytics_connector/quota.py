@@ -0,0 +1,103 @@
+"""Local accounting of the daily API quota (Zoho error 6043), so that low priority work stops before the quota is gone.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+import contextlib
+import datetime
+import logging
+import sqlite3
+from typing import Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+# the share of the daily quota which is kept back from each priority: low priority calls stop when 25% of the
+# quota is left, normal at 10%, so that high priority calls can use the rest
+DEFAULT_PRIORITY_RESERVES: Mapping[str, float] = {"high": 0.0, "normal": 0.1, "low": 0.25}
+
+
+def utc_day() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+
+
+class ApiQuotaTracker:
+    """Counts API units per key (an org) per UTC day in a sqlite file, shared by all the processes using the file.
+
+    daily_limit is the number of API units in your Zoho plan. Zoho counts in the org's time zone, so set
+    daily_limit a little under the plan's limit. When Zoho reports 6043 the key is marked exhausted for the day,
+    whatever the local count says."""
+
+    def __init__(
+        self,
+        path: str,
+        daily_limit: int,
+        priority_reserves: Optional[Mapping[str, float]] = None,
+        timeout: float = 30,
+    ):
+        self.path = path
+        self.daily_limit = daily_limit
+        self.priority_reserves = dict(priority_reserves or DEFAULT_PRIORITY_RESERVES)
+        self.timeout = timeout
+        with contextlib.closing(self._connect()) as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS api_quota_usage "
+                "(key TEXT, day TEXT, units INTEGER, exhausted INTEGER, PRIMARY KEY (key, day))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+
+    def try_consume(self, key: str, units: int = 1, priority: str = "normal") -> bool:
+        """Count units against today's quota for key, if that leaves at least the reserve of the priority.
+        Returns False, counting nothing, if it would not."""
+        allowance = self.daily_limit * (1 - self.priority_reserves[priority])
+        day = utc_day()
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT units, exhausted FROM api_quota_usage WHERE key = ? AND day = ?", (key, day)
+            ).fetchone()
+            used, exhausted = row if row else (0, 0)
+            if exhausted or used + units > allowance:
+                connection.execute("ROLLBACK")
+                return False
+            connection.execute(
+                "INSERT OR REPLACE INTO api_quota_usage (key, day, units, exhausted) VALUES (?, ?, ?, 0)",
+                (key, day, used + units),
+            )
+            connection.execute("COMMIT")
+            return True
+        finally:
+            connection.close()
+
+    def mark_exhausted(self, key: str):
+        """Record that Zoho has reported the daily limit exceeded for key"""
+        day = utc_day()
+        with contextlib.closing(self._connect()) as connection:
+            connection.execute(
+                "INSERT INTO api_quota_usage (key, day, units, exhausted) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT (key, day) DO UPDATE SET exhausted = 1",
+                (key, day, self.daily_limit),
+            )
+        logger.error("Daily API quota for %s is exhausted", key)
+
+    def used(self, key: str) -> int:
+        with contextlib.closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT units FROM api_quota_usage WHERE key = ? AND day = ?", (key, utc_day())
+            ).fetchone()
+        return row[0] if row else 0
+
+    def remaining(self, key: str, priority: str = "high") -> int:
+        """The units left today for key at the priority (by default, the whole remaining quota)"""
+        with contextlib.closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT units, exhausted FROM api_quota_usage WHERE key = ? AND day = ?", (key, utc_day())
+            ).fetchone()
+        used, exhausted = row if row else (0, 0)
+        if exhausted:
+            return 0
+        return max(0, int(self.daily_limit * (1 - self.priority_reserves[priority])) - used)
@@ -0,0 +1,172 @@
+"""Client-side request pacing and in-flight request limits, so that workers stay under the Zoho rate limits.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+import abc
+import collections
+import contextlib
+import logging
+import sqlite3
+import threading
+import time
+from typing import Iterator, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter(abc.ABC):
+    """Base class for rate limiters. ReportClient calls acquire(key) before sending each request."""
+
+    @abc.abstractmethod
+    def acquire(self, key: str) -> float:
+        """Block until a request for key may be sent. Returns the seconds waited."""
+
+
+def take_token(tokens: float, updated: float, now: float, rate: float, capacity: float) -> tuple[float, float]:
+    """Token bucket arithmetic: refill the bucket for the time since it was updated, then take one token.
+
+    Returns the tokens left and the seconds the caller must wait. A caller that has to wait still takes its
+    token, so the bucket goes negative and later callers queue up behind it instead of all waking together."""
+    tokens = min(capacity, tokens + (now - updated) * rate) - 1
+    wait = -tokens / rate if tokens < 0 else 0.0
+    return tokens, wait
+
+
+class TokenBucketRateLimiter(RateLimiter):
+    """A token bucket per key (e.g. per org) shared by the threads of a process.
+
+    requests_per_minute is the sustained rate; burst is how many requests can be sent at once after a quiet
+    period (default: one second's worth, at least 1)."""
+
+    def __init__(self, requests_per_minute: float, burst: Optional[float] = None):
+        self.rate = requests_per_minute / 60
+        self.capacity = burst if burst is not None else max(1.0, self.rate)
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str) -> float:
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(key, (self.capacity, now))
+            tokens, wait = take_token(tokens, updated, now, self.rate, self.capacity)
+            self._buckets[key] = (tokens, now)
+        if wait:
+            logger.debug("Rate limiter: waiting %.2f seconds to send a request for %s", wait, key)
+            time.sleep(wait)
+        return wait
+
+
+class SqliteRateLimiter(RateLimiter):
+    """A token bucket per key kept in a sqlite file, so it is shared by all the processes on a host which use the file.
+    Each acquire is one short write transaction."""
+
+    def __init__(self, path: str, requests_per_minute: float, burst: Optional[float] = None, timeout: float = 30):
+        self.path = path
+        self.rate = requests_per_minute / 60
+        self.capacity = burst if burst is not None else max(1.0, self.rate)
+        self.timeout = timeout
+        with contextlib.closing(self._connect()) as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+
+    def acquire(self, key: str) -> float:
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            now = time.time()  # wall clock time, because it is compared between processes
+            row = connection.execute("SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (self.capacity, now)
+            tokens, wait = take_token(tokens, updated, now, self.rate, self.capacity)
+            connection.execute(
+                "INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now)
+            )
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+        if wait:
+            logger.debug("Rate limiter: waiting %.2f seconds to send a request for %s", wait, key)
+            time.sleep(wait)
+        return wait
+
+
+class LimitChange(NamedTuple):
+    time: float  # time.time()
+    limit: int
+    reason: str  # "increase", or the Zoho error code which caused a decrease
+
+
+class AdaptiveConcurrencyLimiter:
+    """Limits the requests in flight, adjusting the limit AIMD style (like TCP congestion control).
+
+    Each successful response adds 1/limit to the limit, so it grows by about one per round of requests, up to
+    max_limit. A throttling error from Zoho (see ReportClient.THROTTLE_ZOHO_ERROR_CODES) multiplies it by
+    decrease_factor, down to min_limit; the requests already in flight when that happens usually fail too, so
+    further throttling errors within decrease_cooldown_seconds don't cut it again.
+    limit is the current limit and history holds the last history_size changes, for monitoring."""
+
+    def __init__(
+        self,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 16,
+        decrease_factor: float = 0.5,
+        decrease_cooldown_seconds: float = 5.0,
+        history_size: int = 100,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown_seconds = decrease_cooldown_seconds
+        self.history: collections.deque[LimitChange] = collections.deque(maxlen=history_size)
+        self.in_flight = 0
+        self._limit = float(initial_limit)
+        self._last_decrease = float("-inf")
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self) -> Iterator[None]:
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def on_success(self):
+        with self._condition:
+            old_limit = self.limit
+            self._limit = min(float(self.max_limit), self._limit + 1 / self._limit)
+            if self.limit > old_limit:
+                self.history.append(LimitChange(time.time(), self.limit, "increase"))
+                self._condition.notify_all()
+
+    def on_throttle(self, zoho_error_code: int):
+        with self._condition:
+            now = time.monotonic()
+            if now - self._last_decrease < self.decrease_cooldown_seconds:
+                return
+            self._last_decrease = now
+            self._limit = max(float(self.min_limit), self._limit * self.decrease_factor)
+            self.history.append(LimitChange(time.time(), self.limit, str(zoho_error_code)))
+            logger.info("Zoho error %s, in-flight request limit reduced to %s", zoho_error_code, self.limit)
@@ -6,17 +6,22 @@ License, v. 2.0. If a copy of the MPL was not distributed with this
 file, You can obtain one at https://mozilla.org/MPL/2.0/.
 """
 
+import contextlib
+import copy
+import hashlib
 import io
 import json
 import logging
 import os
 import random
 import re
+import tempfile
+import threading
 import time
 import urllib
 import urllib.parse
 import xml.dom.minidom
-from typing import MutableMapping, Optional, Union, List, Any
+from typing import MutableMapping, Optional, Union, List, Any, Callable
 
 import requests
 from requests.adapters import HTTPAdapter, Retry
@@ -25,6 +30,14 @@ from zoho_analytics_connector.zoho_analytics_connector.model_helpers import (
     AnalyticsTableZohoDef_v2,
     ColumnUpdateDef_v2,
 )
+from zoho_analytics_connector.zoho_analytics_connector.quota import ApiQuotaTracker
+from zoho_analytics_connector.zoho_analytics_connector.rate_limit import AdaptiveConcurrencyLimiter, RateLimiter
+from zoho_analytics_connector.zoho_analytics_connector.streaming import (
+    CSVFormBody,
+    MultipartFileBody,
+    iter_csv_lines,
+)
+from zoho_analytics_connector.zoho_analytics_connector.token_store import FileTokenStore, TokenStore
 from zoho_analytics_connector.zoho_analytics_connector.typed_dicts import (
     DataTypeAddColumn,
     ZohoWorkspacesResponse,
@@ -85,11 +98,38 @@ class ReportClient:
     kindly send parameter as ReportClient(token,clientId,clientSecret).
     """
 
-    # Define a default file name for token persistence.
+    # Define a default file name for token persistence. The default store adds token_key to the name, so each
+    # account has its own file (e.g. access_token.0123456789abcdef.json)
     token_file = "access_token.json"
+    token_key: Optional[str] = None
 
-    isOAuth = False
+    isOAuth = False  # the default; each client sets its own in __init__
     request_timeout = 60
+    # when IAM does not say how long a token lives, it is refreshed when it is older than token_max_age_seconds;
+    # otherwise token_expiry_leeway_seconds before it expires. Within token_refresh_margin_seconds of that,
+    # it is refreshed in a background thread
+    token_max_age_seconds = 50 * 60
+    token_expiry_leeway_seconds = 10 * 60
+    token_refresh_margin_seconds = 5 * 60
+    token_expires_at: Optional[float] = None
+    # optional client-side pacing of requests (see rate_limit.py) and daily quota accounting (see quota.py).
+    # Requests are counted against rate_limit_key, which defaults to reportServerURL (login_email_id for
+    # EnhancedZohoAnalyticsClient); use the org id when clients for several logins share an org
+    rate_limiter: Optional[RateLimiter] = None
+    rate_limit_key: Optional[str] = None
+    quota_tracker: Optional[ApiQuotaTracker] = None
+    default_api_priority = "normal"
+    # optional limit on requests in flight, which adapts to these errors: rate limit exceeded,
+    # another import is in progress, table design change in progress
+    concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None
+    THROTTLE_ZOHO_ERROR_CODES = (6045, 10001, 7198)
+    # imports with compress=True send a zip file; set to False when Zoho rejects one which it accepts uncompressed
+    compressed_uploads_supported = True
+    # Zoho's error codes for an import file it cannot read; only these make a compressed import fall back
+    COMPRESSED_IMPORT_REJECTED_ZOHO_ERROR_CODES = (7280,)
+    # a compressed import's csv is kept in memory up to this size, and in a temporary file beyond it
+    IMPORT_SPOOL_MAX_BYTES = 8 * 1024 * 1024
+    __access_token: Optional[str] = None
 
     def __init__(
         self,
@@ -100,9 +140,20 @@ class ReportClient:
         reportServerURL=None,
         default_retries=6,
         access_token=None,
+        token_store: Optional[TokenStore] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        rate_limit_key: Optional[str] = None,
+        concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+        quota_tracker: Optional[ApiQuotaTracker] = None,
     ):
         """
         Initializes a ReportClient instance.
+        token_store persists the OAuth access token; it defaults to a FileTokenStore for token_file, named for the
+        account (see token_key). Processes which share a store share one token, and only one of them refreshes it
+        at a time. Stored tokens are tagged with token_key, and a token stored for another account is ignored.
+        rate_limiter paces requests before they are sent (e.g. TokenBucketRateLimiter(requests_per_minute=100)).
+        concurrency_limiter limits requests in flight, e.g. from the threads of a chunked upload.
+        quota_tracker counts requests against the daily API quota; see api_priority.
         """
         self.iamServerURL = serverURL or "https://accounts.zoho.com"
         self.reportServerURL = reportServerURL or "https://analyticsapi.zoho.com"
@@ -112,72 +163,177 @@ class ReportClient:
         self.refresh_token = refresh_token
         self.token_timestamp = time.time()  # use current time as a safe default
         self.default_retries = default_retries
-
-        if clientId is None and clientSecret is None:
+        self.rate_limiter = rate_limiter
+        self.rate_limit_key = rate_limit_key
+        self.concurrency_limiter = concurrency_limiter
+        self.quota_tracker = quota_tracker
+        self.token_key = self.make_token_key(clientId, refresh_token, self.iamServerURL)
+        self.token_store = token_store if token_store is not None else self.default_token_store()
+        self._token_refresh_lock = threading.Lock()
+        self._last_background_refresh = 0.0
+
+        # the auth mode belongs to the instance, so OAuth and authtoken clients can be used in the same process
+        self.isOAuth = not (clientId is None and clientSecret is None)
+        if not self.isOAuth:
             # not using OAuth2, so use the refresh_token as the access token
             self.__access_token = refresh_token
         else:
             # If an access token is provided directly, use it.
             # Otherwise, try to load an existing persisted token.
             self.__access_token = access_token or self.load_token()
-            ReportClient.isOAuth = True
+
+    @staticmethod
+    def make_token_key(clientId: Optional[str], refresh_token: Optional[str], iam_server_url: str) -> str:
+        """Identifies the account a stored token belongs to: the client id, the refresh token (hashed, so it is not
+        written to the store) and the IAM server"""
+        refresh_token_hash = hashlib.sha256((refresh_token or "").encode("utf-8")).hexdigest()
+        account = json.dumps([clientId, refresh_token_hash, iam_server_url])
+        return hashlib.sha256(account.encode("utf-8")).hexdigest()[:16]
+
+    def default_token_file(self) -> str:
+        """token_file with the token_key in its name"""
+        root, extension = os.path.splitext(self.token_file)
+        return f"{root}.{self.token_key}{extension}"
+
+    def default_token_store(self) -> TokenStore:
+        return FileTokenStore(self.default_token_file())
+
+    def _is_own_token(self, token_data: Optional[dict]) -> bool:
+        """Whether stored token data was saved for this client's account"""
+        return bool(token_data) and token_data.get("token_key") == self.token_key  # type: ignore[union-attr]
 
     @property
     def access_token(self):
         """
         Returns a valid access token. If the current token is expired or None, it will refresh it.
-        """
-        # Consider token expired if more than 50 minutes old or never set.
-        if ReportClient.isOAuth and (time.time() - self.token_timestamp > 50 * 60 or self.__access_token is None):
-            logger.debug("Refreshing Zoho Analytics OAuth token")
-            self.getOAuthToken()
+        Shortly before it expires, it is refreshed in a background thread so callers don't wait for IAM.
+        """
+        if self.isOAuth:
+            seconds_left = self._token_refresh_deadline(self.token_timestamp, self.token_expires_at) - time.time()
+            if self.__access_token is None or seconds_left < 0:
+                self.refresh_access_token(stale_token=self.__access_token)
+            elif seconds_left < self.token_refresh_margin_seconds:
+                self._start_background_token_refresh()
         return self.__access_token
 
+    def _token_refresh_deadline(self, token_timestamp: float, expires_at: Optional[float]) -> float:
+        """The time after which a token should no longer be used"""
+        if expires_at:
+            return expires_at - self.token_expiry_leeway_seconds
+        return token_timestamp + self.token_max_age_seconds
+
+    def refresh_access_token(self, stale_token: Optional[str] = None) -> str:
+        """
+        Single-flight token refresh. Only one thread calls IAM at a time; threads which were waiting for the lock
+        get the token it fetched instead of refreshing again.
+        stale_token is the token the caller found to be expired or rejected. If the current token is a different
+        one, another thread has already refreshed it.
+        """
+        with self._token_refresh_lock:
+            return self._refresh_access_token_locked(stale_token)
+
+    def _refresh_access_token_locked(self, stale_token: Optional[str]) -> str:
+        """Refresh the token, holding _token_refresh_lock. The token store is locked too, so that when another
+        process has already refreshed, its token is used rather than asking IAM again."""
+        if self.__access_token is not None and self.__access_token != stale_token:
+            return self.__access_token
+        with self.token_store.lock():
+            if self._adopt_stored_token(stale_token):
+                logger.debug("Using the Zoho Analytics OAuth token refreshed by another process")
+                return self.__access_token
+            logger.debug("Refreshing Zoho Analytics OAuth token")
+            return self.getOAuthToken()
+
+    def _adopt_stored_token(self, stale_token: Optional[str]) -> bool:
+        """Switch to the stored token if it is not the stale one and is not due for a refresh"""
+        token_data = self.token_store.load()
+        if not self._is_own_token(token_data) or token_data.get("access_token") in (None, stale_token):
+            return False
+        token_timestamp = token_data.get("token_timestamp", 0)
+        expires_at = token_data.get("expires_at")
+        deadline = self._token_refresh_deadline(token_timestamp, expires_at)
+        if deadline - time.time() < self.token_refresh_margin_seconds:
+            return False
+        self.__access_token = token_data["access_token"]
+        self.token_timestamp = token_timestamp
+        self.token_expires_at = expires_at
+        return True
+
+    def _start_background_token_refresh(self):
+        """Refresh the token in a daemon thread, unless a refresh is running or one was attempted in the last minute"""
+        if time.monotonic() - self._last_background_refresh < 60:
+            return
+        if not self._token_refresh_lock.acquire(blocking=False):
+            return  # a refresh is already in progress
+        self._last_background_refresh = time.monotonic()
+        stale_token = self.__access_token
+
+        def refresh():
+            try:
+                self._refresh_access_token_locked(stale_token)
+            except Exception as e:
+                logger.warning("Background refresh of the Zoho OAuth token failed: %s", e)
+            finally:
+                self._token_refresh_lock.release()
+
+        threading.Thread(target=refresh, name="zoho-oauth-token-refresh", daemon=True).start()
+
     @access_token.setter
     def access_token(self, token):
         self.__access_token = token
         self.token_timestamp = time.time()
+        self.token_expires_at = None
         # Persist the token whenever it is updated.
         self.persist_token(token)
 
     def persist_token(self, token: str):
         """
         Default implementation of token persistence.
-        Saves the access token and token timestamp as JSON to a local file.
+        Saves the access token, token timestamp and expiry time to the token store.
         Subclasses may override this method to provide a different persistence mechanism.
         """
-        data = {"access_token": token, "token_timestamp": self.token_timestamp}
-        try:
-            with open(self.token_file, "w") as out_file:
-                json.dump(data, out_file)
-            logger.debug("Access token persisted to %s", self.token_file)
-        except Exception as e:
-            logger.error("Error persisting the token: %s", e)
+        self.token_store.save(
+            {
+                "access_token": token,
+                "token_timestamp": self.token_timestamp,
+                "expires_at": self.token_expires_at,
+                "token_key": self.token_key,
+            }
+        )
 
     def load_token(self) -> Optional[str]:
         """
         Default implementation of token loading.
-        Loads the access token and token timestamp from a local JSON file.
+        Loads the access token, token timestamp and expiry time from the token store.
         Subclasses may override this method to provide a different persistence mechanism.
         Returns:
-            The access token if found; otherwise, returns None.
+            The access token if found for this client's account (see token_key); otherwise, returns None.
         """
-        if os.path.exists(self.token_file):
-            try:
-                with open(self.token_file, "r") as in_file:
-                    data = json.load(in_file)
-                    self.token_timestamp = data.get("token_timestamp", time.time())
-                    logger.debug("Access token loaded from %s", self.token_file)
-                    return data.get("access_token")
-            except Exception as e:
-                logger.error("Error loading the token: %s", e)
-        return None
+        token_data = self.token_store.load()
+        if not self._is_own_token(token_data):
+            return None
+        self.token_timestamp = token_data.get("token_timestamp", time.time())
+        self.token_expires_at = token_data.get("expires_at")
+        return token_data.get("access_token")
+
+    @staticmethod
+    def token_lifetime_seconds(token_response: dict) -> Optional[float]:
+        """
+        The lifetime of a token from an IAM token response, or None if it is not given.
+        expires_in is in seconds, but older IAM responses give it in milliseconds alongside expires_in_sec.
+        """
+        if "expires_in_sec" in token_response:
+            return float(token_response["expires_in_sec"])
+        if "expires_in" not in token_response:
+            return None
+        expires_in = float(token_response["expires_in"])
+        return expires_in / 1000 if expires_in > 24 * 60 * 60 else expires_in
 
     def getOAuthToken(self) -> str:
         """
         Internal method for fetching a new OAuth token.
         Should only be invoked when needed. After a successful fetch, it updates
-        the instance's token, timestamp, and calls the persistence mechanism.
+        the instance's token, timestamp, expiry time and calls the persistence mechanism.
         Returns:
             The new access token as a string.
         Raises:
@@ -197,12 +353,63 @@ class ReportClient:
         resp = respObj.response.json()  # assuming respObj.response supports .json()
         if "access_token" in resp:
             new_token = resp["access_token"]
+            lifetime = self.token_lifetime_seconds(resp)
             self.__access_token = new_token
             self.token_timestamp = time.time()
+            self.token_expires_at = self.token_timestamp + lifetime if lifetime else None
             self.persist_token(new_token)
             return new_token
         raise ValueError("Error while getting OAuth access token", resp)
 
+    @contextlib.contextmanager
+    def api_priority(self, priority: str):
+        """
+        Requests made by this thread inside the with block use the priority ("high", "normal" or "low") for the
+        daily quota, e.g. with client.api_priority("low"): client.data_export_using_sql(...)
+        """
+        previous = self.current_api_priority
+        self._api_priority_local.priority = priority
+        try:
+            yield
+        finally:
+            self._api_priority_local.priority = previous
+
+    @property
+    def _api_priority_local(self) -> threading.local:
+        """The priority of the work each thread is doing with this client (not with other clients).
+        Made on first use, so clients made without __init__ have one too; setdefault is atomic."""
+        return self.__dict__.setdefault("_api_priority_state", threading.local())
+
+    @property
+    def current_api_priority(self) -> str:
+        return getattr(self._api_priority_local, "priority", self.default_api_priority)
+
+    def bind_api_priority(self, fn: Callable) -> Callable:
+        """Wrap fn to run with the current thread's API priority, for tasks handed to worker threads"""
+        priority = self.current_api_priority
+
+        def run_with_priority(*args, **kwargs):
+            with self.api_priority(priority):
+                return fn(*args, **kwargs)
+
+        return run_with_priority
+
+    def _limit_key(self) -> str:
+        return self.rate_limit_key or self.reportServerURL
+
+    def addQueryParams(self, url, authtoken, action, exportFormat, sql=None, criteria=None, table_design=None):
+        """ReportClientHelper.addQueryParams for the auth mode of this client"""
+        return ReportClientHelper.addQueryParams(
+            url,
+            authtoken,
+            action,
+            exportFormat,
+            sql=sql,
+            criteria=criteria,
+            table_design=table_design,
+            is_oauth=self.isOAuth,
+        )
+
     def getResp(self, url: str, httpMethod: str, payLoad, add_token=True, extra_headers=None, **kwargs):
         """
         Internal method. For GET, payLoad is params; for POST, it's data; for DELETE, it may be data or params.
@@ -211,7 +418,7 @@ class ReportClient:
 
         # Build common headers
         headers = {}
-        if add_token and ReportClient.isOAuth and hasattr(self, "access_token"):
+        if add_token and self.isOAuth and hasattr(self, "access_token"):
             headers["Authorization"] = "Zoho-oauthtoken " + self.access_token
         headers["User-Agent"] = "ZohoAnalytics Python GrowthPath Library"
 
@@ -222,7 +429,8 @@ class ReportClient:
         if httpMethod.upper() == "POST":
             try:
                 resp = requests_session.post(url, data=payLoad, headers=headers, timeout=self.request_timeout, **kwargs)
-                if "invalid client" in resp.text:
+                # don't read the body of a streamed response here
+                if not kwargs.get("stream") and "invalid client" in resp.text:
                     raise requests.exceptions.RequestException("Invalid Client")
                 respObj = ResponseObj(resp)
             except requests.exceptions.RequestException as e:
@@ -274,6 +482,21 @@ class ReportClient:
                 f"Unexpected httpMethod in getResp, expected POST, GET, PUT, or DELETE but got {httpMethod}"
             )
 
+    def pace_request(self):
+        """Count a request against the daily quota and wait for the rate limiter, if they are configured.
+        __sendRequest calls this before each attempt; call it before requests sent some other way, such as through
+        the upstream AnalyticsClient."""
+        if self.quota_tracker is not None and not self.quota_tracker.try_consume(
+            self._limit_key(), priority=self.current_api_priority
+        ):
+            raise UnrecoverableRateLimitError(
+                f"The local daily API budget of {self._limit_key()} for {self.current_api_priority} priority "
+                f"requests is used up",
+                zoho_error_code=6043,
+            )
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(self._limit_key())
+
     def __sendRequest(
         self,
         url,
@@ -294,8 +517,24 @@ class ReportClient:
         logger.info("Retry countdown initialised: %s", retry_countdown)
         last_exception = None
         last_respObj = None
+
+        def close_unused_response():
+            """A streamed response which is not returned holds a pooled connection until it is closed"""
+            if keywords.get("stream") and last_respObj is not None:
+                with contextlib.suppress(Exception):
+                    last_respObj.response.close()
+
+        def wait_to_retry(seconds):
+            close_unused_response()
+            time.sleep(seconds)
+
         while retry_countdown > 0:
             retry_countdown -= 1
+            close_unused_response()
+            request_token = self.__access_token
+            self.pace_request()
+            if self.concurrency_limiter is not None:
+                self.concurrency_limiter.acquire()
             try:
                 respObj = self.getResp(url, httpMethod, payLoad, extra_headers=extra_headers, **keywords)
                 last_respObj = respObj
@@ -311,21 +550,32 @@ class ReportClient:
                         (3 * (2 ** (10 - retry_countdown))) + random.random(), 60
                     )  # Add jitter and cap max delay at 60 seconds
 
-                    time.sleep(sleep_time)
+                    wait_to_retry(sleep_time)
                     continue
+            finally:
+                if self.concurrency_limiter is not None:
+                    self.concurrency_limiter.release()
 
             # ----------------------------------------------------------
             # Zoho occasionally returns an “error” object (incl. 6045)
             # while still using HTTP-200.  Detect that here and make it
             # follow the same retry path as the 400/403 handler above.
+            # A streamed export is only checked if it is JSON, so a CSV body
+            # is not read into memory here.
             # ----------------------------------------------------------
-            if respObj.status_code == 200:
+            if respObj.status_code == 200 and (
+                not keywords.get("stream") or "json" in respObj.headers.get("Content-Type", "")
+            ):
                 try:
                     code, _ = self._extract_zoho_error(respObj.response.text)
                     if code is not None:
-                        if code in (6045, 10001):  # 6045 = rate-limit, 10001 = import in progress
+                        # 6045 = rate-limit, 10001 = import in progress, 7198 = table design change in progress
+                        if code in self.THROTTLE_ZOHO_ERROR_CODES:
+                            if self.concurrency_limiter is not None:
+                                self.concurrency_limiter.on_throttle(code)
                             logger.error(
-                                "Zoho API rate-limit error (6045) arrived with HTTP 200 – will retry (%s retries left)",
+                                "Zoho API throttling error (%s) arrived with HTTP 200 – will retry (%s retries left)",
+                                code,
                                 retry_countdown,
                             )
                             if retry_countdown <= 0:
@@ -333,7 +583,7 @@ class ReportClient:
                             # same exponential back-off used elsewhere
                             attempts_made = init_retry_countdown - retry_countdown
                             backoff_seconds = min(4**attempts_made, 120) + random.random()
-                            time.sleep(backoff_seconds)
+                            wait_to_retry(backoff_seconds)
                             continue
                 except (ValueError, json.JSONDecodeError, AttributeError):
                     # If we cannot parse the body, fall through and
@@ -341,6 +591,8 @@ class ReportClient:
                     pass
 
             if 200 <= respObj.status_code < 300:
+                if self.concurrency_limiter is not None:
+                    self.concurrency_limiter.on_success()
                 return self.handleResponse(respObj, action, callBackData)
             elif respObj.status_code in (400, 403, 429):
                 # 400 errors may be an API limit error, which are handled by the result parsing
@@ -352,6 +604,8 @@ class ReportClient:
                         raise ServerError(urlResp=respObj, zoho_error_code=code)
 
                     logger.debug(f"API returned a 400 result and an error code: {code} ")
+                    if code in self.THROTTLE_ZOHO_ERROR_CODES and self.concurrency_limiter is not None:
+                        self.concurrency_limiter.on_throttle(code)
                     if code == 6045:  # rate-limit exceeded
                         logger.error(f"Zoho API recoverable rate-limit error; {retry_countdown} retries left")
                         # exhausted all retries?
@@ -361,7 +615,7 @@ class ReportClient:
                         # exponential back-off (cap at 120 s, add jitter)
                         attempts_made = init_retry_countdown - retry_countdown
                         backoff_seconds = min(4**attempts_made, 120) + random.random()
-                        time.sleep(backoff_seconds)
+                        wait_to_retry(backoff_seconds)
                         continue
                     elif code in [
                         6001,
@@ -372,6 +626,8 @@ class ReportClient:
                         6043,
                     ]:
                         logger.error(f"6043 error, daily API limit in Zoho plan exceeded {respObj.response.text}")
+                        if self.quota_tracker is not None:
+                            self.quota_tracker.mark_exhausted(self._limit_key())
                         raise UnrecoverableRateLimitError(urlResp=respObj, zoho_error_code=code)
                     elif code in [
                         7103,
@@ -419,7 +675,7 @@ class ReportClient:
                             )
                             raise UnrecoverableRateLimitError(urlResp=respObj, zoho_error_code=code)
                         else:
-                            time.sleep(min(10 - retry_countdown, 1) * 10)
+                            wait_to_retry(min(10 - retry_countdown, 1) * 10)
                             continue
                     elif code in [
                         7232,
@@ -483,7 +739,7 @@ class ReportClient:
                         8535,
                     ]:  # invalid oauth token
                         try:
-                            self.getOAuthToken()
+                            self.refresh_access_token(stale_token=request_token)
                         except Exception:
                             pass
                         logger.error("Zoho API Recoverable error encountered (invalid oauth token), will retry")
@@ -491,7 +747,7 @@ class ReportClient:
                             logger.error("Zoho API Recoverable error (invalid oauth token) exhausted retries")
                             raise UnrecoverableRateLimitError(urlResp=respObj, zoho_error_code=code)
                         else:
-                            time.sleep(min(10 - retry_countdown, 1) * 10)
+                            wait_to_retry(min(10 - retry_countdown, 1) * 10)
                             continue
                     elif code in [
                         8509,
@@ -516,7 +772,7 @@ class ReportClient:
                                 message="Zoho error: Another import is in progress",
                             )
                         else:
-                            time.sleep(min(10 - retry_countdown, 1) * 10)
+                            wait_to_retry(min(10 - retry_countdown, 1) * 10)
                             continue
 
                     else:
@@ -529,13 +785,13 @@ class ReportClient:
                         except Exception:
                             pass
                         logger.exception(msg)
-                        time.sleep(min(10 - retry_countdown, 1) * 10)
+                        wait_to_retry(min(10 - retry_countdown, 1) * 10)
                         continue
                 except (RecoverableRateLimitError, UnrecoverableRateLimitError, BadDataError):
                     raise
                 except ServerError:
                     logger.error(f"ServerError raised on _sendRequest.  {url=} {payLoad=} {action=} ")
-                    import_data = payLoad.get("ZOHO_IMPORT_DATA") if payLoad else None
+                    import_data = payLoad.get("ZOHO_IMPORT_DATA") if isinstance(payLoad, dict) else None
                     if import_data:
                         logger.error(
                             f"Import data, a csv file as a string. Row 1 is header, col 0 is first col (id): "
@@ -555,7 +811,7 @@ class ReportClient:
                     8535,
                 ]:  # invalid oauth token
                     try:
-                        self.getOAuthToken()
+                        self.refresh_access_token(stale_token=request_token)
                     except Exception:
                         pass
                     logger.error("Zoho API Recoverable error encountered (invalid oauth token), will retry")
@@ -563,7 +819,7 @@ class ReportClient:
                         logger.error("Zoho API Recoverable error (invalid oauth token) exhausted retries")
                         raise UnrecoverableRateLimitError(urlResp=respObj, zoho_error_code=code)
                     else:
-                        time.sleep(min(10 - retry_countdown, 1) * 10)
+                        wait_to_retry(min(10 - retry_countdown, 1) * 10)
                         continue
             elif respObj.status_code in [
                 414,
@@ -594,7 +850,7 @@ class ReportClient:
                     f"{response_text=}.  {url=}, {httpMethod=}, {payLoad=}, {action=} Retry attempts will be made..."
                 )
                 logger.exception(msg)
-                time.sleep(min(10 - retry_countdown, 1) * 10)
+                wait_to_retry(min(10 - retry_countdown, 1) * 10)
                 continue
         # fell off while loop
         error_details = ""
@@ -715,6 +971,8 @@ class ReportClient:
             f = callBackData
             f.write(response.content)
             return None
+        elif "EXPORT_STREAM" == action:
+            return response.response
         elif "COPYDB" == action:
             resp = response.content
             resp = json.loads(resp)
@@ -810,6 +1068,10 @@ class ReportClient:
             return resp["response"]["result"]["message"]
         return None
 
+    def table_written(self, tableURI: str):
+        """Called after each write to a table (imports, addRow, updateData, deleteData), even one which failed
+        part way. A hook for subclasses, e.g. to invalidate cached exports; it does nothing here."""
+
     def addRow(self, tableURI, columnValues, config=None):
         """
         Adds a row to the specified table identified by the URI.
@@ -826,13 +1088,16 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         # payLoad = ReportClientHelper.getAsPayLoad([columnValues, config], None, None)
-        # url = ReportClientHelper.addQueryParams(tableURI, self.token, "ADDROW", "XML")
+        # url = self.addQueryParams(tableURI, self.token, "ADDROW", "XML")
         # url += "&" + payLoad
         # return self.__sendRequest(url, "POST", payLoad=None, action="ADDROW", callBackData=None)
 
         payLoad = ReportClientHelper.getAsPayLoad([columnValues, config], None, None)
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "ADDROW", "XML")
-        return self.__sendRequest(url, "POST", payLoad, "ADDROW", None)
+        url = self.addQueryParams(tableURI, self.access_token, "ADDROW", "XML")
+        try:
+            return self.__sendRequest(url, "POST", payLoad, "ADDROW", None)
+        finally:
+            self.table_written(tableURI)
 
     def deleteData(self, tableURI, criteria=None, config=None, retry_countdown=0) -> int:
         """This has been refactored to use requests.post.
@@ -851,15 +1116,18 @@ class ReportClient:
         """
         # payLoad = ReportClientHelper.getAsPayLoad([config], criteria, None)
         payload = None  # can't put the SQL in the body of the post request, the library is wrong or out of date
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "DELETE", "JSON", criteria=criteria)
-        r = self.__sendRequest(
-            url=url,
-            httpMethod="POST",
-            payLoad=payload,
-            action="DELETE",
-            callBackData=None,
-            retry_countdown=retry_countdown,
-        )
+        url = self.addQueryParams(tableURI, self.access_token, "DELETE", "JSON", criteria=criteria)
+        try:
+            r = self.__sendRequest(
+                url=url,
+                httpMethod="POST",
+                payLoad=payload,
+                action="DELETE",
+                callBackData=None,
+                retry_countdown=retry_countdown,
+            )
+        finally:
+            self.table_written(tableURI)
         return int(r)
 
     def updateData(self, tableURI, columnValues, criteria, config=None):
@@ -879,8 +1147,11 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([columnValues, config], criteria, None)
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "UPDATE", "JSON")
-        return self.__sendRequest(url, "POST", payLoad, "UPDATE", None)
+        url = self.addQueryParams(tableURI, self.access_token, "UPDATE", "JSON")
+        try:
+            return self.__sendRequest(url, "POST", payLoad, "UPDATE", None)
+        finally:
+            self.table_written(tableURI)
 
     def importData(self, tableURI, importType, importContent, autoIdentify="TRUE", onError="ABORT", importConfig=None):
         """
@@ -919,11 +1190,11 @@ class ReportClient:
             importConfig["ZOHO_CREATE_TABLE"] = "false"
 
         files = {"ZOHO_FILE": ("file", importContent, "multipart/form-data")}
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "IMPORT", "XML")
+        url = self.addQueryParams(tableURI, self.access_token, "IMPORT", "XML")
 
         headers = {}
         # To set access token for the first time when an instance is created.
-        if ReportClient.isOAuth:
+        if self.isOAuth:
             if self.access_token is None:
                 self.access_token = self.getOAuthToken()
             headers = {"Authorization": "Zoho-oauthtoken " + self.access_token}
@@ -935,26 +1206,52 @@ class ReportClient:
             self.access_token = self.getOAuthToken()
             headers = {"Authorization": "Zoho-oauthtoken " + self.access_token}
             respObj = requests.post(url, data=importConfig, files=files, headers=headers)
+        self.table_written(tableURI)
 
         if respObj.status_code != 200:
             raise ServerError(respObj)
         else:
             return ImportResult(respObj.content)
 
+    @staticmethod
+    def import_form_fields(import_mode: str, matching_columns: Optional[str] = None, date_format=None) -> dict:
+        """The form fields of a v1 import, apart from ZOHO_IMPORT_DATA"""
+        form_fields = {
+            "ZOHO_AUTO_IDENTIFY": "true",
+            # "ZOHO_COMMENTCHAR":"#",
+            # "ZOHO_DELIMITER":0, #comma
+            # "ZOHO_QUOTED":2, #double quote
+            "ZOHO_ON_IMPORT_ERROR": "ABORT",
+            "ZOHO_CREATE_TABLE": "false",
+            "ZOHO_IMPORT_TYPE": import_mode,
+            "ZOHO_DATE_FORMAT": date_format or "yyyy-MM-dd",
+        }
+        if matching_columns:
+            form_fields["ZOHO_MATCHING_COLUMNS"] = matching_columns
+        return form_fields
+
     def importData_v1a(
         self,
         tableURI: str,
         import_mode: str,
-        import_content: str,
+        import_content: Any,
         matching_columns: Optional[str] = None,
         date_format=None,
         import_config=None,
         retry_countdown=0,
+        fieldnames: Optional[List[str]] = None,
+        compress: bool = False,
     ) -> "ImportResult":
         """Send data to zoho using a string formatted in CSV style.
         This has been refactored to use requests.post.
         Bulk import data into the table identified by the URI. import_content is a string in csv format (\n separated)
         The first line is column headers.
+        import_content can also be a file-like object or an iterable of rows (dicts or sequences), see
+        streaming.iter_csv_lines. These are csv-encoded while the request is sent, as a chunked request body.
+        A one-shot iterator cannot be sent twice, so it gets a single attempt.
+        With compress, the csv is sent as a zip file (ZOHO_FILE), typically 5-10 times smaller. If Zoho cannot
+        read the zip file (see is_compressed_import_rejection), the import is sent again uncompressed, and if that
+        works compressed_uploads_supported is turned off. Other errors are raised.
         Note: the API supports JSON too but it is not implemented here.
         raises RuntimeError if api limits are exceeded
 
@@ -986,34 +1283,93 @@ class ReportClient:
         due to some error.
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
-        date_format = date_format or "yyyy-MM-dd"
+        payload = self.import_form_fields(import_mode, matching_columns=matching_columns, date_format=date_format)
+        if compress and self.compressed_uploads_supported:
+            # the csv is spooled (to disk when it is large) so it can be zipped as it is sent, and sent again
+            with tempfile.SpooledTemporaryFile(max_size=self.IMPORT_SPOOL_MAX_BYTES) as spool:
+                for line in iter_csv_lines(import_content, fieldnames):
+                    spool.write(line.encode("utf-8"))
+                spool.seek(0)
+                try:
+                    return self._send_import_v1(
+                        tableURI,
+                        MultipartFileBody(
+                            "ZOHO_FILE", spool, filename="data.csv", compression="zip", form_fields=payload
+                        ),
+                        retry_countdown,
+                    )
+                except (ServerError, BadDataError) as e:
+                    if not self.is_compressed_import_rejection(e):
+                        raise
+                    logger.warning("Zoho rejected a compressed import (%s), sending it uncompressed", e)
+                spool.seek(0)
+                result = self.importData_v1a(
+                    tableURI,
+                    import_mode=import_mode,
+                    import_content=spool,
+                    matching_columns=matching_columns,
+                    date_format=date_format,
+                    retry_countdown=retry_countdown,
+                )
+            logger.warning("Compressed imports are turned off for this client")
+            self.compressed_uploads_supported = False
+            return result
 
-        payload = {
-            "ZOHO_AUTO_IDENTIFY": "true",
-            # "ZOHO_COMMENTCHAR":"#",
-            # "ZOHO_DELIMITER":0, #comma
-            # "ZOHO_QUOTED":2, #double quote
-            "ZOHO_ON_IMPORT_ERROR": "ABORT",
-            "ZOHO_CREATE_TABLE": "false",
-            "ZOHO_IMPORT_TYPE": import_mode,
-            "ZOHO_DATE_FORMAT": date_format,
-            "ZOHO_IMPORT_DATA": import_content,
-        }
+        payload["ZOHO_IMPORT_DATA"] = import_content
 
-        if matching_columns:
-            payload["ZOHO_MATCHING_COLUMNS"] = matching_columns
+        extra_headers = None
+        if not isinstance(import_content, str):
+            del payload["ZOHO_IMPORT_DATA"]
+            payload = CSVFormBody(
+                form_fields=payload,
+                data_field="ZOHO_IMPORT_DATA",
+                import_content=import_content,
+                fieldnames=fieldnames,
+            )
+            extra_headers = {"Content-Type": "application/x-www-form-urlencoded"}
+            if not payload.replayable:
+                logger.info("Streaming import from a one-shot iterator, so it will not be retried")
+                retry_countdown = 1
 
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "IMPORT", "XML")
-        r = self.__sendRequest(
-            url=url,
-            httpMethod="POST",
-            payLoad=payload,
-            action="IMPORT",
-            callBackData=None,
-            retry_countdown=retry_countdown,
-        )
+        url = self.addQueryParams(tableURI, self.access_token, "IMPORT", "XML")
+        try:
+            r = self.__sendRequest(
+                url=url,
+                httpMethod="POST",
+                payLoad=payload,
+                action="IMPORT",
+                callBackData=None,
+                retry_countdown=retry_countdown,
+                extra_headers=extra_headers,
+            )
+        finally:
+            self.table_written(tableURI)
         return ImportResult(r.response)  # a parser from Zoho
 
+    def is_compressed_import_rejection(self, error: Exception) -> bool:
+        """True if a compressed import failed because Zoho could not read the zip file: an error code of
+        COMPRESSED_IMPORT_REJECTED_ZOHO_ERROR_CODES or HTTP 415. Other errors would fail uncompressed too.
+        Works for the errors of this module (zoho_error_code) and of the upstream client (errorCode)."""
+        code = getattr(error, "zoho_error_code", None) or getattr(error, "errorCode", None)
+        return code in self.COMPRESSED_IMPORT_REJECTED_ZOHO_ERROR_CODES or getattr(error, "httpStatusCode", None) == 415
+
+    def _send_import_v1(self, tableURI: str, body: MultipartFileBody, retry_countdown) -> "ImportResult":
+        """Send a v1 import whose data is a file in a multipart body"""
+        url = self.addQueryParams(tableURI, self.access_token, "IMPORT", "XML")
+        try:
+            r = self.__sendRequest(
+                url=url,
+                httpMethod="POST",
+                payLoad=body,
+                action="IMPORT",
+                callBackData=None,
+                retry_countdown=retry_countdown,
+                extra_headers={"Content-Type": body.content_type},
+            )
+        finally:
+            self.table_written(tableURI)
+        return ImportResult(r.response)
+
     def importDataAsString(self, tableURI, importType, importContent, autoIdentify, onError, importConfig=None):
         """
         Bulk import data into the table identified by the URI.
@@ -1052,8 +1408,11 @@ class ReportClient:
             importConfig["ZOHO_CREATE_TABLE"] = "false"
 
         payLoad = ReportClientHelper.getAsPayLoad([dict, importConfig], None, None)
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "IMPORT", "XML")
-        return self.__sendRequest(url, "POST", payLoad, "IMPORT", None)
+        url = self.addQueryParams(tableURI, self.access_token, "IMPORT", "XML")
+        try:
+            return self.__sendRequest(url, "POST", payLoad, "IMPORT", None)
+        finally:
+            self.table_written(tableURI)
 
     def exportData(
         self, tableOrReportURI, format, exportToFileObj, criteria: Optional[str] = None, config: Optional[str] = None
@@ -1078,7 +1437,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], criteria, None)
-        url = ReportClientHelper.addQueryParams(tableOrReportURI, self.access_token, "EXPORT", format)
+        url = self.addQueryParams(tableOrReportURI, self.access_token, "EXPORT", format)
         return self.__sendRequest(url, "POST", payLoad, "EXPORT", exportToFileObj)
 
     def exportDataUsingSQL(self, tableOrReportURI, format, exportToFileObj, sql, config=None):
@@ -1103,7 +1462,7 @@ class ReportClient:
 
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, sql)
-        url = ReportClientHelper.addQueryParams(tableOrReportURI, self.access_token, "EXPORT", format)
+        url = self.addQueryParams(tableOrReportURI, self.access_token, "EXPORT", format)
         return self.__sendRequest(url, "POST", payLoad, "EXPORT", exportToFileObj)
 
     def exportDataUsingSQL_v2(self, tableOrReportURI, format, sql, config=None, retry_countdown=0) -> io.BytesIO:
@@ -1136,7 +1495,7 @@ class ReportClient:
         # addQueryParams  adds parameters to the URL, not in the POST body but that seems ok for zoho..
         # url += "&ZOHO_ERROR_FORMAT=XML&ZOHO_ACTION=" + urllib.parse.quote(action)
         # addQueryParams adds: ZOHO_ERROR_FORMAT, ZOHO_OUTPUT_FORMAT
-        url = ReportClientHelper.addQueryParams(
+        url = self.addQueryParams(
             tableOrReportURI, self.access_token, "EXPORT", format, sql=sql
         )  # urlencoding is done in here
         callback_object = io.BytesIO()
@@ -1150,6 +1509,27 @@ class ReportClient:
         )
         return callback_object
 
+    def exportDataUsingSQL_stream(
+        self, tableOrReportURI, format, sql, retry_countdown=0, config=None
+    ) -> requests.Response:
+        """Like exportDataUsingSQL_v2, but the request is made with stream=True and the open requests.Response is
+        returned without reading the body, so it can be consumed with iter_content or iter_lines.
+        The caller must close the response. A concurrency_limiter slot is only held until the response headers
+        arrive, so a caller which makes other requests while it reads the body cannot deadlock on the limiter.
+        @raise ServerError: If the server has recieved the request but did not process the request
+        due to some error.
+        """
+        url = self.addQueryParams(tableOrReportURI, self.access_token, "EXPORT", format, sql=sql)
+        return self.__sendRequest(
+            url=url,
+            httpMethod="POST",
+            payLoad=None,
+            action="EXPORT_STREAM",
+            callBackData=None,
+            retry_countdown=retry_countdown,
+            stream=True,
+        )
+
     def copyDatabase(self, dbURI, config=None):
         """
         Copy the specified database identified by the URI.
@@ -1164,7 +1544,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(dbURI, self.access_token, "COPYDATABASE", "JSON")
+        url = self.addQueryParams(dbURI, self.access_token, "COPYDATABASE", "JSON")
         return self.__sendRequest(url, "POST", payLoad, "COPYDB", None)
 
     def copy_workspace_api_v2(
@@ -1277,7 +1657,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(userURI, self.access_token, "DELETEDATABASE", "XML")
+        url = self.addQueryParams(userURI, self.access_token, "DELETEDATABASE", "XML")
         url += "&ZOHO_DATABASE_NAME=" + urllib.parse.quote(databaseName)
         return self.__sendRequest(url, "POST", payLoad, "DELETEDATABASE", None)
 
@@ -1299,7 +1679,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(userUri, self.access_token, "ENABLEDOMAINDB", "JSON")
+        url = self.addQueryParams(userUri, self.access_token, "ENABLEDOMAINDB", "JSON")
         url += "&DBNAME=" + urllib.parse.quote(dbName)
         url += "&DOMAINNAME=" + urllib.parse.quote(domainName)
         return self.__sendRequest(url, "POST", payLoad, "ENABLEDOMAINDB", None)
@@ -1322,7 +1702,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(userUri, self.access_token, "DISABLEDOMAINDB", "JSON")
+        url = self.addQueryParams(userUri, self.access_token, "DISABLEDOMAINDB", "JSON")
         url += "&DBNAME=" + urllib.parse.quote(dbName)
         url += "&DOMAINNAME=" + urllib.parse.quote(domainName)
         return self.__sendRequest(url, "POST", payLoad, "DISABLEDOMAINDB", None)
@@ -1342,7 +1722,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(dbURI, self.access_token, "CREATETABLE", "JSON")
+        url = self.addQueryParams(dbURI, self.access_token, "CREATETABLE", "JSON")
         # url += "&ZOHO_TABLE_DESIGN=" + urllib.parse.quote(tableDesign)
         url += "&ZOHO_TABLE_DESIGN=" + urllib.parse.quote_plus(tableDesign)  # smaller URL, fits under limit better
 
@@ -1388,7 +1768,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "AUTOGENREPORTS", "JSON")
+        url = self.addQueryParams(tableURI, self.access_token, "AUTOGENREPORTS", "JSON")
         url += "&ZOHO_SOURCE=" + urllib.parse.quote(source)
         return self.__sendRequest(url, "POST", payLoad, "AUTOGENREPORTS", None)
 
@@ -1414,7 +1794,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "CREATESIMILARVIEWS", "JSON")
+        url = self.addQueryParams(tableURI, self.access_token, "CREATESIMILARVIEWS", "JSON")
         url += "&ZOHO_REFVIEW=" + urllib.parse.quote(refView)
         url += "&ZOHO_FOLDERNAME=" + urllib.parse.quote(folderName)
         url += "&ISCOPYCUSTOMFORMULA=" + urllib.parse.quote("true" if customFormula else "false")
@@ -1439,7 +1819,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(dbURI, self.access_token, "RENAMEVIEW", "XML")
+        url = self.addQueryParams(dbURI, self.access_token, "RENAMEVIEW", "XML")
         url += "&ZOHO_VIEWNAME=" + urllib.parse.quote(viewName)
         url += "&ZOHO_NEW_VIEWNAME=" + urllib.parse.quote(newViewName)
         url += "&ZOHO_NEW_VIEWDESC=" + urllib.parse.quote(viewDesc)
@@ -1463,7 +1843,7 @@ class ReportClient:
         @rtype: string
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(dbURI, self.access_token, "SAVEAS", "JSON")
+        url = self.addQueryParams(dbURI, self.access_token, "SAVEAS", "JSON")
         url += "&ZOHO_VIEWTOCOPY=" + urllib.parse.quote(viewToCopy)
         url += "&ZOHO_NEW_VIEWNAME=" + urllib.parse.quote(newViewName)
         return self.__sendRequest(url, "POST", payLoad, "SAVEAS", None)
@@ -1487,7 +1867,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(dbURI, self.access_token, "COPYREPORTS", "XML")
+        url = self.addQueryParams(dbURI, self.access_token, "COPYREPORTS", "XML")
         url += "&ZOHO_VIEWTOCOPY=" + urllib.parse.quote(views)
         url += "&ZOHO_DATABASE_NAME=" + urllib.parse.quote(dbName)
         url += "&ZOHO_COPY_DB_KEY=" + urllib.parse.quote(dbKey)
@@ -1512,7 +1892,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "COPYFORMULA", "XML")
+        url = self.addQueryParams(tableURI, self.access_token, "COPYFORMULA", "XML")
         url += "&ZOHO_FORMULATOCOPY=" + urllib.parse.quote(formula)
         url += "&ZOHO_DATABASE_NAME=" + urllib.parse.quote(dbName)
         url += "&ZOHO_COPY_DB_KEY=" + urllib.parse.quote(dbKey)
@@ -1534,7 +1914,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "ADDCOLUMN", "XML")
+        url = self.addQueryParams(tableURI, self.access_token, "ADDCOLUMN", "XML")
         url += "&ZOHO_COLUMNNAME=" + urllib.parse.quote(columnName)
         url += "&ZOHO_DATATYPE=" + urllib.parse.quote(dataType)
         return self.__sendRequest(url, "POST", payLoad, "ADDCOLUMN", None)
@@ -1596,7 +1976,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "DELETECOLUMN", "XML")
+        url = self.addQueryParams(tableURI, self.access_token, "DELETECOLUMN", "XML")
         url += "&ZOHO_COLUMNNAME=" + urllib.parse.quote(columnName)
         return self.__sendRequest(url, "POST", payLoad, "DELETECOLUMN", None)
 
@@ -1616,7 +1996,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "RENAMECOLUMN", "XML")
+        url = self.addQueryParams(tableURI, self.access_token, "RENAMECOLUMN", "XML")
         url += "&OLDCOLUMNNAME=" + urllib.parse.quote(oldColumnName)
         url += "&NEWCOLUMNNAME=" + urllib.parse.quote(newColumnName)
         return self.__sendRequest(url, "POST", payLoad, "RENAMECOLUMN", None)
@@ -1637,7 +2017,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "HIDECOLUMN", "JSON")
+        url = self.addQueryParams(tableURI, self.access_token, "HIDECOLUMN", "JSON")
         for columnName in columnNames:
             url += "&ZOHO_COLUMNNAME=" + urllib.parse.quote(columnName)
         return self.__sendRequest(url, "POST", payLoad, "HIDECOLUMN", None)
@@ -1658,7 +2038,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "SHOWCOLUMN", "JSON")
+        url = self.addQueryParams(tableURI, self.access_token, "SHOWCOLUMN", "JSON")
         for columnName in columnNames:
             url += "&ZOHO_COLUMNNAME=" + urllib.parse.quote(columnName)
         return self.__sendRequest(url, "POST", payLoad, "SHOWCOLUMN", None)
@@ -1683,7 +2063,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "ADDLOOKUP", "XML")
+        url = self.addQueryParams(tableURI, self.access_token, "ADDLOOKUP", "XML")
         url += "&ZOHO_COLUMNNAME=" + urllib.parse.quote(columnName)
         url += "&ZOHO_REFERREDTABLE=" + urllib.parse.quote(referedTable)
         url += "&ZOHO_REFERREDCOLUMN=" + urllib.parse.quote(referedColumn)
@@ -1704,7 +2084,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "REMOVELOOKUP", "XML")
+        url = self.addQueryParams(tableURI, self.access_token, "REMOVELOOKUP", "XML")
         url += "&ZOHO_COLUMNNAME=" + urllib.parse.quote(columnName)
         return self.__sendRequest(url, "POST", payLoad, "REMOVELOOKUP", None)
 
@@ -1724,7 +2104,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(userURI, self.access_token, "CREATEBLANKDB", "JSON")
+        url = self.addQueryParams(userURI, self.access_token, "CREATEBLANKDB", "JSON")
         url += "&ZOHO_DATABASE_NAME=" + urllib.parse.quote(dbName)
         if dbDesc is not None:
             url += "&ZOHO_DATABASE_DESC=" + urllib.parse.quote(dbDesc)
@@ -1746,7 +2126,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payload = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(requestURI, self.access_token, "DATABASEMETADATA", "JSON")
+        url = self.addQueryParams(requestURI, self.access_token, "DATABASEMETADATA", "JSON")
         url += "&ZOHO_METADATA=" + urllib.parse.quote(metadata)
         r = self.__sendRequest(
             url=url, httpMethod="POST", payLoad=payload, action="DATABASEMETADATA", callBackData=None
@@ -1769,7 +2149,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(userURI, self.access_token, "GETDATABASENAME", "XML")
+        url = self.addQueryParams(userURI, self.access_token, "GETDATABASENAME", "XML")
         url += "&DBID=" + urllib.parse.quote(dbid)
         return self.__sendRequest(url, "POST", payLoad, "GETDATABASENAME", None)
 
@@ -1789,7 +2169,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(userURI, self.access_token, "GETDATABASEID", "XML")
+        url = self.addQueryParams(userURI, self.access_token, "GETDATABASEID", "XML")
         url += "&ZOHO_DATABASE_NAME=" + urllib.parse.quote(dbName)
         return self.__sendRequest(url, "POST", payLoad, "GETDATABASEID", None)
 
@@ -1809,7 +2189,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(userURI, self.access_token, "ISDBEXIST", "JSON")
+        url = self.addQueryParams(userURI, self.access_token, "ISDBEXIST", "JSON")
         url += "&ZOHO_DB_NAME=" + urllib.parse.quote(dbName)
         return self.__sendRequest(url, "POST", payLoad, "ISDBEXIST", None)
 
@@ -1829,7 +2209,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(dbURI, self.access_token, "ISVIEWEXIST", "JSON")
+        url = self.addQueryParams(dbURI, self.access_token, "ISVIEWEXIST", "JSON")
         url += "&ZOHO_VIEW_NAME=" + urllib.parse.quote(viewName)
         return self.__sendRequest(url, "POST", payLoad, "ISVIEWEXIST", None)
 
@@ -1849,7 +2229,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "ISCOLUMNEXIST", "JSON")
+        url = self.addQueryParams(tableURI, self.access_token, "ISCOLUMNEXIST", "JSON")
         url += "&ZOHO_COLUMN_NAME=" + urllib.parse.quote(columnName)
         return self.__sendRequest(url, "POST", payLoad, "ISCOLUMNEXIST", None)
 
@@ -1867,7 +2247,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(dbURI, self.access_token, "GETCOPYDBKEY", "XML")
+        url = self.addQueryParams(dbURI, self.access_token, "GETCOPYDBKEY", "XML")
         return self.__sendRequest(url, "POST", payLoad, "GETCOPYDBKEY", None)
 
     def getViewName(self, userURI, objid, config=None):
@@ -1886,7 +2266,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(userURI, self.access_token, "GETVIEWNAME", "XML")
+        url = self.addQueryParams(userURI, self.access_token, "GETVIEWNAME", "XML")
         url += "&OBJID=" + urllib.parse.quote(objid)
         return self.__sendRequest(url, "POST", payLoad, "GETVIEWNAME", None)
 
@@ -1904,7 +2284,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "GETINFO", "XML")
+        url = self.addQueryParams(tableURI, self.access_token, "GETINFO", "XML")
         return self.__sendRequest(url, "POST", payLoad, "GETINFO", None)
 
     def getViewInfo(self, dbURI, viewID, config=None):
@@ -1923,7 +2303,7 @@ class ReportClient:
         @rtype: dictionary
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(dbURI, self.access_token, "GETVIEWINFO", "JSON")
+        url = self.addQueryParams(dbURI, self.access_token, "GETVIEWINFO", "JSON")
         url += "&ZOHO_VIEW_ID=" + urllib.parse.quote(viewID)
         return self.__sendRequest(url, "GET", payLoad, "GETVIEWINFO", None)
 
@@ -1941,7 +2321,7 @@ class ReportClient:
         @rtype:List
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(userURI, self.access_token, "RECENTITEMS", "JSON")
+        url = self.addQueryParams(userURI, self.access_token, "RECENTITEMS", "JSON")
         return self.__sendRequest(url, "GET", payLoad, "RECENTITEMS", None)
 
     def getDashboards(self, userURI, config=None):
@@ -1958,7 +2338,7 @@ class ReportClient:
         @rtype:List
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(userURI, self.access_token, "GETDASHBOARDS", "JSON")
+        url = self.addQueryParams(userURI, self.access_token, "GETDASHBOARDS", "JSON")
         return self.__sendRequest(url, "GET", payLoad, "GETDASHBOARDS", None)
 
     def myWorkspaceList(self, userURI, config=None):
@@ -1975,7 +2355,7 @@ class ReportClient:
         @rtype:List
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(userURI, self.access_token, "MYWORKSPACELIST", "JSON")
+        url = self.addQueryParams(userURI, self.access_token, "MYWORKSPACELIST", "JSON")
         return self.__sendRequest(url, "GET", payLoad, "MYWORKSPACELIST", None)
 
     def sharedWorkspaceList(self, userURI, config=None):
@@ -1992,7 +2372,7 @@ class ReportClient:
         @rtype:List
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(userURI, self.access_token, "SHAREDWORKSPACELIST", "JSON")
+        url = self.addQueryParams(userURI, self.access_token, "SHAREDWORKSPACELIST", "JSON")
         return self.__sendRequest(url, "GET", payLoad, "SHAREDWORKSPACELIST", None)
 
     def viewList(self, dbURI, config=None):
@@ -2009,7 +2389,7 @@ class ReportClient:
         @rtype:List
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(dbURI, self.access_token, "VIEWLIST", "JSON")
+        url = self.addQueryParams(dbURI, self.access_token, "VIEWLIST", "JSON")
         return self.__sendRequest(url, "GET", payLoad, "VIEWLIST", None)
 
     def folderList(self, dbURI, config=None):
@@ -2026,7 +2406,7 @@ class ReportClient:
         @rtype:List
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(dbURI, self.access_token, "FOLDERLIST", "JSON")
+        url = self.addQueryParams(dbURI, self.access_token, "FOLDERLIST", "JSON")
         return self.__sendRequest(url, "GET", payLoad, "FOLDERLIST", None)
 
     def shareView(self, dbURI, emailIds, views, criteria=None, config=None):
@@ -2047,7 +2427,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], criteria, None)
-        url = ReportClientHelper.addQueryParams(dbURI, self.access_token, "SHARE", "XML")
+        url = self.addQueryParams(dbURI, self.access_token, "SHARE", "XML")
         url += "&ZOHO_EMAILS=" + urllib.parse.quote(emailIds)
         url += "&ZOHO_VIEWS=" + urllib.parse.quote(views)
         return self.__sendRequest(url, "POST", payLoad, "SHARE", None)
@@ -2066,7 +2446,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(dbURI, self.access_token, "REMOVESHARE", "XML")
+        url = self.addQueryParams(dbURI, self.access_token, "REMOVESHARE", "XML")
         url += "&ZOHO_EMAILS=" + urllib.parse.quote(emailIds)
         return self.__sendRequest(url, "POST", payLoad, "REMOVESHARE", None)
 
@@ -2084,7 +2464,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(dbURI, self.access_token, "ADDDBOWNER", "XML")
+        url = self.addQueryParams(dbURI, self.access_token, "ADDDBOWNER", "XML")
         url += "&ZOHO_EMAILS=" + urllib.parse.quote(emailIds)
         return self.__sendRequest(url, "POST", payLoad, "ADDDBOWNER", None)
 
@@ -2102,7 +2482,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(dbURI, self.access_token, "REMOVEDBOWNER", "XML")
+        url = self.addQueryParams(dbURI, self.access_token, "REMOVEDBOWNER", "XML")
         url += "&ZOHO_EMAILS=" + urllib.parse.quote(emailIds)
         return self.__sendRequest(url, "POST", payLoad, "REMOVEDBOWNER", None)
 
@@ -2120,7 +2500,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(dbURI, self.access_token, "GETSHAREINFO", "JSON")
+        url = self.addQueryParams(dbURI, self.access_token, "GETSHAREINFO", "JSON")
         return self.__sendRequest(url, "POST", payLoad, "GETSHAREINFO", None)
 
     def getViewUrl(self, tableURI, config=None):
@@ -2137,7 +2517,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "GETVIEWURL", "XML")
+        url = self.addQueryParams(tableURI, self.access_token, "GETVIEWURL", "XML")
         return self.__sendRequest(url, "POST", payLoad, "GETVIEWURL", None)
 
     def getEmbedUrl(self, tableURI, criteria=None, config=None):
@@ -2157,7 +2537,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], criteria, None)
-        url = ReportClientHelper.addQueryParams(tableURI, self.access_token, "GETEMBEDURL", "XML")
+        url = self.addQueryParams(tableURI, self.access_token, "GETEMBEDURL", "XML")
         return self.__sendRequest(url, "POST", payLoad, "GETEMBEDURL", None)
 
     def getUsers(self, userURI, config=None):
@@ -2174,7 +2554,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(userURI, self.access_token, "GETUSERS", "JSON")
+        url = self.addQueryParams(userURI, self.access_token, "GETUSERS", "JSON")
         return self.__sendRequest(url, "POST", payLoad, "GETUSERS", None)
 
     def addUser(self, userURI, emailIds, config=None):
@@ -2191,7 +2571,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(userURI, self.access_token, "ADDUSER", "XML")
+        url = self.addQueryParams(userURI, self.access_token, "ADDUSER", "XML")
         url += "&ZOHO_EMAILS=" + urllib.parse.quote(emailIds)
         return self.__sendRequest(url, "POST", payLoad, "ADDUSER", None)
 
@@ -2210,7 +2590,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(userURI, self.access_token, "REMOVEUSER", "XML")
+        url = self.addQueryParams(userURI, self.access_token, "REMOVEUSER", "XML")
         url += "&ZOHO_EMAILS=" + urllib.parse.quote(emailIds)
         return self.__sendRequest(url, "POST", payLoad, "REMOVEUSER", None)
 
@@ -2229,7 +2609,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(userURI, self.access_token, "ACTIVATEUSER", "XML")
+        url = self.addQueryParams(userURI, self.access_token, "ACTIVATEUSER", "XML")
         url += "&ZOHO_EMAILS=" + urllib.parse.quote(emailIds)
         return self.__sendRequest(url, "POST", payLoad, "ACTIVATEUSER", None)
 
@@ -2248,7 +2628,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(userURI, self.access_token, "DEACTIVATEUSER", "XML")
+        url = self.addQueryParams(userURI, self.access_token, "DEACTIVATEUSER", "XML")
         url += "&ZOHO_EMAILS=" + urllib.parse.quote(emailIds)
         return self.__sendRequest(url, "POST", payLoad, "DEACTIVATEUSER", None)
 
@@ -2266,7 +2646,7 @@ class ReportClient:
         @raise ParseError: If the server has responded but client was not able to parse the response.
         """
         payLoad = ReportClientHelper.getAsPayLoad([config], None, None)
-        url = ReportClientHelper.addQueryParams(userURI, self.access_token, "GETUSERPLANDETAILS", "XML")
+        url = self.addQueryParams(userURI, self.access_token, "GETUSERPLANDETAILS", "XML")
         return self.__sendRequest(url, "POST", payLoad, "GETUSERPLANDETAILS", None)
 
     def getUserURI(self, dbOwnerName):
@@ -2316,6 +2696,16 @@ class ReportClient:
 
         return url
 
+    @staticmethod
+    def splitURI(tableURI: str) -> tuple[str, str, str]:
+        """The owner, database and table (or report) names of a URI made by getURI"""
+        # undo splCharReplace before splitting; "(//)" first, as it contains "/" (quoted names have no parentheses)
+        path = urllib.parse.urlparse(tableURI).path.replace("(//)", "%5C").replace("(/)", "%2F")
+        owner, database_name, table_name = path.split("/")[-3:]
+        return tuple(  # type: ignore[return-value]
+            urllib.parse.unquote(part) for part in (owner, database_name, table_name)
+        )
+
     def getURI_v2(self) -> str:
         """
         Returns the base URL for v2 api with trailing /
@@ -2752,6 +3142,18 @@ class ImportResult:
             self.dataTypeDict[content] = el.getAttribute("datatype")
             self.impCols.append(content)
 
+    @classmethod
+    def merge(cls, results: List["ImportResult"]) -> "ImportResult":
+        """Combine the results of a chunked import into one ImportResult.
+        Row and warning counts are summed, import errors are concatenated, and the rest
+        (column details, operation) comes from the first chunk."""
+        merged = copy.copy(results[0])
+        merged.totalRowCount = sum(r.totalRowCount for r in results)
+        merged.successRowCount = sum(r.successRowCount for r in results)
+        merged.warningCount = sum(r.warningCount for r in results)
+        merged.impErrors = "".join(r.impErrors for r in results if r.impErrors)
+        return merged
+
 
 class ResponseObj:
     """
@@ -2760,12 +3162,16 @@ class ResponseObj:
 
     def __init__(self, resp: requests.Response):
         """updated to assume a urllib3 object"""
-        self.content = getattr(resp, "content", None)
         self.reason = getattr(resp, "reason", None)  # This is used for communication about errors
         self.status_code = getattr(resp, "status_code", None)
         self.headers: MutableMapping = getattr(resp, "headers", {})
         self.response = resp
 
+    @property
+    def content(self):
+        """read lazily, so that the body of a streamed response is not pulled into memory"""
+        return getattr(self.response, "content", None)
+
 
 class ReportClientHelper:
     """
@@ -2800,12 +3206,18 @@ class ReportClientHelper:
             raise ParseError(response, "Unable parse the response as xml", inst)
 
     @staticmethod
-    def addQueryParams(url, authtoken, action, exportFormat, sql=None, criteria=None, table_design=None):
+    def addQueryParams(
+        url, authtoken, action, exportFormat, sql=None, criteria=None, table_design=None, is_oauth=None
+    ):
+        """is_oauth is the auth mode of the calling client; authtoken is only added to the url when it is False.
+        None means the class default, ReportClient.isOAuth"""
+        if is_oauth is None:
+            is_oauth = ReportClient.isOAuth
         url = ReportClientHelper.checkAndAppendQMark(url)
         url += "&ZOHO_ERROR_FORMAT=JSON&ZOHO_ACTION=" + urllib.parse.quote(action)
         url += "&ZOHO_OUTPUT_FORMAT=" + urllib.parse.quote(exportFormat)
         url += "&ZOHO_API_VERSION=" + ReportClientHelper.API_VERSION
-        if not ReportClient.isOAuth:
+        if not is_oauth:
             url += "&authtoken=" + urllib.parse.quote(authtoken)
         if exportFormat == "JSON":
             url += "&ZOHO_VALID_JSON=TRUE"
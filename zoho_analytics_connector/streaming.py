@@ -0,0 +1,328 @@
+"""Helpers for moving large CSV payloads to and from Zoho without holding them in memory more than once.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+import codecs
+import csv
+import io
+import os
+import urllib.parse
+import uuid
+import zipfile
+import zlib
+from typing import Any, Iterable, Iterator, Mapping, Optional, Sequence, Union
+
+
+def iter_csv_records(lines: Iterable[str]) -> Iterator[str]:
+    """Group CSV text lines into complete records, keeping line endings.
+
+    A quoted field may contain newlines, so a record only ends once it holds an even number of
+    double quotes (escaped quotes are doubled, so they never change the parity)."""
+    pending: list[str] = []
+    quote_count = 0
+    for line in lines:
+        pending.append(line)
+        quote_count += line.count('"')
+        if quote_count % 2 == 0:
+            yield "".join(pending)
+            pending = []
+            quote_count = 0
+    if pending:
+        yield "".join(pending)
+
+
+def iter_csv_chunks(
+    csv_content: Union[str, Iterable[str]],
+    max_bytes: Optional[int] = None,
+    max_rows: Optional[int] = None,
+) -> Iterator[str]:
+    """Split CSV content on record boundaries into chunks which each start with the header row.
+
+    csv_content is a CSV string, or an iterable of lines such as a file opened with newline="".
+    A chunk is closed when adding the next record would take it over max_bytes (utf-8 encoded)
+    or when it holds max_rows data rows. A single record bigger than max_bytes is sent on its own.
+    If there are no data rows, the header is yielded alone so that a TRUNCATEADD still truncates."""
+    if max_bytes is None and max_rows is None:
+        raise ValueError("iter_csv_chunks needs max_bytes or max_rows")
+    lines = io.StringIO(csv_content, newline="") if isinstance(csv_content, str) else csv_content
+    records = iter_csv_records(lines)
+    header = next(records, None)
+    if header is None:
+        return
+    if not header.endswith("\n"):
+        header += "\n"
+    header_bytes = len(header.encode("utf-8"))
+
+    chunk: list[str] = []
+    chunk_bytes = header_bytes
+    sent_any = False
+    for record in records:
+        record_bytes = len(record.encode("utf-8"))
+        chunk_is_full = (max_rows is not None and len(chunk) >= max_rows) or (
+            max_bytes is not None and chunk and chunk_bytes + record_bytes > max_bytes
+        )
+        if chunk_is_full:
+            yield header + "".join(chunk)
+            sent_any = True
+            chunk = []
+            chunk_bytes = header_bytes
+        chunk.append(record)
+        chunk_bytes += record_bytes
+    if chunk or not sent_any:
+        yield header + "".join(chunk)
+
+
+def iter_text_lines(byte_chunks: Iterable[bytes], encoding: str = "utf-8-sig") -> Iterator[str]:
+    """Decode a stream of byte chunks (e.g. requests' iter_content) into lines, keeping the line endings.
+
+    Chunks can split multi-byte characters, the BOM or lines anywhere. Line endings are kept so that
+    csv.reader can put back the newlines inside quoted fields."""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    remainder = ""
+    for chunk in byte_chunks:
+        lines = (remainder + decoder.decode(chunk)).split("\n")
+        remainder = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    remainder += decoder.decode(b"", final=True)
+    if remainder:
+        yield remainder
+
+
+class _LastLine:
+    """A write target for csv.writer which only remembers the line just written."""
+
+    def __init__(self):
+        self.line = ""
+
+    def write(self, line: str):
+        self.line = line
+
+
+def iter_csv_lines(import_content: Any, fieldnames: Optional[Sequence[str]] = None) -> Iterator[str]:
+    """Lazily turn import content into csv text lines.
+
+    import_content may be a csv string, a file-like object (text, or utf-8 bytes) or an iterable of rows.
+    Rows are dicts or sequences; for dicts the header is fieldnames or the keys of the first row,
+    for sequences the header is fieldnames if given, otherwise the first row must be the header."""
+    if isinstance(import_content, str):
+        yield from io.StringIO(import_content, newline="")
+        return
+    if hasattr(import_content, "read"):
+        if isinstance(import_content.read(0), bytes):
+            for line_number, line in enumerate(import_content):
+                text = line.decode("utf-8")
+                yield text.lstrip("\ufeff") if line_number == 0 else text
+        else:
+            yield from import_content
+        return
+
+    rows = iter(import_content)
+    first_row = next(rows, None)
+    if first_row is None:
+        return
+    target = _LastLine()
+    writer: Any
+    if isinstance(first_row, Mapping):
+        writer = csv.DictWriter(target, fieldnames=list(fieldnames or first_row.keys()), lineterminator="\n")
+        writer.writeheader()
+        yield target.line
+    else:
+        writer = csv.writer(target, lineterminator="\n")
+        if fieldnames:
+            writer.writerow(fieldnames)
+            yield target.line
+    writer.writerow(first_row)
+    yield target.line
+    for row in rows:
+        writer.writerow(row)
+        yield target.line
+
+
+def is_replayable(import_content: Any) -> bool:
+    """True if import content can be read a second time, which is needed to retry a request."""
+    if isinstance(import_content, (str, bytes)):
+        return True
+    if hasattr(import_content, "read"):
+        return hasattr(import_content, "seekable") and import_content.seekable()
+    return iter(import_content) is not import_content
+
+
+class CSVFormBody:
+    """A form-urlencoded request body which csv-encodes the import content while requests sends it.
+
+    requests sends an iterable body with chunked transfer encoding, so the csv is never built in memory.
+    requests iterates the body again when __sendRequest retries; that works when the content is replayable
+    (a string, a list of rows or a seekable file) and raises RuntimeError for a one-shot generator."""
+
+    def __init__(
+        self,
+        form_fields: Mapping[str, str],
+        data_field: str,
+        import_content: Any,
+        fieldnames: Optional[Sequence[str]] = None,
+        piece_size: int = 64 * 1024,
+    ):
+        self.form_fields = form_fields
+        self.data_field = data_field
+        self.import_content = import_content
+        self.fieldnames = fieldnames
+        self.piece_size = piece_size
+        self.replayable = is_replayable(import_content)
+        self._start_position = import_content.tell() if self.replayable and hasattr(import_content, "read") else None
+        self._iterated = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        if self._iterated:
+            if not self.replayable:
+                raise RuntimeError("The import content is a one-shot iterator and has already been sent")
+            if self._start_position is not None:
+                self.import_content.seek(self._start_position)
+        self._iterated = True
+        prefix = urllib.parse.urlencode(self.form_fields)
+        yield f"{prefix}&{self.data_field}=".encode("ascii") if prefix else f"{self.data_field}=".encode("ascii")
+        piece: list[str] = []
+        piece_length = 0
+        for line in iter_csv_lines(self.import_content, self.fieldnames):
+            piece.append(line)
+            piece_length += len(line)
+            if piece_length >= self.piece_size:
+                yield urllib.parse.quote_plus("".join(piece)).encode("ascii")
+                piece = []
+                piece_length = 0
+        if piece:
+            yield urllib.parse.quote_plus("".join(piece)).encode("ascii")
+
+
+def iter_gzip(pieces: Iterable[bytes]) -> Iterator[bytes]:
+    """Gzip compress a stream of bytes as it is read"""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)  # gzip format
+    for piece in pieces:
+        compressed = compressor.compress(piece)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class _CollectedWrites(io.RawIOBase):
+    """A write-only, unseekable target for zipfile, which collects what is written until it is taken."""
+
+    def __init__(self):
+        self.pieces: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.pieces.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self.pieces)
+        self.pieces = []
+        return data
+
+
+def iter_zip(pieces: Iterable[bytes], member_name: str) -> Iterator[bytes]:
+    """Deflate a stream of bytes into a zip archive with one member, yielding the archive as it is built.
+    zipfile writes to an unseekable target with data descriptors, so nothing has to be written twice."""
+    target = _CollectedWrites()
+    with zipfile.ZipFile(target, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(member_name, "w", force_zip64=True) as member:
+            for piece in pieces:
+                member.write(piece)
+                data = target.take()
+                if data:
+                    yield data
+    yield target.take()
+
+
+def unzip_single_member(archive_bytes: bytes) -> bytes:
+    """The content of the first member of a zip archive, e.g. one built by iter_zip"""
+    with zipfile.ZipFile(io.BytesIO(archive_bytes)) as archive:
+        return archive.read(archive.namelist()[0])
+
+
+class MultipartFileBody:
+    """A multipart/form-data request body with one file field, read in pieces while requests sends it.
+
+    content is a file path, a binary file object, or an iterable of bytes or str (utf-8 encoded) such as a
+    generator. A file opened from a path is closed as soon as it has been sent. compression is None, "gzip"
+    (".gz" is added to the file name) or "zip" (the file becomes the one member of a .zip archive); the file is
+    compressed as it is sent. form_fields are sent as parts before the file.
+    Send it as data= with the content_type header. Like CSVFormBody it can be sent again for a retry if the
+    content is replayable (a path, a seekable file or a list), and raises RuntimeError for a one-shot generator."""
+
+    def __init__(
+        self,
+        field_name: str,
+        content: Any,
+        filename: Optional[str] = None,
+        compression: Optional[str] = None,
+        form_fields: Optional[Mapping[str, str]] = None,
+        piece_size: int = 64 * 1024,
+    ):
+        if compression not in (None, "gzip", "zip"):
+            raise ValueError(f"Unknown compression {compression}")
+        self.field_name = field_name
+        self.content = content
+        self.compression = compression
+        self.form_fields = form_fields or {}
+        self.piece_size = piece_size
+        if filename is None:
+            filename = os.path.basename(content) if isinstance(content, (str, os.PathLike)) else "data.csv"
+        self.member_name = str(filename)
+        if compression == "gzip":
+            self.filename = self.member_name + ".gz"
+        elif compression == "zip":
+            self.filename = os.path.splitext(self.member_name)[0] + ".zip"
+        else:
+            self.filename = self.member_name
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.replayable = isinstance(content, (str, os.PathLike)) or is_replayable(content)
+        self._start_position = content.tell() if hasattr(content, "read") and self.replayable else None
+        self._iterated = False
+
+    def _iter_content(self) -> Iterator[bytes]:
+        if isinstance(self.content, (str, os.PathLike)):
+            with open(self.content, "rb") as in_file:
+                yield from iter(lambda: in_file.read(self.piece_size), b"")
+        elif hasattr(self.content, "read"):
+            yield from iter(lambda: self.content.read(self.piece_size), b"")
+        else:
+            for piece in self.content:
+                if piece:  # an empty piece would end a chunked request body
+                    yield piece.encode("utf-8") if isinstance(piece, str) else piece
+
+    def __iter__(self) -> Iterator[bytes]:
+        if self._iterated:
+            if not self.replayable:
+                raise RuntimeError("The import content is a one-shot iterator and has already been sent")
+            if self._start_position is not None:
+                self.content.seek(self._start_position)
+        self._iterated = True
+        for name, value in self.form_fields.items():
+            yield (
+                f"--{self.boundary}\r\n"
+                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                f"{value}\r\n"
+            ).encode("utf-8")
+        content_type = {"gzip": "application/gzip", "zip": "application/zip"}.get(
+            self.compression or "", "application/octet-stream"
+        )
+        yield (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{self.field_name}"; filename="{self.filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode("utf-8")
+        pieces = self._iter_content()
+        if self.compression == "gzip":
+            pieces = iter_gzip(pieces)
+        elif self.compression == "zip":
+            pieces = iter_zip(pieces, self.member_name)
+        yield from pieces
+        yield f"\r\n--{self.boundary}--\r\n".encode("ascii")
@@ -1,15 +1,41 @@
+import array
+import asyncio
+import datetime
+import email.parser
+import email.policy
+import gzip
 import io
 import json
+import math
 import os
+import threading
+import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from types import SimpleNamespace
 
 import pytest
 import requests.exceptions
 
-from zoho_analytics_connector.zoho_analytics_connector.enhanced_report_client import EnhancedZohoAnalyticsClient
-from zoho_analytics_connector.zoho_analytics_connector.report_client import ReportClient, ServerError
+from zoho_analytics_connector.zoho_analytics_connector.enhanced_report_client import (
+    EnhancedZohoAnalyticsClient,
+    ZohoClientPool,
+)
+from zoho_analytics_connector.zoho_analytics_connector import (
+    analytics_client_upstream,
+    async_report_client,
+    bulk,
+    columnar,
+    export_cache,
+    partitioning,
+    quota,
+    rate_limit,
+    report_client,
+    streaming,
+)
+from zoho_analytics_connector.zoho_analytics_connector.report_client import ImportResult, ReportClient, ServerError
 from zoho_analytics_connector.zoho_analytics_connector.typed_dicts import TableView_v2
+from zoho_analytics_connector.zoho_analytics_connector.token_store import FileTokenStore
 
 try:
     # from zoho_analytics_connector.private import config
@@ -285,6 +311,36 @@ def test_get_table_catalog_v2_uses_detail_payload_columns(monkeypatch: pytest.Mo
     assert catalog["dear_financial_transactions"]["columns"][0]["columnName"] == "probe_col"
 
 
+def test_get_table_catalog_v2_reports_failed_views_and_keeps_order(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = object.__new__(EnhancedZohoAnalyticsClient)
+    monkeypatch.setattr(client, "get_org_and_workspace_id", lambda database_name=None: ("org-1", "workspace-1"))
+    view_names = [f"table_{i}" for i in range(8)]
+    monkeypatch.setattr(
+        client,
+        "get_views_api_v2",
+        lambda org_id, workspace_id, view_types=None: {
+            "data": {"views": [{"viewId": name, "viewName": name, "viewType": "Table"} for name in view_names]}
+        },
+    )
+
+    def fake_view_details(view_id):
+        if view_id == "table_3":
+            raise ServerError(SimpleNamespace(status_code=500, content=b"boom", headers={}))
+        return {"data": {"views": {"viewId": view_id, "viewName": view_id, "viewType": "Table", "columns": []}}}
+
+    monkeypatch.setattr(client, "get_view_details_api_v2", fake_view_details)
+    failed_views: dict[str, Exception] = {}
+
+    catalog = client.get_table_catalog_v2(database_name="DearTest", max_workers=3, failed_views=failed_views)
+
+    assert list(catalog) == [name for name in view_names if name != "table_3"]
+    assert list(failed_views) == ["table_3"]
+    assert list(client.get_table_catalog_v2(database_name="DearTest", max_workers=3)) == list(catalog)
+    with pytest.raises(ServerError) as raised:
+        client.get_table_catalog_v2(database_name="DearTest", max_workers=3, raise_errors=True)
+    assert raised.value.__notes__ == ["Could not fetch the details of views table_3"]
+
+
 def test_send_request_treats_201_as_success(monkeypatch: pytest.MonkeyPatch) -> None:
     client = object.__new__(ReportClient)
     client.default_retries = 1
@@ -309,6 +365,1328 @@ def test_send_request_treats_201_as_success(monkeypatch: pytest.MonkeyPatch) ->
     assert result == {"status": "success"}
 
 
+def make_import_result_xml(row_count: int) -> bytes:
+    return (
+        '<?xml version="1.0" encoding="UTF-8" ?><response action="IMPORT"><result><importSummary>'
+        "<totalColumnCount>2</totalColumnCount><selectedColumnCount>2</selectedColumnCount>"
+        f"<totalRowCount>{row_count}</totalRowCount><successRowCount>{row_count}</successRowCount>"
+        "<warnings>0</warnings><importOperation>updated</importOperation></importSummary>"
+        '<columnDetails><column datatype="Plain Text">common_name</column></columnDetails>'
+        "<importErrors></importErrors></result></response>"
+    ).encode("utf-8")
+
+
+def get_offline_enhanced_client() -> EnhancedZohoAnalyticsClient:
+    """a client using the retired authtoken mode, so nothing is fetched or persisted"""
+    return EnhancedZohoAnalyticsClient(
+        login_email_id="test@example.com",
+        refresh_token="authtoken",
+        default_databasename="DearTest",
+        reportServerURL="https://analytics.example.com",
+    )
+
+
+def test_iter_csv_chunks_keeps_header_and_quoted_newlines() -> None:
+    csv_content = 'common_name,size\n"Rab\nbit",small\nElephant,large\n"Wolf ""grey""",medium\n'
+
+    chunks = list(streaming.iter_csv_chunks(csv_content, max_rows=2))
+
+    assert chunks == [
+        'common_name,size\n"Rab\nbit",small\nElephant,large\n',
+        'common_name,size\n"Wolf ""grey""",medium\n',
+    ]
+    assert list(streaming.iter_csv_chunks("common_name,size", max_bytes=10)) == ["common_name,size\n"]
+
+
+def test_chunked_upload_truncates_once_and_merges_results(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = get_offline_enhanced_client()
+    calls: list[tuple[str, str]] = []
+
+    def fake_import(uri, import_mode, import_content, **kwargs):
+        calls.append((import_mode, import_content))
+        return ImportResult(make_import_result_xml(import_content.count("\n") - 1))
+
+    monkeypatch.setattr(client, "importData_v1a", fake_import)
+    rows = "".join(f"animal_{i},small\n" for i in range(10))
+
+    result = client.data_upload(
+        import_content="common_name,size\n" + rows,
+        table_name="animals",
+        import_mode="TRUNCATEADD",
+        chunk_row_count=3,
+        max_workers=2,
+    )
+
+    assert calls[0] == ("TRUNCATEADD", "common_name,size\nanimal_0,small\nanimal_1,small\nanimal_2,small\n")
+    assert sorted(mode for mode, _ in calls[1:]) == ["APPEND"] * 3
+    assert all(content.startswith("common_name,size\n") for _, content in calls)
+    assert result.totalRowCount == 10
+    assert result.successRowCount == 10
+    assert result.warningCount == 0
+
+
+def test_streamed_upload_encodes_rows_as_chunked_form_body(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = get_offline_enhanced_client()
+    captured: dict[str, object] = {}
+
+    def fake_post(url, data=None, headers=None, **kwargs):
+        captured["body"] = b"".join(data)
+        captured["headers"] = headers
+        xml = make_import_result_xml(2)
+        return SimpleNamespace(status_code=200, text=xml.decode(), content=xml, headers={}, reason="OK")
+
+    monkeypatch.setattr(client.requests_session, "post", fake_post)
+    rows = ({"common_name": name, "size": size} for name, size in [("Rabbit", "small"), ("Ele,phant", "large")])
+
+    result = client.data_upload(import_content=rows, table_name="animals", import_mode="APPEND")
+
+    form = urllib.parse.parse_qs(captured["body"].decode("ascii"))
+    assert form["ZOHO_IMPORT_DATA"] == ['common_name,size\nRabbit,small\n"Ele,phant",large\n']
+    assert form["ZOHO_IMPORT_TYPE"] == ["APPEND"]
+    assert captured["headers"]["Content-Type"] == "application/x-www-form-urlencoded"
+    assert result.successRowCount == 2
+
+
+def test_csv_form_body_replays_lists_but_not_generators() -> None:
+    replayable = streaming.CSVFormBody({}, "ZOHO_IMPORT_DATA", [("a", "b"), (1, 2)])
+    assert b"".join(replayable) == b"".join(replayable) == b"ZOHO_IMPORT_DATA=a%2Cb%0A1%2C2%0A"
+
+    one_shot = streaming.CSVFormBody({}, "ZOHO_IMPORT_DATA", (row for row in [("a", "b")]))
+    b"".join(one_shot)
+    with pytest.raises(RuntimeError):
+        b"".join(one_shot)
+
+
+class FakeStreamedResponse:
+    status_code = 200
+    reason = "OK"
+    headers = {"Content-Type": "text/csv;charset=UTF-8"}
+
+    def __init__(self, chunks: list[bytes]):
+        self.chunks = chunks
+        self.closed = False
+
+    @property
+    def text(self):
+        raise AssertionError("a streamed response body must not be read in one go")
+
+    def iter_content(self, chunk_size=1):
+        yield from self.chunks
+
+    def close(self):
+        self.closed = True
+
+
+def test_export_stream_yields_rows_incrementally(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = get_offline_enhanced_client()
+    body = '\ufeffcommon_name,notes\r\nRabbit,"line one\r\nline two"\r\nKoala,"caf\u00e9"\r\n'.encode("utf-8")
+    response = FakeStreamedResponse([body[i : i + 5] for i in range(0, len(body), 5)])
+    captured: dict[str, object] = {}
+
+    def fake_post(url, **kwargs):
+        captured.update(kwargs)
+        return response
+
+    monkeypatch.setattr(client.requests_session, "post", fake_post)
+
+    rows = list(client.data_export_using_sql_stream(sql="select * from animals", table_name="animals"))
+
+    assert captured["stream"] is True
+    assert rows == [
+        {"common_name": "Rabbit", "notes": "line one\r\nline two"},
+        {"common_name": "Koala", "notes": "caf\u00e9"},
+    ]
+    assert response.closed
+
+
+def test_export_stream_closes_responses_which_are_retried(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = get_offline_enhanced_client()
+    unavailable = FakeStreamedResponse([b"busy"])
+    unavailable.status_code = 503
+    responses = [unavailable, FakeStreamedResponse([b"common_name\r\nRabbit\r\n"])]
+    sleeps: list[float] = []
+
+    def fake_sleep(seconds):
+        assert unavailable.closed  # the connection goes back to the pool before waiting
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(client.requests_session, "post", lambda url, **kwargs: responses.pop(0))
+    monkeypatch.setattr(report_client.time, "sleep", fake_sleep)
+
+    rows = list(client.data_export_using_sql_stream(sql="select * from animals", table_name="animals"))
+
+    assert rows == [{"common_name": "Rabbit"}]
+    assert len(sleeps) == 1
+
+
+class DictCache:
+    """the get/set/delete subset of the django cache api"""
+
+    def __init__(self):
+        self.data: dict[str, object] = {}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value, timeout=None):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+WORKSPACES_METADATA = {
+    "data": {
+        "ownedWorkspaces": [{"workspaceName": "DearTest", "orgId": "org-1", "workspaceId": "ws-1"}],
+        "sharedWorkspaces": [
+            {"workspaceName": "DearTest", "orgId": "org-2", "workspaceId": "ws-2"},
+            {"workspaceName": "Cin7Omni", "orgId": "org-2", "workspaceId": "ws-3"},
+        ],
+    }
+}
+
+
+def test_get_org_and_workspace_id_is_cached(monkeypatch: pytest.MonkeyPatch) -> None:
+    backend = DictCache()
+    client = get_offline_enhanced_client()
+    client.workspace_cache_backend = backend
+    fetch_count = 0
+
+    def fake_get_all_workspaces():
+        nonlocal fetch_count
+        fetch_count += 1
+        return WORKSPACES_METADATA
+
+    monkeypatch.setattr(client, "get_all_workspaces_metadata_api_v2", fake_get_all_workspaces)
+
+    assert client.get_org_and_workspace_id() == ("org-1", "ws-1")
+    assert client.get_org_and_workspace_id("Cin7Omni") == ("org-2", "ws-3")
+    assert fetch_count == 1
+
+    other_process_client = get_offline_enhanced_client()
+    other_process_client.workspace_cache_backend = backend
+    monkeypatch.setattr(other_process_client, "get_all_workspaces_metadata_api_v2", fake_get_all_workspaces)
+    assert other_process_client.get_org_and_workspace_id("Cin7Omni") == ("org-2", "ws-3")
+    assert fetch_count == 1
+
+    client.invalidate_workspace_cache()
+    assert client.get_org_and_workspace_id() == ("org-1", "ws-1")
+    assert fetch_count == 2
+
+    with pytest.raises(RuntimeError):
+        client.get_org_and_workspace_id("Missing")
+    assert fetch_count == 3
+
+
+def get_oauth_client_with_fake_iam(monkeypatch: pytest.MonkeyPatch, iam_delay=0.0, token_store=None) -> tuple:
+    """an OAuth client whose IAM token endpoint is faked; returns the client and the list of IAM calls"""
+    client = EnhancedZohoAnalyticsClient(
+        login_email_id="test@example.com",
+        refresh_token="refresh",
+        clientId="client-id",
+        clientSecret="client-secret",
+        access_token="old-token",
+        reportServerURL="https://analytics.example.com",
+        token_store=token_store,
+    )
+    iam_calls: list[str] = []
+
+    def fake_get_resp(url, httpMethod, payLoad, add_token=True, **kwargs):
+        assert not add_token
+        time.sleep(iam_delay)
+        iam_calls.append(url)
+        token_response = {"access_token": f"new-token-{len(iam_calls)}", "expires_in": 3600}
+        return SimpleNamespace(status_code=200, response=SimpleNamespace(json=lambda: token_response))
+
+    monkeypatch.setattr(client, "getResp", fake_get_resp)
+    return client, iam_calls
+
+
+def test_expired_token_is_refreshed_once_for_many_threads(monkeypatch: pytest.MonkeyPatch) -> None:
+    client, iam_calls = get_oauth_client_with_fake_iam(monkeypatch, iam_delay=0.05)
+    client.token_timestamp = time.time() - 2 * client.token_max_age_seconds
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        tokens = list(executor.map(lambda _: client.access_token, range(8)))
+
+    assert len(iam_calls) == 1
+    assert set(tokens) == {"new-token-1"}
+
+
+def test_token_is_refreshed_in_background_before_expiry(monkeypatch: pytest.MonkeyPatch) -> None:
+    client, iam_calls = get_oauth_client_with_fake_iam(monkeypatch, iam_delay=0.05)
+    client.token_timestamp = time.time() - client.token_max_age_seconds + 60
+
+    assert client.access_token == "old-token"  # the caller does not wait for IAM
+    assert client.access_token == "old-token"
+    with client._token_refresh_lock:  # wait for the background refresh
+        pass
+
+    assert client.access_token == "new-token-1"
+    assert len(iam_calls) == 1
+
+
+def test_token_refreshed_by_another_process_is_reused(monkeypatch: pytest.MonkeyPatch, tmp_path) -> None:
+    token_path = str(tmp_path / "access_token.json")
+    client_a, iam_calls_a = get_oauth_client_with_fake_iam(monkeypatch, token_store=FileTokenStore(token_path))
+    client_b, iam_calls_b = get_oauth_client_with_fake_iam(monkeypatch, token_store=FileTokenStore(token_path))
+    client_a.token_timestamp = client_b.token_timestamp = time.time() - 2 * client_a.token_max_age_seconds
+
+    assert client_a.access_token == "new-token-1"
+    assert client_a.token_expires_at == pytest.approx(time.time() + 3600, abs=5)
+    assert client_b.access_token == "new-token-1"
+    assert client_b.token_expires_at == client_a.token_expires_at
+    assert len(iam_calls_a) == 1 and len(iam_calls_b) == 0
+
+
+def test_stored_tokens_are_only_used_by_their_own_account(monkeypatch: pytest.MonkeyPatch, tmp_path) -> None:
+    token_store = FileTokenStore(str(tmp_path / "access_token.json"))
+    client_a, _ = get_oauth_client_with_fake_iam(monkeypatch, token_store=token_store)
+    client_a.token_timestamp = time.time() - 2 * client_a.token_max_age_seconds
+    assert client_a.access_token == "new-token-1"
+
+    other_account = ReportClient("other-refresh", clientId="client-id", clientSecret="secret", token_store=token_store)
+    other_account.getResp = lambda *args, **kwargs: SimpleNamespace(
+        status_code=200, response=SimpleNamespace(json=lambda: {"access_token": "other-token", "expires_in": 3600})
+    )
+
+    assert other_account.token_key != client_a.token_key
+    assert other_account.access_token == "other-token"  # not client_a's token from the shared file
+    assert ReportClient("other-refresh", clientId="client-id", clientSecret="secret").default_token_file() != (
+        client_a.default_token_file()
+    )
+    FileTokenStore(str(tmp_path / "missing" / "token.json")).save({"access_token": "x"})  # logged, not raised
+
+
+def test_token_lifetime_seconds_handles_milliseconds() -> None:
+    assert ReportClient.token_lifetime_seconds({"expires_in": 3600}) == 3600
+    assert ReportClient.token_lifetime_seconds({"expires_in": 3600000}) == 3600
+    assert ReportClient.token_lifetime_seconds({"expires_in": 3600000, "expires_in_sec": 3590}) == 3590
+    assert ReportClient.token_lifetime_seconds({}) is None
+
+
+def test_auth_mode_is_per_client() -> None:
+    oauth_client = ReportClient("refresh", clientId="client-id", clientSecret="client-secret", access_token="token")
+    authtoken_client = ReportClient("an-authtoken")
+
+    assert oauth_client.isOAuth and not authtoken_client.isOAuth
+    assert "authtoken=" not in oauth_client.addQueryParams("https://x/api/a@b.com/db", "token", "EXPORT", "CSV")
+    assert "authtoken=an-authtoken" in authtoken_client.addQueryParams(
+        "https://x/api/a@b.com/db", "an-authtoken", "EXPORT", "CSV"
+    )
+
+
+def test_client_pool_keeps_one_client_per_account_and_data_centre() -> None:
+    pool = ZohoClientPool()
+    credentials = dict(refresh_token="refresh", clientId="client-id", clientSecret="client-secret", access_token="t")
+    us_client = pool.get_client("a@example.com", **credentials)
+    au_client = pool.get_client("a@example.com", data_centre="au", **credentials)
+
+    assert pool.get_client("a@example.com") is us_client
+    assert au_client is not us_client
+    assert au_client.reportServerURL == "https://analyticsapi.zoho.com.au"
+    assert au_client.iamServerURL == "https://accounts.zoho.com.au"
+    pool.remove_client("a@example.com", data_centre="au")
+    with pytest.raises(KeyError):
+        pool.get_client("a@example.com", data_centre="au")
+
+
+def test_pooled_clients_each_have_their_own_token_store(tmp_path) -> None:
+    pool = ZohoClientPool(token_directory=str(tmp_path))
+    credentials = dict(clientId="client-id", clientSecret="client-secret", access_token="t")
+    client_a = pool.get_client("a@example.com", refresh_token="refresh-a", **credentials)
+    client_b = pool.get_client("b@example.com", refresh_token="refresh-b", **credentials)
+
+    assert client_a.token_store.path != client_b.token_store.path
+    assert client_a.token_store.path == str(tmp_path / f"access_token.{client_a.token_key}.json")
+    client_a.access_token = "token-a"
+    assert client_b.load_token() is None
+
+
+def test_token_bucket_paces_requests_per_key(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(rate_limit.time, "sleep", lambda seconds: None)
+    limiter = rate_limit.TokenBucketRateLimiter(requests_per_minute=60, burst=2)
+
+    waits = [limiter.acquire("org-1") for _ in range(4)]
+
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] == pytest.approx(1.0, abs=0.01)
+    assert waits[3] == pytest.approx(2.0, abs=0.01)  # queued behind the third request
+    assert limiter.acquire("org-2") == 0.0
+    with pytest.raises(TypeError):
+        rate_limit.RateLimiter()  # abstract
+
+
+def test_sqlite_rate_limiter_is_shared_between_instances(monkeypatch: pytest.MonkeyPatch, tmp_path) -> None:
+    monkeypatch.setattr(rate_limit.time, "sleep", lambda seconds: None)
+    path = str(tmp_path / "rate_limit.sqlite")
+    first = rate_limit.SqliteRateLimiter(path, requests_per_minute=60, burst=1)
+    second = rate_limit.SqliteRateLimiter(path, requests_per_minute=60, burst=1)
+
+    assert first.acquire("org-1") == 0.0
+    assert second.acquire("org-1") == pytest.approx(1.0, abs=0.05)
+
+
+def test_send_request_acquires_from_rate_limiter(monkeypatch: pytest.MonkeyPatch) -> None:
+    acquired: list[str] = []
+    client = get_offline_enhanced_client()
+    client.rate_limiter = SimpleNamespace(acquire=acquired.append)
+    ok_response = SimpleNamespace(
+        status_code=200, response=SimpleNamespace(text='{"status": "success"}'), content=b'{"status": "success"}'
+    )
+    monkeypatch.setattr(client, "getResp", lambda *args, **kwargs: ok_response)
+
+    client._ReportClient__sendRequest("https://analytics.example.com/x", "GET", payLoad=None, action=None)
+
+    assert acquired == ["test@example.com"]
+
+
+def test_adaptive_concurrency_limiter_is_aimd() -> None:
+    limiter = rate_limit.AdaptiveConcurrencyLimiter(initial_limit=4, max_limit=6)
+
+    for _ in range(6):  # each success adds 1/limit
+        limiter.on_success()
+    assert limiter.limit == 5
+    limiter.on_throttle(6045)
+    limiter.on_throttle(6045)  # within the cooldown, so the limit is only cut once
+    assert limiter.limit == 2
+    assert [(change.limit, change.reason) for change in limiter.history] == [(5, "increase"), (2, "6045")]
+
+    limiter.acquire()
+    limiter.acquire()
+    third_request = ThreadPoolExecutor(max_workers=1).submit(limiter.acquire)
+    time.sleep(0.05)
+    assert not third_request.done() and limiter.in_flight == 2
+    limiter.release()
+    third_request.result(timeout=1)
+    assert limiter.in_flight == 2
+
+
+def test_send_request_reports_throttling_to_concurrency_limiter(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = get_offline_enhanced_client()
+    client.concurrency_limiter = rate_limit.AdaptiveConcurrencyLimiter(initial_limit=8)
+    rate_limited = '{"response": {"error": {"code": 7198, "message": "table design in progress"}}}'
+    responses = iter(
+        [
+            SimpleNamespace(status_code=400, response=SimpleNamespace(text=rate_limited)),
+            SimpleNamespace(status_code=200, response=SimpleNamespace(text="{}"), content=b"{}"),
+        ]
+    )
+    monkeypatch.setattr(client, "getResp", lambda *args, **kwargs: next(responses))
+    monkeypatch.setattr(report_client.time, "sleep", lambda seconds: None)
+
+    client._ReportClient__sendRequest("https://analytics.example.com/x", "GET", payLoad=None, action=None)
+
+    assert [change.reason for change in client.concurrency_limiter.history] == ["7198"]
+    assert client.concurrency_limiter.limit == 4
+    assert client.concurrency_limiter.in_flight == 0
+
+
+def test_throttling_errors_with_http_200_reach_the_concurrency_limiter(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = get_offline_enhanced_client()
+    client.concurrency_limiter = rate_limit.AdaptiveConcurrencyLimiter(initial_limit=8)
+    throttled = '{"response": {"error": {"code": 7198, "message": "table design in progress"}}}'
+    responses = iter(
+        [
+            SimpleNamespace(status_code=200, headers={}, response=SimpleNamespace(text=throttled)),
+            SimpleNamespace(status_code=200, headers={}, response=SimpleNamespace(text="{}"), content=b"{}"),
+        ]
+    )
+    monkeypatch.setattr(client, "getResp", lambda *args, **kwargs: next(responses))
+    monkeypatch.setattr(report_client.time, "sleep", lambda seconds: None)
+
+    client._ReportClient__sendRequest("https://analytics.example.com/x", "GET", payLoad=None, action=None)
+
+    assert [change.reason for change in client.concurrency_limiter.history] == ["7198"]
+
+
+def test_streamed_export_does_not_hold_the_last_concurrency_slot(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = get_offline_enhanced_client()
+    # the limit after throttling, kept at one for this test
+    client.concurrency_limiter = rate_limit.AdaptiveConcurrencyLimiter(initial_limit=1, min_limit=1, max_limit=1)
+    response = FakeStreamedResponse([b"name\r\n", b"Rabbit\r\n", b"Koala\r\n"])
+    xml = make_import_result_xml(1)
+    upload_response = SimpleNamespace(status_code=200, text=xml.decode(), content=xml, headers={}, reason="OK")
+    monkeypatch.setattr(
+        client.requests_session,
+        "post",
+        lambda url, **kwargs: response if kwargs.get("stream") else upload_response,
+    )
+
+    def copy_rows():
+        for row in client.data_export_using_sql_stream(sql="select name from animals", table_name="animals"):
+            client.data_upload(f"name\n{row['name']}\n", table_name="pets", import_mode="APPEND")
+
+    worker = threading.Thread(target=copy_rows, daemon=True)
+    worker.start()
+    worker.join(5)
+
+    assert not worker.is_alive()  # an upload made while the body is read got the only slot
+    assert response.closed
+    assert client.concurrency_limiter.in_flight == 0
+
+
+def test_quota_tracker_keeps_reserves_for_higher_priorities(tmp_path) -> None:
+    tracker = quota.ApiQuotaTracker(str(tmp_path / "quota.sqlite"), daily_limit=10)
+
+    low_calls = sum(tracker.try_consume("org-1", priority="low") for _ in range(10))
+    normal_calls = sum(tracker.try_consume("org-1", priority="normal") for _ in range(10))
+    high_calls = sum(tracker.try_consume("org-1", priority="high") for _ in range(10))
+
+    assert (low_calls, normal_calls, high_calls) == (7, 2, 1)
+    assert tracker.remaining("org-1") == 0 and tracker.remaining("org-2", priority="low") == 7
+
+
+def test_send_request_enforces_daily_quota(monkeypatch: pytest.MonkeyPatch, tmp_path) -> None:
+    client = get_offline_enhanced_client()
+    client.quota_tracker = quota.ApiQuotaTracker(str(tmp_path / "quota.sqlite"), daily_limit=100)
+    quota_exceeded = '{"response": {"error": {"code": 6043, "message": "daily limit exceeded"}}}'
+    calls = []
+
+    def fake_get_resp(*args, **kwargs):
+        calls.append(args)
+        return SimpleNamespace(status_code=400, response=SimpleNamespace(text=quota_exceeded))
+
+    monkeypatch.setattr(client, "getResp", fake_get_resp)
+    with client.api_priority("high"):
+        with pytest.raises(report_client.UnrecoverableRateLimitError):
+            client._ReportClient__sendRequest("https://analytics.example.com/x", "GET", payLoad=None, action=None)
+        assert client.quota_tracker.remaining("test@example.com") == 0
+        with pytest.raises(report_client.UnrecoverableRateLimitError) as raised:
+            client._ReportClient__sendRequest("https://analytics.example.com/x", "GET", payLoad=None, action=None)
+
+    assert raised.value.zoho_error_code == 6043
+    assert len(calls) == 1  # the second request was stopped locally
+    assert client.current_api_priority == "normal"
+
+
+def test_api_priority_belongs_to_one_client() -> None:
+    client_a = get_offline_enhanced_client()
+    client_b = get_offline_enhanced_client()
+
+    def priorities():
+        return client_a.current_api_priority, client_b.current_api_priority
+
+    with client_a.api_priority("low"):
+        assert priorities() == ("low", "normal")
+        run_in_worker = client_a.bind_api_priority(priorities)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(run_in_worker).result() == ("low", "normal")
+
+
+def test_async_client_uploads_exports_and_deletes(monkeypatch: pytest.MonkeyPatch) -> None:
+    httpx = pytest.importorskip("httpx")
+    requests_seen: list[tuple[str, str]] = []
+    invalid_token = {"response": {"error": {"code": 8535, "message": "invalid oauth token"}}}
+    rate_limited = {"response": {"error": {"code": 6045, "message": "rate limit"}}}
+
+    def handler(request):
+        if request.url.host == "accounts.example.com":
+            return httpx.Response(200, json={"access_token": "new-token", "expires_in": 3600})
+        action = request.url.params["ZOHO_ACTION"]
+        requests_seen.append((action, request.headers["Authorization"]))
+        if request.headers["Authorization"] == "Zoho-oauthtoken old-token":
+            return httpx.Response(401, json=invalid_token)
+        if action == "IMPORT":
+            if len(requests_seen) == 2:
+                return httpx.Response(400, json=rate_limited)
+            form = urllib.parse.parse_qs(request.content.decode("ascii"))
+            assert form["ZOHO_IMPORT_DATA"] == ["common_name,size\nRabbit,small\nElephant,large\n"]
+            return httpx.Response(200, content=make_import_result_xml(2))
+        if action == "EXPORT":
+            assert request.url.params["ZOHO_SQLQUERY"] == "select * from animals"
+            return httpx.Response(200, text="common_name,size\nRabbit,small\n")
+        return httpx.Response(200, json={"response": {"result": {"deletedrows": 3}}})
+
+    async def no_sleep(seconds):
+        pass
+
+    async def run() -> tuple:
+        async with async_report_client.AsyncZohoAnalyticsClient(
+            login_email_id="test@example.com",
+            refresh_token="refresh",
+            default_databasename="DearTest",
+            access_token="old-token",
+            clientId="client-id",
+            clientSecret="client-secret",
+            serverURL="https://accounts.example.com",
+            reportServerURL="https://analytics.example.com",
+            transport=httpx.MockTransport(handler),
+        ) as client:
+            monkeypatch.setattr(async_report_client.asyncio, "sleep", no_sleep)
+            rows = [{"common_name": "Rabbit", "size": "small"}, {"common_name": "Elephant", "size": "large"}]
+            import_result = await client.data_upload(rows, table_name="animals")
+            exported = list(await client.data_export_using_sql("select * from animals", table_name="animals"))
+            deleted = await client.delete_rows("animals", "size = 'small'")
+            return import_result, exported, deleted
+
+    import_result, exported, deleted = asyncio.run(run())
+
+    assert import_result.successRowCount == 2
+    assert exported == [{"common_name": "Rabbit", "size": "small"}]
+    assert deleted == 3
+    assert [action for action, _ in requests_seen] == ["IMPORT", "IMPORT", "IMPORT", "EXPORT", "DELETE"]
+
+
+def test_async_client_gets_table_metadata_v2() -> None:
+    httpx = pytest.importorskip("httpx")
+
+    def handler(request):
+        path = request.url.path
+        if path.endswith("/workspaces/"):
+            return httpx.Response(200, json=WORKSPACES_METADATA)
+        if path.endswith("/views/"):
+            assert request.headers["ZANALYTICS-ORGID"] == "org-1"
+            views = [{"viewId": name, "viewName": name, "viewType": "Table"} for name in ("animals", "plants")]
+            return httpx.Response(200, json={"data": {"views": views}})
+        view_id = path.rsplit("/", 1)[-1]
+        columns = [{"columnName": "Name", "dataType": "PLAIN"}]
+        view = {"viewId": view_id, "viewName": view_id, "viewType": "Table", "columns": columns}
+        return httpx.Response(200, json={"data": {"views": view}})
+
+    async def run():
+        async with async_report_client.AsyncZohoAnalyticsClient(
+            login_email_id="test@example.com",
+            refresh_token="authtoken",
+            default_databasename="DearTest",
+            reportServerURL="https://analytics.example.com",
+            transport=httpx.MockTransport(handler),
+        ) as client:
+            return await client.get_table_metadata_v2(force_lowercase_column_names=True)
+
+    metadata = asyncio.run(run())
+
+    assert list(metadata) == ["animals", "plants"]
+    assert metadata["animals"]["name"]["dataType"] == "PLAIN"
+
+
+def test_upstream_client_reuses_one_session(monkeypatch) -> None:
+    client = analytics_client_upstream.AnalyticsClient("id", "secret", "refresh", pool_maxsize=7)
+    client.access_token = "token"
+    sessions_used = []
+
+    def fake_request(self, method, url, **kwargs):
+        sessions_used.append(self)
+        return SimpleNamespace(status_code=200, text='{"data": {}}', content=b"", headers={})
+
+    monkeypatch.setattr(requests.Session, "request", fake_request)
+    client.send_api_request("GET", "/restapi/v2/orgs", None, None)
+    client.send_api_request("GET", "/restapi/v2/workspaces", None, None)
+    client.submit_export_request("https://analyticsapi.zoho.com/restapi/v2/bulk", None)
+
+    assert len(sessions_used) == 3 and len(set(map(id, sessions_used))) == 1
+    assert sessions_used[0].get_adapter("https://analyticsapi.zoho.com")._pool_maxsize == 7
+
+    client.set_proxy("proxy.example.com", "3128", None, None)
+    proxied_session = client.get_request_obj()
+    assert proxied_session is not sessions_used[0]
+    assert proxied_session.proxies["https"] == "http://proxy.example.com:3128"
+
+
+def test_bulk_import_many_polls_jobs_until_finished(monkeypatch, tmp_path) -> None:
+    client = get_offline_enhanced_client()
+    views = [{"viewId": "v-animals", "viewName": "animals"}, {"viewId": "v-plants", "viewName": "plants"}]
+    monkeypatch.setattr(client, "get_org_and_workspace_id", lambda database_name=None: ("org-1", "ws-1"))
+    monkeypatch.setattr(client, "get_views_api_v2", lambda **kwargs: {"data": {"views": views}})
+    polls: dict[str, int] = {}
+
+    def fake_request(self, method, url, **kwargs):
+        assert kwargs["headers"]["Authorization"] == "Zoho-oauthtoken authtoken"
+        if method == "POST":
+            view_id = url.split("/views/")[1].split("/")[0]
+            data = {"jobId": "job-" + view_id}
+        else:
+            job_id = url.rsplit("/", 1)[-1]
+            polls[job_id] = polls.get(job_id, 0) + 1
+            final_code = "1003" if job_id == "job-v-plants" else "1004"
+            data = {"jobId": job_id, "jobCode": "1002" if polls[job_id] < 3 else final_code}
+        return SimpleNamespace(status_code=200, text=json.dumps({"data": data}), headers={})
+
+    monkeypatch.setattr(requests.Session, "request", fake_request)
+    csv_path = tmp_path / "rows.csv"
+    csv_path.write_text("name\nrabbit\n")
+    jobs = [{"table_name": name, "file_path": str(csv_path)} for name in ("animals", "plants", "fungi")]
+
+    results = client.bulk_import_many(jobs, poll_interval_seconds=0.001, max_poll_interval_seconds=0.002)
+
+    assert [(result["name"], result["status"], result["job_code"]) for result in results] == [
+        ("animals", "completed", 1004),
+        ("plants", "failed", 1003),
+        ("fungi", "error", None),
+    ]
+    assert polls == {"job-v-animals": 3, "job-v-plants": 3}
+    assert "fungi" in results[2]["error"]
+
+
+def test_bulk_job_is_polled_once_even_if_the_timeout_is_shorter_than_the_poll_interval() -> None:
+    polls: list[int] = []
+
+    def get_job_details():
+        polls.append(1)
+        return {"jobId": "job-1", "jobCode": "1004"}
+
+    status, details = bulk.wait_for_job(get_job_details, timeout_seconds=0.01, poll_interval_seconds=10)
+
+    assert (status, details["jobCode"], len(polls)) == ("completed", "1004", 1)
+
+
+def test_upstream_requests_refresh_only_the_token_they_were_sent_with(monkeypatch: pytest.MonkeyPatch) -> None:
+    client, iam_calls = get_oauth_client_with_fake_iam(monkeypatch)
+    client.token_timestamp = time.time()
+    sent_tokens: list[str] = []
+
+    def fake_request(self, method, url, **kwargs):
+        sent_tokens.append(kwargs["headers"]["Authorization"])
+        if client.access_token == "old-token":
+            client.access_token = "rotated-token"  # refreshed by another thread while this request was sent
+            error = json.dumps({"status": "failure", "data": {"errorCode": 8535, "errorMessage": "expired"}})
+            return SimpleNamespace(status_code=401, text=error, headers={})
+        return SimpleNamespace(status_code=200, text=json.dumps({"data": {"jobId": "job-1"}}), headers={})
+
+    monkeypatch.setattr(requests.Session, "request", fake_request)
+
+    client.upstream_client().get_bulk_instance("org-1", "ws-1").get_import_job_details("job-1")
+
+    assert sent_tokens == ["Zoho-oauthtoken old-token", "Zoho-oauthtoken rotated-token"]
+    assert iam_calls == []
+
+
+def test_bulk_export_many_downloads_completed_jobs(monkeypatch, tmp_path) -> None:
+    client = get_offline_enhanced_client()
+    monkeypatch.setattr(client, "get_org_and_workspace_id", lambda database_name=None: ("org-1", "ws-1"))
+    queries = {"animals": "select * from animals", "stuck": "select * from big_table"}
+
+    def fake_request(self, method, url, params=None, **kwargs):
+        if url.endswith("/bulk/workspaces/ws-1/data"):
+            sql = json.loads(urllib.parse.parse_qs(params)["CONFIG"][0])["sqlQuery"]
+            data = {"jobId": "job-animals" if "animals" in sql else "job-stuck"}
+        elif url.endswith("/data"):
+            return FakeStreamedResponse([b"name\n", b"rabbit\n"])
+        else:
+            job_id = url.rsplit("/", 1)[-1]
+            data = {"jobId": job_id, "jobCode": "1004" if job_id == "job-animals" else "1002"}
+        return SimpleNamespace(status_code=200, text=json.dumps({"data": data}), headers={})
+
+    monkeypatch.setattr(requests.Session, "request", fake_request)
+
+    results = client.bulk_export_many(
+        queries,
+        output_dir=str(tmp_path),
+        job_timeout_seconds=0.05,
+        poll_interval_seconds=0.001,
+        max_poll_interval_seconds=0.002,
+    )
+
+    assert [(result["name"], result["status"]) for result in results] == [
+        ("animals", "completed"),
+        ("stuck", "timeout"),
+    ]
+    assert results[0]["output"] == str(tmp_path / "animals.csv")
+    assert (tmp_path / "animals.csv").read_bytes() == b"name\nrabbit\n"
+    assert not (tmp_path / "stuck.csv").exists()
+
+
+def test_upstream_export_streams_chunks_to_any_sink(monkeypatch, tmp_path) -> None:
+    client = analytics_client_upstream.AnalyticsClient("id", "secret", "refresh")
+    client.access_token = "token"
+    chunks = [b"name,size\n"] + [b"rabbit,small\n"] * 1000
+    requested: list[bool] = []
+
+    def fake_request(self, method, url, stream=False, **kwargs):
+        requested.append(stream)
+        return FakeStreamedResponse(chunks)
+
+    monkeypatch.setattr(requests.Session, "request", fake_request)
+    bulk_api = client.get_bulk_instance("org-1", "ws-1")
+    received: list[bytes] = []
+    bulk_api.export_bulk_data("job-1", received.append)
+    bulk_api.export_bulk_data("job-1", str(tmp_path / "rows.csv.gz"), compress=True)
+    file_object = io.BytesIO()
+    bulk_api.export_bulk_data("job-1", file_object)
+
+    assert requested == [True, True, True]
+    assert received == chunks
+    assert gzip.decompress((tmp_path / "rows.csv.gz").read_bytes()) == b"".join(chunks)
+    assert file_object.getvalue() == b"".join(chunks)
+
+
+def test_upstream_export_which_fails_partway_leaves_no_file(monkeypatch, tmp_path) -> None:
+    client = analytics_client_upstream.AnalyticsClient("id", "secret", "refresh")
+    client.access_token = "token"
+    (tmp_path / "previous.csv").write_bytes(b"name\nkoala\n")
+
+    class BrokenDownload(FakeStreamedResponse):
+        def iter_content(self, chunk_size=1):
+            yield b"name,size\n"
+            raise requests.exceptions.ChunkedEncodingError("connection broken")
+
+    monkeypatch.setattr(requests.Session, "request", lambda self, *args, **kwargs: BrokenDownload([]))
+    bulk_api = client.get_bulk_instance("org-1", "ws-1")
+    for file_name in ("rows.csv", "previous.csv"):
+        with pytest.raises(requests.exceptions.ChunkedEncodingError):
+            bulk_api.export_bulk_data("job-1", str(tmp_path / file_name))
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["previous.csv"]
+    assert (tmp_path / "previous.csv").read_bytes() == b"name\nkoala\n"
+
+
+def parse_multipart_file(body: streaming.MultipartFileBody) -> tuple[str, bytes]:
+    """the file name and content of a MultipartFileBody, sent through the email parser"""
+    raw = f"Content-Type: {body.content_type}\r\n\r\n".encode("ascii") + b"".join(body)
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(raw)
+    part = next(part for part in message.iter_parts() if part.get_filename())
+    return part.get_filename(), part.get_payload(decode=True)
+
+
+def test_multipart_file_body_streams_and_closes_files(monkeypatch, tmp_path) -> None:
+    csv_path = tmp_path / "animals.csv"
+    csv_path.write_bytes(b"name,size\n" + b"rabbit,small\n" * 10000)
+    opened = []
+
+    def tracking_open(*args, **kwargs):
+        opened.append(open(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(streaming, "open", tracking_open, raising=False)
+    body = streaming.MultipartFileBody("FILE", str(csv_path), piece_size=4096)
+
+    assert parse_multipart_file(body) == ("animals.csv", csv_path.read_bytes())
+    assert parse_multipart_file(body) == ("animals.csv", csv_path.read_bytes())  # a retry reopens the file
+    assert len(opened) == 2 and all(in_file.closed for in_file in opened)
+
+    rows = (f"{n},small\n" for n in range(1000))
+    filename, payload = parse_multipart_file(streaming.MultipartFileBody("FILE", rows, compression="gzip"))
+    assert filename == "data.csv.gz"
+    assert gzip.decompress(payload) == "".join(f"{n},small\n" for n in range(1000)).encode("utf-8")
+
+
+def test_upstream_bulk_import_sends_a_streamed_multipart_body(monkeypatch) -> None:
+    client = analytics_client_upstream.AnalyticsClient("id", "secret", "refresh")
+    client.access_token = "token"
+    sent = {}
+
+    def fake_request(self, method, url, data=None, headers=None, **kwargs):
+        assert not isinstance(data, (bytes, str)) and "files" not in kwargs
+        sent["file"] = parse_multipart_file(data)
+        return SimpleNamespace(status_code=200, text=json.dumps({"data": {"jobId": "job-1"}}), headers={})
+
+    monkeypatch.setattr(requests.Session, "request", fake_request)
+    bulk_api = client.get_bulk_instance("org-1", "ws-1")
+
+    job_id = bulk_api.import_bulk_data("v-1", "append", "csv", "true", (b"name\n", b"rabbit\n"))
+
+    assert job_id == "job-1"
+    assert sent["file"] == ("data.csv", b"name\nrabbit\n")
+    assert "Content-Type" not in bulk_api.request_headers
+
+
+def test_compressed_upload_bytes_on_the_wire() -> None:
+    """a benchmark of the request body sizes of an hourly sync of 20,000 rows, sent with and without compress"""
+    rows = [
+        {
+            "order_id": 100000 + n,
+            "customer": f"Customer {n % 500}",
+            "status": ("paid", "open", "void")[n % 3],
+            "amount": f"{(n * 37) % 10000 / 100:.2f}",
+            "date": f"2024-{n % 12 + 1:02d}-{n % 28 + 1:02d}",
+        }
+        for n in range(20000)
+    ]
+    form_fields = ReportClient.import_form_fields("APPEND")
+    plain_body = streaming.CSVFormBody(form_fields, "ZOHO_IMPORT_DATA", rows)
+    csv_bytes = "".join(streaming.iter_csv_lines(rows)).encode("utf-8")
+    zipped_body = streaming.MultipartFileBody(
+        "ZOHO_FILE", io.BytesIO(csv_bytes), "data.csv", compression="zip", form_fields=form_fields
+    )
+
+    plain_bytes = sum(map(len, plain_body))
+    zipped_bytes = sum(map(len, zipped_body))
+    ratio = plain_bytes / zipped_bytes
+
+    assert 5 < ratio < 20, f"uncompressed: {plain_bytes} bytes, zipped: {zipped_bytes} bytes, {ratio:.1f}x"
+
+
+def test_compressed_import_falls_back_when_zoho_rejects_it(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = get_offline_enhanced_client()
+    bodies: list[object] = []
+
+    resent_csv: list[str] = []
+
+    def fake_post(url, data=None, headers=None, **kwargs):
+        bodies.append(data)
+        if isinstance(data, streaming.MultipartFileBody):
+            _, archive = parse_multipart_file(data)
+            assert streaming.unzip_single_member(archive) == b"common_name\nRabbit\nKoala\n"
+            error = json.dumps({"response": {"error": {"code": 7280, "message": "Unsupported file"}}})
+            return SimpleNamespace(status_code=400, text=error, content=error.encode(), headers={}, reason="Bad")
+        if isinstance(data, streaming.CSVFormBody):
+            resent_csv.extend(urllib.parse.parse_qs(b"".join(data).decode("ascii"))["ZOHO_IMPORT_DATA"])
+        xml = make_import_result_xml(2)
+        return SimpleNamespace(status_code=200, text=xml.decode(), content=xml, headers={}, reason="OK")
+
+    monkeypatch.setattr(client.requests_session, "post", fake_post)
+    rows = iter([{"common_name": "Rabbit"}, {"common_name": "Koala"}])  # one-shot, but kept in the spooled file
+
+    result = client.data_upload(rows, table_name="animals", import_mode="APPEND", compress=True, retry_limit=1)
+    client.data_upload("common_name\nWombat\n", table_name="animals", import_mode="APPEND", compress=True)
+
+    assert result.successRowCount == 2
+    assert [type(body).__name__ for body in bodies] == ["MultipartFileBody", "CSVFormBody", "dict"]
+    assert resent_csv == ["common_name\nRabbit\nKoala\n"]
+    assert client.compressed_uploads_supported is False
+
+
+def test_compressed_import_raises_errors_other_than_an_unreadable_file(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = get_offline_enhanced_client()
+    bodies: list[object] = []
+
+    def fake_post(url, data=None, headers=None, **kwargs):
+        bodies.append(data)
+        error = json.dumps({"response": {"error": {"code": 8509, "message": "Invalid value"}}})
+        return SimpleNamespace(status_code=400, text=error, content=error.encode(), headers={}, reason="Bad")
+
+    monkeypatch.setattr(client.requests_session, "post", fake_post)
+
+    with pytest.raises(report_client.BadDataError):
+        client.data_upload("common_name\nRabbit\n", table_name="animals", import_mode="APPEND", compress=True)
+
+    assert [type(body).__name__ for body in bodies] == ["MultipartFileBody"]
+    assert client.compressed_uploads_supported is True
+
+
+def test_export_cache_keys_are_namespaced_and_normalized() -> None:
+    key = export_cache.export_cache_key(
+        "analyticsapi.zoho.com", "me@example.com", "Sales", "select * from sales", "csv"
+    )
+
+    assert key == export_cache.export_cache_key(
+        "analyticsapi.zoho.com", "me@example.com", "Sales", "SELECT *\n  FROM sales;", "CSV"
+    )
+    assert key != export_cache.export_cache_key(
+        "analyticsapi.zoho.eu", "me@example.com", "Sales", "select * from sales", "csv"
+    )
+    assert key != export_cache.export_cache_key(
+        "analyticsapi.zoho.com", "me@example.com", "Test Sales", "select * from sales", "csv"
+    )
+    assert export_cache.normalize_sql("SELECT  Name FROM animals WHERE Name = 'Big  Rabbit'") == (
+        "select name from animals where name = 'Big  Rabbit'"
+    )
+
+
+def test_lru_and_disk_caches_are_bounded_in_bytes(tmp_path) -> None:
+    memory_cache = export_cache.LRUMemoryCache(max_bytes=100)
+    memory_cache.set("a", "x" * 40)
+    memory_cache.set("b", "y" * 40)
+    assert memory_cache.get("a") == "x" * 40  # a is now the most recently used
+    memory_cache.set("c", "z" * 40)
+
+    assert memory_cache.get("b") is None
+    assert memory_cache.current_bytes == 80
+    assert memory_cache.stats.snapshot() == {"sets": 3, "hits": 1, "misses": 1, "evictions": 1}
+
+    disk_cache = export_cache.DiskCache(str(tmp_path), max_bytes=None)
+    csv_text = "name,size\n" + "rabbit,small\n" * 10000
+    disk_cache.set("animals", csv_text, timeout=60)
+    disk_cache.set("expired", "old", timeout=-1)
+
+    assert disk_cache.get("animals") == csv_text
+    assert disk_cache.get("expired") is None
+    assert sum(path.stat().st_size for path in tmp_path.iterdir()) < len(csv_text) / 20
+
+
+def test_disk_cache_scans_its_directory_only_when_it_may_be_full(monkeypatch, tmp_path) -> None:
+    scans: list[str] = []
+    real_scandir = os.scandir
+
+    def counting_scandir(path):
+        scans.append(path)
+        return real_scandir(path)
+
+    monkeypatch.setattr(export_cache.os, "scandir", counting_scandir)
+    disk_cache = export_cache.DiskCache(str(tmp_path), max_bytes=20000)
+    for number in range(200):
+        disk_cache.set(f"export-{number}", os.urandom(500).hex(), timeout=60)
+
+    assert sum(path.stat().st_size for path in tmp_path.iterdir()) <= 20000
+    assert disk_cache.get("export-199") is not None
+    assert disk_cache.get("export-0") is None
+    assert disk_cache.stats.snapshot()["evictions"] > 100
+    assert len(scans) < 200 / 3
+
+
+def test_disk_cache_write_errors_are_logged_and_leave_no_files(tmp_path) -> None:
+    disk_cache = export_cache.DiskCache(str(tmp_path / "cache"), max_bytes=None)
+    disk_cache.set("unserializable", {"csv": object()}, timeout=60)
+
+    assert os.listdir(tmp_path / "cache") == []
+
+    os.rmdir(tmp_path / "cache")
+    disk_cache.set("no-directory", "name\nrabbit\n", timeout=60)  # the temporary file cannot be created
+
+    assert disk_cache.get("no-directory") is None
+    assert disk_cache.stats.snapshot().get("sets", 0) == 0
+
+
+def test_export_using_sql_is_served_from_the_export_cache(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = get_offline_enhanced_client()
+    client.export_cache = export_cache.LRUMemoryCache()
+    exports: list[str] = []
+
+    def fake_export(tableOrReportURI, format, sql, retry_countdown):
+        exports.append(sql)
+        return io.BytesIO('\ufeffname,notes\r\nRabbit,"two\r\nlines"\r\n'.encode("utf-8"))
+
+    monkeypatch.setattr(client, "exportDataUsingSQL_v2", fake_export)
+
+    first = list(client.data_export_using_sql("select * from animals", table_name="animals"))
+    second = list(client.data_export_using_sql("SELECT * FROM animals", table_name="animals"))
+
+    assert first == second == [{"name": "Rabbit", "notes": "two\r\nlines"}]
+    assert len(exports) == 1
+    assert client.export_cache_stats.snapshot() == {"misses": 1, "hits": 1}
+    assert client.export_cache_stats.hit_ratio == 0.5
+
+
+def test_tables_in_sql_finds_from_join_and_subquery_tables() -> None:
+    sql = """SELECT a.name, c.size FROM "Animal Types" a, habitats h JOIN sizes AS c ON a.id = c.id
+        WHERE a.name = 'from the zoo' AND a.id IN (select animal_id from sightings) ORDER BY 1"""
+
+    assert export_cache.tables_in_sql(sql) == {"animal types", "sizes", "habitats", "sightings"}
+    assert export_cache.ordered_tables_in_sql(sql) == ["animal types", "habitats", "sizes", "sightings"]
+    assert export_cache.tables_in_sql("select 1") == set()
+
+
+def test_writes_invalidate_only_the_cached_exports_of_the_table(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = get_offline_enhanced_client()
+    client.export_cache = export_cache.LRUMemoryCache()
+    monkeypatch.setattr(client, "exportDataUsingSQL_v2", lambda **kwargs: io.BytesIO(b"count\r\n1\r\n"))
+    monkeypatch.setattr(client, "_ReportClient__sendRequest", lambda *args, **kwargs: 1)
+    queries = ["select count(*) from animals", "select count(*) from plants", "select * from plants join animals"]
+    for sql in queries:
+        client.data_export_using_sql(sql, table_name="animals")
+
+    def is_cached(sql):
+        return client.export_cache.get(client.export_cache_key(sql, "DearTest")) is not None
+
+    client.delete_rows("Animals", "size = 'small'")
+
+    assert [is_cached(sql) for sql in queries] == [False, True, False]
+    assert client.export_cache_stats.snapshot()["invalidations"] == 1
+    uri = client.getURI("test@example.com", "Dear/Test", "Animals & Plants")
+    assert client.splitURI(uri) == ("test@example.com", "Dear/Test", "Animals & Plants")
+
+
+def test_writes_invalidate_the_cached_exports_of_a_table_with_a_backslash_in_its_name(monkeypatch) -> None:
+    client = get_offline_enhanced_client()
+    client.export_cache = export_cache.LRUMemoryCache()
+    monkeypatch.setattr(client, "exportDataUsingSQL_v2", lambda **kwargs: io.BytesIO(b"count\r\n1\r\n"))
+    monkeypatch.setattr(client, "_ReportClient__sendRequest", lambda *args, **kwargs: 1)
+    sql = 'select count(*) from "x\\y"'
+    client.data_export_using_sql(sql, table_name="x\\y")
+
+    client.delete_rows("x\\y", "size = 'small'")
+
+    assert client.export_cache.get(client.export_cache_key(sql, "DearTest")) is None
+    uri = client.getURI("test@example.com", "Dear\\Test", "x\\y/z")
+    assert client.splitURI(uri) == ("test@example.com", "Dear\\Test", "x\\y/z")
+
+
+def test_writes_invalidate_cached_exports_after_cache_eviction(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = get_offline_enhanced_client()
+    cache = client.export_cache = export_cache.LRUMemoryCache(max_bytes=3000)
+    counts = iter(range(1, 10))
+    monkeypatch.setattr(
+        client, "exportDataUsingSQL_v2", lambda **kwargs: io.BytesIO(f"count\r\n{next(counts)}\r\n".encode())
+    )
+    monkeypatch.setattr(client, "_ReportClient__sendRequest", lambda *args, **kwargs: 1)
+    sql = "select count(*) from animals"
+
+    assert list(client.data_export_using_sql(sql, table_name="animals")) == [{"count": "1"}]
+    old_key = client.export_cache_key(sql, "DearTest")
+    assert cache.get(old_key) is not None  # so the version of animals is the least recently used entry
+    cache.set("padding", "x" * (cache.max_bytes - cache.current_bytes + 1))  # evicts the version of animals
+
+    assert cache.stats.snapshot()["evictions"] == 1
+    assert cache.get(old_key) is not None  # the export is still cached
+    client.delete_rows("Animals", "size = 'small'")
+
+    assert list(client.data_export_using_sql(sql, table_name="animals")) == [{"count": "2"}]
+    assert cache.get(old_key) is not None  # but it is no longer found
+
+
+def test_identical_concurrent_exports_share_one_request(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = get_offline_enhanced_client()
+    exports: list[str] = []
+
+    def fake_export(tableOrReportURI, format, sql, retry_countdown):
+        exports.append(sql)
+        time.sleep(0.3)  # the other callers arrive while this export is running
+        return io.BytesIO(b"count\r\n7\r\n")
+
+    monkeypatch.setattr(client, "exportDataUsingSQL_v2", fake_export)
+    callers = 6
+    barrier = threading.Barrier(callers)
+
+    def export(sql):
+        barrier.wait()
+        return list(client.data_export_using_sql(sql, table_name="animals"))
+
+    queries = ["select count(*) from animals"] * (callers - 1) + ["SELECT COUNT(*) FROM animals;"]
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        results = list(executor.map(export, queries))
+
+    assert results == [[{"count": "7"}]] * callers
+    assert len(exports) == 1
+    assert client.export_cache_stats.snapshot() == {"coalesced": callers - 1}
+    assert not client.export_flights._calls
+
+
+def test_stale_cached_export_is_returned_and_refreshed_in_the_background(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = get_offline_enhanced_client()
+    client.export_cache = export_cache.LRUMemoryCache()
+    exports: list[str] = []
+    refresh_started = threading.Event()
+    finish_refresh = threading.Event()
+
+    def fake_export(tableOrReportURI, format, sql, retry_countdown):
+        exports.append(sql)
+        if len(exports) > 1:
+            refresh_started.set()
+            finish_refresh.wait(5)
+        return io.BytesIO(f"count\r\n{len(exports)}\r\n".encode("utf-8"))
+
+    monkeypatch.setattr(client, "exportDataUsingSQL_v2", fake_export)
+
+    def count(**kwargs):
+        return list(client.data_export_using_sql("select count(*) from animals", table_name="animals", **kwargs))
+
+    assert count(stale_after_seconds=60) == [{"count": "1"}]
+    assert count(stale_after_seconds=60) == [{"count": "1"}]
+    assert len(exports) == 1
+    time.sleep(0.01)
+    # past the soft TTL: the stale copy comes back at once, while one refresh runs
+    assert count(stale_after_seconds=0) == [{"count": "1"}]
+    assert refresh_started.wait(5)
+    assert count(stale_after_seconds=0) == [{"count": "1"}]
+    finish_refresh.set()
+    for _ in range(500):
+        if client.export_cache_stats.snapshot().get("refreshes"):
+            break
+        time.sleep(0.01)
+
+    assert count() == [{"count": "2"}]
+    assert len(exports) == 2
+    assert client.export_cache_stats.snapshot() == {"misses": 1, "hits": 4, "stale_hits": 2, "refreshes": 1}
+
+
+def test_exports_started_before_a_write_are_not_joined_or_cached_after_it(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = get_offline_enhanced_client()
+    client.export_cache = export_cache.LRUMemoryCache()
+    exports: list[str] = []
+    export_started = threading.Event()
+    finish_export = threading.Event()
+
+    def fake_export(tableOrReportURI, format, sql, retry_countdown):
+        exports.append(sql)
+        number = len(exports)
+        if number == 1:
+            export_started.set()
+            finish_export.wait(5)
+        return io.BytesIO(f"count\r\n{number}\r\n".encode("utf-8"))
+
+    monkeypatch.setattr(client, "exportDataUsingSQL_v2", fake_export)
+    monkeypatch.setattr(client, "_ReportClient__sendRequest", lambda *args, **kwargs: 1)
+
+    def count():
+        return list(client.data_export_using_sql("select count(*) from animals", table_name="animals"))
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        before_write = executor.submit(count)
+        assert export_started.wait(5)
+        client.delete_rows("Animals", "size = 'small'")
+        after_write = count()  # does not wait for the export which started before the write
+        finish_export.set()
+
+    assert before_write.result() == [{"count": "1"}]
+    assert after_write == [{"count": "2"}]
+    assert count() == [{"count": "2"}]
+    assert len(exports) == 2
+    assert client.export_cache_stats.snapshot() == {"misses": 2, "hits": 1, "invalidations": 1, "superseded": 1}
+
+
+TYPED_EXPORT_SCHEMA = {
+    "Animals": {
+        "name": {"columnName": "name", "dataType": "PLAIN", "dataTypeId": 12},
+        "legs": {"columnName": "legs", "dataType": "NUMBER", "dataTypeId": -5},
+        "weight": {"columnName": "weight", "dataType": "DECIMAL_NUMBER", "dataTypeId": 8},
+        "born": {"columnName": "born", "dataType": "DATE", "dataTypeId": 93},
+        "tame": {"columnName": "tame", "dataType": "BOOLEAN"},
+    }
+}
+TYPED_EXPORT_CSV = (
+    "name,legs,weight,born,tame,total\r\n"
+    "Rabbit,4,\"1,250.5\",2021-03-04 05:06:07,true,3\r\n"
+    "Snake,0,,12 Jan 2020 00:00:00,false,4\r\n"
+)
+
+
+def test_typed_export_decodes_columns_from_table_metadata(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = get_offline_enhanced_client()
+    monkeypatch.setattr(client, "exportDataUsingSQL_v2", lambda **kwargs: io.BytesIO(TYPED_EXPORT_CSV.encode()))
+
+    result = client.data_export_typed(
+        "select a.*, 3 as total from animals a",
+        table_name="animals",
+        schema=TYPED_EXPORT_SCHEMA,
+        column_kinds={"total": "int"},
+        use_numpy=False,
+    )
+
+    assert len(result) == 2
+    kinds = {"name": "str", "legs": "int", "weight": "float", "born": "date", "tame": "bool", "total": "int"}
+    assert result.kinds == kinds
+    assert result["name"] == ["Rabbit", "Snake"]
+    assert result["legs"] == array.array("q", [4, 0])
+    assert result["weight"][0] == 1250.5 and result["weight"][1] != result["weight"][1]  # NaN for the blank
+    assert result["born"] == [datetime.datetime(2021, 3, 4, 5, 6, 7), datetime.datetime(2020, 1, 12)]
+    assert list(result["tame"]) == [True, False]
+    assert next(result.rows())["total"] == 3
+
+
+def test_typed_export_uses_numpy_arrays_when_installed() -> None:
+    numpy = pytest.importorskip("numpy")
+    kinds = EnhancedZohoAnalyticsClient.column_kinds_from_schema(TYPED_EXPORT_SCHEMA, ["ANIMALS"])
+
+    result = columnar.decode_csv(TYPED_EXPORT_CSV, kinds)
+
+    assert result["legs"].dtype == numpy.int64
+    assert numpy.isnan(result["weight"][1])
+    assert result["born"].dtype == numpy.dtype("datetime64[s]")
+    assert result["born"][1] == numpy.datetime64("2020-01-12T00:00:00")
+    assert result["tame"].tolist() == [True, False]
+
+
+@pytest.mark.parametrize("engine,library", [("pandas", "pandas"), ("arrow", "pyarrow")])
+def test_dataframe_export_and_upload_round_trip(monkeypatch: pytest.MonkeyPatch, engine, library) -> None:
+    pytest.importorskip(library)
+    client = get_offline_enhanced_client()
+    exported_csv = (
+        "name,legs,weight,born,tame\r\nRabbit,4,1250.5,2021-03-04 05:06:07,true\r\nNA,,2,12 Jan 2020 00:00:00,\r\n"
+    )
+    monkeypatch.setattr(client, "exportDataUsingSQL_v2", lambda **kwargs: io.BytesIO(exported_csv.encode()))
+    calls: list[tuple[str, str, str]] = []
+
+    def fake_import(uri, import_mode, import_content, date_format, **kwargs):
+        calls.append((import_mode, import_content, date_format))
+        return ImportResult(make_import_result_xml(import_content.count("\n") - 1))
+
+    monkeypatch.setattr(client, "importData_v1a", fake_import)
+
+    frame = client.export_to_dataframe("select * from Animals", engine=engine, schema=TYPED_EXPORT_SCHEMA)
+    columns = frame.to_pydict() if engine == "arrow" else {name: frame[name].tolist() for name in frame.columns}
+    result = client.upload_dataframe(frame, "Animals", import_mode="TRUNCATEADD", chunk_row_count=1)
+
+    assert columns["name"] == ["Rabbit", "NA"]
+    assert columns["legs"][0] == 4 and columns["weight"] == [1250.5, 2.0]
+    assert columns["born"] == [datetime.datetime(2021, 3, 4, 5, 6, 7), datetime.datetime(2020, 1, 12)]
+    assert columns["tame"][0] is True
+    assert [(mode, date_format) for mode, _, date_format in calls] == [
+        ("TRUNCATEADD", "yyyy-MM-dd HH:mm:ss"),
+        ("APPEND", "yyyy-MM-dd HH:mm:ss"),
+    ]
+    assert all(content.splitlines()[0].replace('"', "") == "name,legs,weight,born,tame" for _, content, _ in calls)
+    assert "2021-03-04 05:06:07" in calls[0][1]
+    assert result.successRowCount == 2
+
+
+@pytest.mark.parametrize("engine,library", [("pandas", "pandas"), ("arrow", "pyarrow")])
+def test_dataframe_export_parses_formatted_numbers_like_typed_export(monkeypatch, engine, library) -> None:
+    pytest.importorskip(library)
+    client = get_offline_enhanced_client()
+    exported_csv = 'name,legs,weight\r\nRabbit,"1,204","$1,250.50"\r\nSnake,0,\r\n'
+    monkeypatch.setattr(client, "exportDataUsingSQL_v2", lambda **kwargs: io.BytesIO(exported_csv.encode()))
+
+    frame = client.export_to_dataframe("select * from Animals", engine=engine, schema=TYPED_EXPORT_SCHEMA)
+    typed = client.data_export_typed("select * from Animals", table_name="Animals", schema=TYPED_EXPORT_SCHEMA)
+    columns = frame.to_pydict() if engine == "arrow" else {name: frame[name].tolist() for name in frame.columns}
+
+    assert columns["legs"] == list(typed["legs"]) == [1204, 0]
+    assert columns["weight"][0] == typed["weight"][0] == 1250.5
+    assert columns["weight"][1] is None or math.isnan(columns["weight"][1])
+
+
+def test_partition_ranges_are_disjoint_and_open_ended() -> None:
+    assert partitioning.split_points(1, 10, 4) == [3, 6, 8]
+    assert partitioning.split_points(5, 6, 4) == [6]
+    assert partitioning.split_points(7, 7, 4) == []
+    low, high = datetime.datetime(2024, 1, 1), datetime.datetime(2024, 1, 3)
+    assert partitioning.split_points(low, high, 2) == [datetime.datetime(2024, 1, 2)]
+    assert partitioning.parse_partition_value("2024-01-02 00:00:00") == datetime.datetime(2024, 1, 2)
+    assert partitioning.parse_partition_value("1,234.5") == 1234.5
+    assert partitioning.parse_partition_value("$1,234") == 1234
+    for text in ("rabbit", "05 Jan, 2024", "2024/01/05"):
+        with pytest.raises(ValueError):
+            partitioning.parse_partition_value(text)
+    with pytest.raises(ValueError):
+        columnar.parse_number("05 Jan, 2024")
+    assert partitioning.parse_partition_value("05 Jan 2024", {"dataType": "DATE"}) == datetime.datetime(2024, 1, 5)
+    assert partitioning.parse_partition_value("1,204", {"dataType": "AUTO_NUMBER"}) == 1204
+    with pytest.raises(ValueError):
+        partitioning.parse_partition_value("2024-01-05", {"dataType": "NUMBER"})
+
+    sqls = partitioning.partition_sqls("select * from sales;", "id", [3, 6])
+
+    assert [sql.split(" WHERE ")[1] for sql in sqls] == [
+        '"id" < 3',
+        '"id" >= 3 AND "id" < 6',
+        '"id" >= 6',
+        '"id" IS NULL',
+    ]
+    assert sqls[0].startswith("SELECT * FROM (select * from sales) AS partition_source WHERE ")
+
+
+def test_partitioned_export_runs_ranges_concurrently_and_keeps_their_order(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = get_offline_enhanced_client()
+    running = 0
+    max_running = 0
+    lock = threading.Lock()
+    ids = list(range(1, 21))
+
+    started = 0
+
+    def fake_export(tableOrReportURI, format, sql, retry_countdown):
+        nonlocal running, max_running, started
+        if "MIN(" in sql:
+            return io.BytesIO(b"low,high,row_count\r\n1,20,20\r\n")
+        with lock:
+            started += 1
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.05)
+        condition = sql.split(" WHERE ")[1]
+        lower = int(condition.split(">= ")[1].split()[0]) if ">=" in condition else 0
+        upper = int(condition.split("< ")[1]) if "<" in condition else 100
+        rows = [] if "NULL" in condition else [i for i in ids if lower <= i < upper]
+        with lock:
+            running -= 1
+        return io.BytesIO(("id\r\n" + "".join(f"{i}\r\n" for i in reversed(rows))).encode())
+
+    monkeypatch.setattr(client, "exportDataUsingSQL_v2", fake_export)
+
+    rows = client.data_export_partitioned(
+        "select id from sales", "sales", partition_column="id", partitions=10, max_workers=2
+    )
+    first_row = next(rows)
+    time.sleep(0.2)  # the window refills, but only up to max_workers ranges ahead
+
+    assert started == 3
+    rows = [first_row, *rows]
+    assert sorted(int(row["id"]) for row in rows) == ids
+    assert [int(row["id"]) for row in rows][:2] == [2, 1]  # the first range comes first
+    assert max_running == 2
+    assert started == 11  # ten ranges, and the nulls
+
+
 def test_create_tables(enhanced_zoho_analytics_client):
     # is the table already defined?
     try:
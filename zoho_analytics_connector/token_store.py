@@ -0,0 +1,99 @@
+"""Access token persistence which can be shared by all the processes on a host.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import tempfile
+from typing import Iterator, Optional, TypedDict
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+class TokenData(TypedDict, total=False):
+    access_token: str
+    token_timestamp: float  # when the token was fetched, time.time()
+    expires_at: Optional[float]  # from the expires_in of the IAM response, None if it was not given
+    token_key: str  # the account the token belongs to, see ReportClient.make_token_key
+
+
+class TokenStore:
+    """Base class for token persistence, which stores nothing.
+    ReportClient refreshes tokens inside lock(), and first checks load() for a token refreshed by another
+    process, so a store with a real lock means one IAM refresh serves every process sharing the store."""
+
+    def load(self) -> Optional[TokenData]:
+        return None
+
+    def save(self, token_data: TokenData):
+        pass
+
+    @contextlib.contextmanager
+    def lock(self) -> Iterator[None]:
+        yield
+
+
+class FileTokenStore(TokenStore):
+    """Stores the token as JSON in a file. Writes are atomic (a temporary file is renamed over the old one)
+    and lock() takes an exclusive fcntl lock on a sidecar .lock file, so processes don't overwrite each
+    other's tokens or refresh at the same time. Without fcntl (Windows) lock() does not lock.
+    A read_only store loads tokens but never writes or locks."""
+
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.read_only = read_only
+
+    def load(self) -> Optional[TokenData]:
+        try:
+            with open(self.path, "r") as in_file:
+                token_data = json.load(in_file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error("Error loading the token from %s: %s", self.path, e)
+            return None
+        logger.debug("Access token loaded from %s", self.path)
+        return token_data
+
+    def save(self, token_data: TokenData):
+        if self.read_only:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        temporary_path = None
+        try:
+            with tempfile.NamedTemporaryFile("w", dir=directory, prefix=".token-", delete=False) as out_file:
+                temporary_path = out_file.name
+                json.dump(token_data, out_file)
+                out_file.flush()
+                os.fsync(out_file.fileno())
+            os.chmod(temporary_path, 0o600)
+            os.replace(temporary_path, self.path)
+            logger.debug("Access token persisted to %s", self.path)
+        except Exception as e:
+            logger.error("Error persisting the token to %s: %s", self.path, e)
+            if temporary_path is not None:
+                with contextlib.suppress(OSError):
+                    os.unlink(temporary_path)
+
+    @contextlib.contextmanager
+    def lock(self) -> Iterator[None]:
+        if self.read_only or fcntl is None:
+            yield
+            return
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
@@ -153,3 +153,27 @@ class ZohoViewsData(TypedDict):
 
 class ZohoViewsResponse(TypedDict):
     data: ZohoViewsData
+
+
+class BulkImportJob(TypedDict):
+    """A file to import into an existing table with the v2 bulk API"""
+
+    table_name: str
+    file_path: str
+    import_type: NotRequired[Literal["append", "truncateadd", "updateadd"]]  # default append
+    file_type: NotRequired[Literal["csv", "json"]]  # default csv
+    auto_identify: NotRequired[bool]  # default True
+    config: NotRequired[dict]  # other import parameters, e.g. matchingColumns or dateFormat
+
+
+class BulkJobResult(TypedDict):
+    """The outcome of one v2 bulk API job"""
+
+    name: str  # the table name of an import, the query name of an export
+    job_id: Optional[str]  # None if the job could not be submitted
+    status: Literal["completed", "failed", "not_found", "timeout", "error"]
+    job_code: Optional[int]  # Zoho's jobCode from the last poll
+    details: dict  # the job details from the last poll
+    error: Optional[str]
+    elapsed_seconds: float
+    output: NotRequired[str]  # where an export was downloaded to